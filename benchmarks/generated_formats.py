@@ -0,0 +1,67 @@
+"""Compare the load time of yaml and json files in generated/
+
+Usage: python benchmarks/generated_formats.py [--hosts 2000]
+"""
+
+import argparse
+import tempfile
+from pathlib import Path
+from timeit import repeat
+
+from invgen.hosts import generate_hosts, get_all_generated_hosts
+
+METADATA = """firewall_rules:
+  - service: ssh
+    state: enabled
+  - service: https
+    state: enabled
+selinux_state: enforcing
+default_packages: [vim, curl, wget, iotop]
+"""
+
+HOST = """metadata:
+  os: rhel-9
+ansible_host: {name}
+password: !vault |
+  $ANSIBLE_VAULT;1.1;AES256
+  663736303132
+network_interfaces:
+  - name: eth0
+    ip: 192.168.1.{index}
+    dns: [8.8.8.8, 8.8.4.4]
+"""
+
+
+def build_source(root: Path, hosts: int) -> None:
+    (root / "metadata" / "os").mkdir(parents=True)
+    (root / "metadata" / "os" / "rhel-9.yaml").write_text(METADATA)
+    (root / "hosts").mkdir()
+    for i in range(hosts):
+        name = f"host{i:05d}"
+        (root / "hosts" / f"{name}.yaml").write_text(HOST.format(name=name, index=i % 255))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--hosts", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir) / "source"
+        build_source(source, args.hosts)
+
+        results = {}
+        for format in ("yaml", "json"):
+            output = Path(tmpdir) / format
+            generate_hosts(source, output, format=format)
+            results[format] = min(
+                repeat(lambda: get_all_generated_hosts(output), number=1, repeat=args.repeat)
+            )
+            print(f"{format}: loaded {args.hosts} hosts in {results[format]:.3f}s")
+
+        print(f"json is {results['yaml'] / results['json']:.1f}x faster to load")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Compare building the Ansible inventory in-process with the script inventory
+
+The inventory plugin builds the inventory inside the Ansible process. The
+script inventory serializes it as json in a subprocess, which Ansible parses
+again. Both are timed on the same generated directory, with and without the
+subprocess. Vault values are converted by Ansible's loader in the plugin,
+which is not timed here.
+
+Usage: python benchmarks/inventory_plugin.py [--hosts 1000 4000]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from timeit import repeat
+
+from invgen.hosts import generate_hosts, get_all_generated_hosts
+from invgen.inventory import AnsibleInventory
+
+METADATA = """firewall_rules:
+  - service: ssh
+    state: enabled
+  - service: https
+    state: enabled
+selinux_state: enforcing
+default_packages: [vim, curl, wget, iotop]
+"""
+
+HOST = """metadata:
+  os: rhel-9
+  env: {env}
+ansible_host: 192.168.{subnet}.{index}
+network_interfaces:
+  - name: eth0
+    dns: [8.8.8.8, 8.8.4.4]
+"""
+
+
+def build_source(root: Path, hosts: int) -> None:
+    (root / "metadata" / "os").mkdir(parents=True)
+    (root / "metadata" / "env").mkdir()
+    (root / "metadata" / "os" / "rhel-9.yaml").write_text(METADATA)
+    for env in ("prod", "staging"):
+        (root / "metadata" / "env" / f"{env}.yaml").write_text(f"tier: {env}\n")
+    (root / "hosts").mkdir()
+    for i in range(hosts):
+        (root / "hosts" / f"host{i:05d}.yaml").write_text(
+            HOST.format(env=("prod", "staging")[i % 2], subnet=i // 256, index=i % 256)
+        )
+
+
+def in_process(source: Path) -> dict:
+    return AnsibleInventory(get_all_generated_hosts(source)).build()
+
+
+def json_round_trip(source: Path) -> dict:
+    return json.loads(AnsibleInventory(get_all_generated_hosts(source)).render())
+
+
+def script(source: Path) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-m", "invgen.inventory", "--list", "--source", str(source)],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--hosts", type=int, nargs="+", default=[1000, 4000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'hosts':>6} {'in-process':>10} {'json':>9} {'script':>9}")
+    for hosts in args.hosts:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = Path(tmpdir)
+            build_source(source, hosts)
+            generate_hosts(source)
+            # The order of `all` differs between processes
+            assert in_process(source)["_meta"] == script(source)["_meta"]
+
+            times = [
+                min(repeat(lambda: build(source), number=1, repeat=args.repeat))
+                for build in (in_process, json_round_trip, script)
+            ]
+            print(
+                f"{hosts:>6} {times[0]:>9.3f}s {times[1]:>8.3f}s {times[2]:>8.3f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
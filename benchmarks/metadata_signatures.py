@@ -0,0 +1,94 @@
+"""Measure how merging scales with hosts and distinct metadata combinations
+
+Each host uses one of `--signatures` combinations of metadata values, each
+metadata value has `--vars` vars. The merge of all hosts is timed with the
+merged metadata shared per combination and, for comparison, merged again for
+every host.
+
+Usage: python benchmarks/metadata_signatures.py [--hosts 2000 4000 8000]
+"""
+
+import argparse
+import tempfile
+from pathlib import Path
+from timeit import repeat
+
+from invgen.hosts import (
+    build_host_vars,
+    generate_hosts,
+    get_all_host_files,
+    iter_host_entries,
+)
+from invgen.metadata import MetadataVars, build_metadata_vars
+
+TYPES = ("os", "env", "site")
+
+
+def build_source(root: Path, hosts: int, signatures: int, vars: int) -> None:
+    for metadata_type in TYPES:
+        (root / "metadata" / metadata_type).mkdir(parents=True)
+        for i in range(signatures):
+            lines = [f"{metadata_type}_var{j}: [{i}, {j}, value-{j}]" for j in range(vars)]
+            (root / "metadata" / metadata_type / f"v{i}.yaml").write_text(
+                "\n".join(lines) + "\n"
+            )
+    (root / "hosts").mkdir()
+    for i in range(hosts):
+        # Each combination uses the same value of every type
+        value = f"v{i % signatures}"
+        metadata = "".join(f"  {t}: {value}\n" for t in TYPES)
+        (root / "hosts" / f"host{i:05d}.yaml").write_text(
+            f"metadata:\n{metadata}ansible_host: 10.0.{i // 256 % 256}.{i % 256}\n"
+        )
+
+
+def merge_all(source: Path, metadata: MetadataVars, shared: bool) -> None:
+    for host_file in get_all_host_files(source):
+        for entry in iter_host_entries(host_file, source):
+            if not shared:
+                metadata._layers.clear()
+            build_host_vars(entry, metadata)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--hosts", type=int, nargs="+", default=[2000, 4000, 8000])
+    parser.add_argument("--signatures", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--vars", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'hosts':>6} {'signatures':>10} {'shared':>9} {'per host':>9} {'generate':>9}")
+    for signatures in args.signatures:
+        for hosts in args.hosts:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                source = Path(tmpdir) / "source"
+                build_source(source, hosts, signatures, args.vars)
+                metadata = build_metadata_vars(source)
+                # Parse all files once, only the merge is timed
+                merge_all(source, metadata, shared=True)
+
+                times = {}
+                for shared in (True, False):
+                    times[shared] = min(
+                        repeat(
+                            lambda: merge_all(source, build_metadata_vars(source), shared),
+                            number=1,
+                            repeat=args.repeat,
+                        )
+                    )
+                generate = min(
+                    repeat(
+                        lambda: generate_hosts(source, Path(tmpdir) / "output"),
+                        number=1,
+                        repeat=1,
+                    )
+                )
+                print(
+                    f"{hosts:>6} {signatures:>10} {times[True]:>8.3f}s "
+                    f"{times[False]:>8.3f}s {generate:>8.3f}s"
+                )
+
+
+if __name__ == "__main__":
+    main()
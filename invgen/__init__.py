@@ -0,0 +1,14 @@
+from invgen.api import Host, Inventory, memory_source, write_jsonl
+from invgen.hosts import GenerateStats, generate_hosts, iter_generated_hosts
+from invgen.inventory import Group
+
+__all__ = [
+    "GenerateStats",
+    "Group",
+    "Host",
+    "Inventory",
+    "generate_hosts",
+    "iter_generated_hosts",
+    "memory_source",
+    "write_jsonl",
+]
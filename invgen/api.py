@@ -0,0 +1,257 @@
+import os
+from collections import defaultdict
+from collections.abc import Iterable, Iterator, Mapping
+from dataclasses import dataclass
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import IO, Any
+
+import yaml
+
+from invgen.archive import Archive, ArchivePath, SourcePath, open_source
+from invgen.files import SafeDumper, dump_json
+from invgen.hosts import (
+    GenerateStats,
+    GeneratedHost,
+    HostEntry,
+    build_host_vars,
+    generate_hosts,
+    get_all_host_files,
+    iter_host_entries,
+    matches_where,
+    parse_where,
+)
+from invgen.inventory import (
+    AnsibleInventory,
+    Group,
+    get_group_names,
+    select_hosts,
+)
+from invgen.metadata import MetadataVars, build_metadata_vars
+from invgen.rules import RuleSet, load_rules
+
+Source = SourcePath | str | os.PathLike
+
+
+@dataclass
+class Host:
+    """A host with its merged vars
+
+    `provenance` maps each var to the layers that defined it, the layer
+    whose value is kept first, if it was requested.
+    """
+
+    name: str
+    vars: dict[str, Any]
+    file: SourcePath
+    provenance: dict[str, list[str]] | None = None
+
+    @property
+    def metadata(self) -> dict[str, Any]:
+        return self.vars.get("metadata") or {}
+
+    def to_json(self) -> str:
+        """Serialize the host as one line of json"""
+        record: dict[str, Any] = {"name": self.name, "vars": self.vars}
+        if self.provenance is not None:
+            record["provenance"] = self.provenance
+        return dump_json(record)
+
+
+def memory_source(files: Mapping[str, Any], name: str = "memory") -> ArchivePath:
+    """Build a source root from file contents keyed by their relative path
+
+    Values are yaml text, bytes, or data that is dumped as yaml, e.g.
+    `{"hosts/web1.yaml": {"metadata": {"os": "rhel-9"}}}`.
+    """
+    members = {}
+    for path, content in files.items():
+        if isinstance(content, str):
+            content = content.encode()
+        elif not isinstance(content, bytes):
+            content = yaml.dump(content, Dumper=SafeDumper, sort_keys=False).encode()
+        members[path.strip("/")] = content
+    return Archive(Path(f"<{name}>"), members).root
+
+
+class Inventory:
+    """An inventory built from one or more source roots
+
+    Sources are directories, archives, or in-memory roots from
+    `memory_source`. Later sources override hosts and metadata of earlier
+    ones, like `invgen generate -s a -s b`.
+
+    Hosts are merged one at a time while iterating, nothing is written to
+    disk. The metadata index, the rules and the host file declaring each
+    host are loaded on first use and kept, call `refresh` to pick up added
+    or removed files, renamed hosts and changed rules.
+    Parsed files, including `!include` targets, are shared by all
+    inventories of a process and reused while they are unchanged.
+    """
+
+    def __init__(self, *sources: Source, render_vars: bool = False):
+        if not sources:
+            raise ValueError("An inventory needs at least one source")
+        self.roots: list[SourcePath] = [
+            s if isinstance(s, ArchivePath) else open_source(Path(s)) for s in sources
+        ]
+        self.render_vars = render_vars
+        self._metadata: MetadataVars | None = None
+        self._rules: RuleSet | None = None
+        self._files: dict[SourcePath, SourcePath] = {}
+        self._owners: dict[str, SourcePath] | None = None
+
+    @classmethod
+    def from_files(cls, files: Mapping[str, Any], **options) -> "Inventory":
+        """Build an inventory from in-memory files, see `memory_source`"""
+        return cls(memory_source(files), **options)
+
+    @property
+    def metadata(self) -> MetadataVars:
+        if self._metadata is None:
+            self._metadata = build_metadata_vars(self.roots)
+        return self._metadata
+
+    @property
+    def rules(self) -> RuleSet:
+        if self._rules is None:
+            self._rules = load_rules(self.roots)
+        return self._rules
+
+    def _index(self) -> tuple[dict[SourcePath, SourcePath], dict[str, SourcePath]]:
+        """Return the root of each host file and the host file of each host
+
+        Files are in the order of their roots, a host declared again by a
+        later file belongs to that file.
+        """
+        if self._owners is None:
+            files: dict[SourcePath, SourcePath] = {}
+            owners: dict[str, SourcePath] = {}
+            for root in self.roots:
+                for host_file in get_all_host_files(root):
+                    files[host_file] = root
+                    for entry in iter_host_entries(host_file, root):
+                        owners[entry.name] = host_file
+            self._files, self._owners = files, owners
+        return self._files, self._owners
+
+    def refresh(self) -> None:
+        """Forget the metadata index, the rules and the host files, e.g. after
+        files changed"""
+        self._metadata = None
+        self._rules = None
+        self._owners = None
+
+    def _file_entries(self, host_file: SourcePath) -> Iterator[HostEntry]:
+        """Yield the entries of a host file that are not overridden"""
+        files, owners = self._index()
+        for entry in iter_host_entries(host_file, files[host_file], self.rules):
+            if owners.get(entry.name) == host_file:
+                yield entry
+
+    def _entries(self) -> Iterator[tuple[SourcePath, HostEntry]]:
+        """Yield (root, entry) of each host, hosts of later sources win"""
+        files, owners = self._index()
+        owning = set(owners.values())
+        for host_file in files:
+            if host_file in owning:
+                for entry in self._file_entries(host_file):
+                    yield files[host_file], entry
+
+    def _groups(self) -> tuple[dict[str, list[str]], list[str]]:
+        groups: dict[str, list[str]] = defaultdict(list)
+        names = []
+        for _, entry in self._entries():
+            names.append(entry.name)
+            for group in get_group_names(entry.vars.get("metadata")):
+                groups[group].append(entry.name)
+        return groups, names
+
+    def host_names(self, limit: str = "") -> list[str]:
+        """Return the names of all hosts, or those matching an Ansible --limit"""
+        groups, names = self._groups()
+        return select_hosts(limit, groups, names) if limit else names
+
+    def iter_hosts(
+        self,
+        limit: str = "",
+        only: list[str] | None = None,
+        where: list[str] | None = None,
+        provenance: bool = False,
+    ) -> Iterator[Host]:
+        """Yield each host with its merged vars as soon as it is merged
+
+        Hosts can be selected with an Ansible --limit pattern and with `only`
+        and `where` like `invgen generate`.
+        """
+        selected = set(self.host_names(limit)) if limit else None
+        conditions = parse_where(where or [])
+        for _, entry in self._entries():
+            if selected is not None and entry.name not in selected:
+                continue
+            if only and not any(fnmatch(entry.name, p) for p in only):
+                continue
+            if conditions and not matches_where(
+                entry.vars.get("metadata") or {}, conditions
+            ):
+                continue
+            yield self._host(entry, provenance)
+
+    def _host(self, entry: HostEntry, provenance: bool = False) -> Host:
+        struct = build_host_vars(entry, self.metadata, render_vars=self.render_vars)
+        return Host(
+            entry.name,
+            {k: v.value for k, v in struct.items()},
+            entry.file,
+            {k: v.history[::-1] for k, v in struct.items()} if provenance else None,
+        )
+
+    def get_host(self, name: str) -> Host:
+        """Return a host with its merged vars
+
+        raises KeyError for unknown hosts
+        """
+        _, owners = self._index()
+        if name not in owners:
+            raise KeyError(name)
+        for entry in self._file_entries(owners[name]):
+            if entry.name == name:
+                return self._host(entry)
+        # The host was removed from its file since the owners were loaded
+        raise KeyError(name)
+
+    def iter_groups(self, limit: str = "") -> Iterator[Group]:
+        """Yield the `<type>_<value>` groups and their hosts"""
+        groups, names = self._groups()
+        if limit:
+            selected = set(select_hosts(limit, groups, names))
+            groups = {k: [h for h in v if h in selected] for k, v in groups.items()}
+        for name, hosts in groups.items():
+            if hosts:
+                yield Group(name=name, hosts=hosts)
+
+    def to_ansible(self, limit: str = "", group_vars: bool = False) -> dict[str, Any]:
+        """Return the inventory as `invgen-ansible --list` would, without json"""
+        hosts = [GeneratedHost(h.name, h.vars) for h in self.iter_hosts(limit)]
+        return AnsibleInventory(hosts, self.metadata if group_vars else None).build()
+
+    def generate(self, output_dir: Path | None = None, **options) -> GenerateStats:
+        """Write the generated host files, see `generate_hosts`"""
+        options.setdefault("render_vars", self.render_vars)
+        return generate_hosts(
+            self.roots if len(self.roots) > 1 else self.roots[0], output_dir, **options
+        )
+
+
+def write_jsonl(hosts: Iterable[Host], stream: IO[str]) -> int:
+    """Write one json line per host, flushing each one, returns the count
+
+    Each host is merged only after the previous one was written, so a slow
+    reader holds back the merge and memory stays bounded.
+    """
+    count = 0
+    for host in hosts:
+        stream.write(host.to_json() + "\n")
+        stream.flush()
+        count += 1
+    return count
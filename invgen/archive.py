@@ -0,0 +1,208 @@
+import fnmatch
+import itertools
+import sys
+import tarfile
+import zipfile
+from pathlib import Path, PurePosixPath
+
+from invgen.logging import logger
+
+ARCHIVE_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.zst", ".zip")
+SOURCE_DIRS = ("hosts", "metadata", "generated")
+
+
+_tokens = itertools.count()
+
+
+def is_archive(path: Path) -> bool:
+    """Check if a source path points to a supported archive file"""
+    return path.is_file() and path.name.endswith(ARCHIVE_SUFFIXES)
+
+
+class Archive:
+    """In-memory view of an inventory source packed as tar or zip.
+
+    All members are read in one sequential pass when the archive is opened,
+    nothing is extracted to disk. `token` identifies this view for the
+    lifetime of the process, `from_file` is set if it was read from `path`.
+    """
+
+    def __init__(self, path: Path, members: dict[str, bytes], from_file: bool = False):
+        self.path = path
+        self.members = members
+        self.from_file = from_file
+        self.token = next(_tokens)
+        self.dirs: set[str] = {""}
+        for name in members:
+            parent = PurePosixPath(name).parent
+            while str(parent) != ".":
+                self.dirs.add(str(parent))
+                parent = parent.parent
+
+    @classmethod
+    def read(cls, path: Path) -> "Archive":
+        logger.info(f"Reading archive {path}")
+        if path.name.endswith(".zip"):
+            members = _read_zip(path)
+        else:
+            members = _read_tar(path)
+        return cls(path, _strip_common_prefix(members), from_file=True)
+
+    @property
+    def root(self) -> "ArchivePath":
+        return ArchivePath(self, "")
+
+
+def _read_zip(path: Path) -> dict[str, bytes]:
+    members = {}
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if not info.is_dir():
+                members[_normalize(info.filename)] = archive.read(info)
+    return members
+
+
+def _read_tar(path: Path) -> dict[str, bytes]:
+    if path.name.endswith(".tar.zst") and sys.version_info < (3, 14):
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError(
+                f"Reading {path.name} requires the zstandard package "
+                '(pip install "invgen[zstd]")'
+            )
+        with open(path, "rb") as f:
+            with zstandard.ZstdDecompressor().stream_reader(f) as reader:
+                with tarfile.open(fileobj=reader, mode="r|") as archive:
+                    return _read_tar_members(archive)
+
+    # Stream mode reads the archive front to back without seeking
+    with tarfile.open(path, mode="r|*") as archive:
+        return _read_tar_members(archive)
+
+
+def _read_tar_members(archive: tarfile.TarFile) -> dict[str, bytes]:
+    members = {}
+    for member in archive:
+        if member.isfile():
+            f = archive.extractfile(member)
+            if f is not None:
+                members[_normalize(member.name)] = f.read()
+    return members
+
+
+def _normalize(name: str) -> str:
+    return str(PurePosixPath(name.lstrip("/").removeprefix("./")))
+
+
+def _strip_common_prefix(members: dict[str, bytes]) -> dict[str, bytes]:
+    """Strip a single wrapping directory, e.g. `inventory/hosts/...`"""
+    top_level = {name.split("/", 1)[0] for name in members}
+    if len(top_level) != 1 or top_level & set(SOURCE_DIRS):
+        return members
+
+    prefix = f"{top_level.pop()}/"
+    if not all(name.startswith(prefix) for name in members):
+        return members
+    return {name.removeprefix(prefix): content for name, content in members.items()}
+
+
+class ArchivePath:
+    """Read-only subset of the `pathlib.Path` interface for archive members"""
+
+    def __init__(self, archive: Archive, member: str):
+        self.archive = archive
+        self.member = member
+
+    def _child(self, member: str) -> "ArchivePath":
+        return ArchivePath(self.archive, member)
+
+    @property
+    def name(self) -> str:
+        return PurePosixPath(self.member).name
+
+    @property
+    def stem(self) -> str:
+        return PurePosixPath(self.member).stem
+
+    @property
+    def suffix(self) -> str:
+        return PurePosixPath(self.member).suffix
+
+    @property
+    def parent(self) -> "ArchivePath":
+        parent = str(PurePosixPath(self.member).parent)
+        return self._child("" if parent == "." else parent)
+
+    def joinpath(self, *parts: str) -> "ArchivePath":
+        joined = PurePosixPath(self.member, *parts)
+        return self._child(_normalize(str(joined)) if str(joined) != "." else "")
+
+    def __truediv__(self, part: str) -> "ArchivePath":
+        return self.joinpath(part)
+
+    def exists(self) -> bool:
+        return self.is_file() or self.is_dir()
+
+    def is_file(self) -> bool:
+        return self.member in self.archive.members
+
+    def is_dir(self) -> bool:
+        return self.member in self.archive.dirs
+
+    def iterdir(self):
+        if not self.is_dir():
+            raise NotADirectoryError(str(self))
+        prefix = f"{self.member}/" if self.member else ""
+        children = set()
+        for name in list(self.archive.members) + list(self.archive.dirs):
+            if name and name.startswith(prefix):
+                children.add(name[len(prefix) :].split("/", 1)[0])
+        for child in sorted(children):
+            yield self._child(f"{prefix}{child}")
+
+    def rglob(self, pattern: str):
+        prefix = f"{self.member}/" if self.member else ""
+        for name in sorted(self.archive.members):
+            if name.startswith(prefix) and fnmatch.fnmatch(
+                PurePosixPath(name).name, pattern
+            ):
+                yield self._child(name)
+
+    def read_bytes(self) -> bytes:
+        try:
+            return self.archive.members[self.member]
+        except KeyError:
+            raise FileNotFoundError(str(self))
+
+    def read_text(self, encoding: str = "utf-8") -> str:
+        return self.read_bytes().decode(encoding)
+
+    def __str__(self) -> str:
+        if not self.member:
+            return str(self.archive.path)
+        return f"{self.archive.path}/{self.member}"
+
+    def __repr__(self) -> str:
+        return f"ArchivePath({str(self)!r})"
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ArchivePath):
+            return NotImplemented
+        return self.archive is other.archive and self.member == other.member
+
+    def __hash__(self) -> int:
+        return hash((id(self.archive), self.member))
+
+    def __lt__(self, other: "ArchivePath") -> bool:
+        return self.member < other.member
+
+
+SourcePath = Path | ArchivePath
+
+
+def open_source(source: Path) -> SourcePath:
+    """Return a readable root for a source directory or archive"""
+    if is_archive(source):
+        return Archive.read(source).root
+    return source
@@ -0,0 +1,333 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any
+
+from invgen.archive import ArchivePath, SourcePath
+from invgen.logging import logger
+from invgen.tables import TABLE_SUFFIXES
+
+CACHE_DIR = ".invgen"
+BUILD_CACHE_VERSION = 4
+
+
+def fingerprint(path: SourcePath) -> list[int] | None:
+    """Return [mtime_ns, size] of a file, or None if it doesn't exist
+
+    Archive members share the fingerprint of their archive.
+    """
+    target = path.archive.path if isinstance(path, ArchivePath) else path
+    try:
+        stat = target.stat()
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def source_key(root: SourcePath) -> str:
+    """Stable file name for the cache of a source root"""
+    path = root.archive.path if isinstance(root, ArchivePath) else root
+    resolved = str(path.resolve())
+    digest = hashlib.sha1(resolved.encode()).hexdigest()[:12]
+    return f"{path.name or 'root'}-{digest}"
+
+
+class BuildCache:
+    """Persisted generation state of the host files of one source root.
+
+    Each host file records its own fingerprint, the metadata of its hosts,
+    the metadata files they resolved to, the files included by either, the
+    generated files it produced and the sources of the vars of its hosts.
+    A host file whose dependencies are unchanged is skipped without parsing it.
+    """
+
+    def __init__(self, path: Path, options: dict[str, Any]):
+        self.path = path
+        self.options = options
+        self.files: dict[str, dict[str, Any]] = {}
+        self.seen: set[str] = set()
+
+    @classmethod
+    def load(
+        cls, root: SourcePath, output_dir: Path, options: dict[str, Any]
+    ) -> "BuildCache":
+        path = output_dir.joinpath(CACHE_DIR, "build", f"{source_key(root)}.json")
+        cache = cls(path, options)
+        try:
+            data = json.loads(path.read_text())
+        except FileNotFoundError:
+            return cache
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable build cache {path}: {e}")
+            return cache
+
+        if (
+            data.get("version") == BUILD_CACHE_VERSION
+            and data.get("options") == options
+        ):
+            cache.files = data.get("files", {})
+        return cache
+
+    def keep(self, host_file: SourcePath) -> None:
+        """Keep the entry of a host file that wasn't generated in this run"""
+        self.seen.add(str(host_file))
+
+    def _unchanged(self, host_file: SourcePath) -> dict[str, Any] | None:
+        """Return the entry of a host file if it and its includes are unchanged"""
+        entry = self.files.get(str(host_file))
+        # Files without a fingerprint, e.g. in-memory sources, are never fresh
+        if (
+            entry is None
+            or entry["fingerprint"] is None
+            or entry["fingerprint"] != fingerprint(host_file)
+        ):
+            return None
+        for include, include_fingerprint in entry["includes"].items():
+            if fingerprint(Path(include)) != include_fingerprint:
+                return None
+        return entry
+
+    def get_hosts(self, host_file: SourcePath) -> dict[str, dict] | None:
+        """Return the hosts of a host file and their metadata if it is unchanged"""
+        entry = self._unchanged(host_file)
+        return None if entry is None else entry["hosts"]
+
+    def get_recorded_hosts(self, host_file: SourcePath) -> dict[str, dict] | None:
+        """Return the hosts of a host file as of its last generation, if recorded"""
+        entry = self.files.get(str(host_file))
+        return None if entry is None else entry["hosts"]
+
+    def get_provenance(self, host_file: SourcePath) -> dict[str, dict] | None:
+        """Return the sources of the vars of each host of a host file, if recorded"""
+        entry = self.files.get(str(host_file))
+        return None if entry is None else entry.get("provenance")
+
+    def get_metadata(self, host_file: SourcePath, host: str) -> dict | None:
+        """Return the cached metadata of a host if its host file is unchanged"""
+        hosts = self.get_hosts(host_file)
+        return None if hosts is None else hosts.get(host)
+
+    def is_fresh(
+        self,
+        host_file: SourcePath,
+        lookup_file,
+        output_dir: Path,
+        outputs: list[str] | None = None,
+    ) -> bool:
+        """Check if the generated output of a host file is up to date
+
+        `lookup_file(metadata_type, value)` returns the file a metadata value
+        currently resolves to. `outputs` are the generated files the host file
+        is expected to produce, e.g. without hosts overridden by another source.
+        """
+        key = str(host_file)
+        self.seen.add(key)
+        entry = self._unchanged(host_file)
+        if entry is None:
+            return False
+        if outputs is not None and set(outputs) != entry["outputs"].keys():
+            return False
+
+        for ref, (file, file_fingerprint) in entry["metadata"].items():
+            metadata_type, value = ref.split("/", 1)
+            current = lookup_file(metadata_type, value)
+            if (None if current is None else str(current)) != file:
+                return False
+            if current is not None and fingerprint(current) != file_fingerprint:
+                return False
+
+        for output, output_fingerprint in entry["outputs"].items():
+            if fingerprint(output_dir.joinpath(output)) != output_fingerprint:
+                return False
+        return True
+
+    def update(
+        self,
+        host_file: SourcePath,
+        hosts: dict[str, dict],
+        metadata_files: dict[str, SourcePath | None],
+        outputs: list[str],
+        output_dir: Path,
+        includes: list[SourcePath] | None = None,
+        provenance: dict[str, dict[str, list[str]]] | None = None,
+    ) -> None:
+        """Record the hosts, dependencies and outputs of a generated host file
+
+        `hosts` maps the name of each host in the file to its metadata,
+        `provenance` maps it to the sources of each of its vars.
+        Included archive members are covered by the fingerprint of the host
+        file, which is the fingerprint of the archive.
+        """
+        key = str(host_file)
+        self.seen.add(key)
+        self.files[key] = {
+            "fingerprint": fingerprint(host_file),
+            "hosts": hosts,
+            "metadata": {
+                ref: [None, None] if file is None else [str(file), fingerprint(file)]
+                for ref, file in metadata_files.items()
+            },
+            "includes": {
+                str(file): fingerprint(file)
+                for file in includes or []
+                if isinstance(file, Path)
+            },
+            "outputs": {
+                output: fingerprint(output_dir.joinpath(output)) for output in outputs
+            },
+            "provenance": provenance or {},
+        }
+
+    def save(self) -> None:
+        """Write the cache, dropping host files that no longer exist"""
+        files = {k: v for k, v in self.files.items() if k in self.seen}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(
+            json.dumps(
+                {
+                    "version": BUILD_CACHE_VERSION,
+                    "options": self.options,
+                    "files": files,
+                }
+            )
+        )
+
+
+HOST_INDEX_VERSION = 1
+
+
+def write_host_index(output_dir: Path, hosts: dict[str, dict[str, Any]]) -> None:
+    """Write the index of generated hosts, mapping names to file and metadata
+
+    The index records the state of the generated directory, it is ignored
+    once files were added or removed without regenerating.
+    """
+    path = output_dir.joinpath(CACHE_DIR, "index.json")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(
+        json.dumps(
+            {
+                "version": HOST_INDEX_VERSION,
+                "generated": fingerprint(output_dir.joinpath("generated")),
+                "hosts": hosts,
+            }
+        )
+    )
+
+
+def load_host_index(
+    base_dir: SourcePath, current: bool = True
+) -> dict[str, dict[str, Any]] | None:
+    """Load the index of generated hosts, None if it is missing or outdated
+
+    With `current=False` an outdated index is returned as well.
+    """
+    path = base_dir.joinpath(CACHE_DIR, "index.json")
+    try:
+        data = json.loads(path.read_text())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable host index {path}: {e}")
+        return None
+
+    if data.get("version") != HOST_INDEX_VERSION:
+        return None
+    if current and data.get("generated") != fingerprint(base_dir.joinpath("generated")):
+        logger.info(f"Host index {path} is outdated")
+        return None
+    return data["hosts"]
+
+
+COMPLETION_INDEX_VERSION = 1
+
+
+def _source_path(root: SourcePath) -> Path:
+    return (root.archive.path if isinstance(root, ArchivePath) else root).absolute()
+
+
+def completion_stamps(
+    roots: list[SourcePath], multi_host_files: list[SourcePath] | None = None
+) -> dict[str, list[int] | None]:
+    """Fingerprint what the host names and metadata values of roots are read from
+
+    These are the directories of hosts and metadata, whose mtime changes when
+    files are added, removed or renamed, metadata tables, and host files that
+    declare hosts not named after the file. Archives are a single file.
+    """
+    stamps: dict[str, list[int] | None] = {}
+    for root in roots:
+        if isinstance(root, ArchivePath):
+            stamps[str(_source_path(root))] = fingerprint(root)
+            continue
+        for name in ("hosts", "metadata"):
+            top = _source_path(root).joinpath(name)
+            stamps[str(top)] = fingerprint(top)
+            for dirpath, dirnames, filenames in os.walk(top):
+                for dirname in dirnames:
+                    stamps[os.path.join(dirpath, dirname)] = fingerprint(
+                        Path(dirpath, dirname)
+                    )
+                if dirpath == str(top) and name == "metadata":
+                    for filename in filenames:
+                        if filename.endswith(TABLE_SUFFIXES):
+                            stamps[os.path.join(dirpath, filename)] = fingerprint(
+                                Path(dirpath, filename)
+                            )
+    for file in multi_host_files or []:
+        if isinstance(file, Path):
+            stamps[str(file.absolute())] = fingerprint(file)
+    return stamps
+
+
+def write_completion_index(
+    output_dir: Path,
+    roots: list[SourcePath],
+    hosts: dict[str, SourcePath],
+    metadata: dict[str, list[str]],
+) -> None:
+    """Write the host names and metadata values used for shell completion
+
+    `hosts` maps each host name to the file declaring it.
+    """
+    path = output_dir.joinpath(CACHE_DIR, "completion.json")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    multi_host_files = {str(f): f for name, f in hosts.items() if name != f.stem}
+    path.write_text(
+        json.dumps(
+            {
+                "version": COMPLETION_INDEX_VERSION,
+                "sources": [str(_source_path(root)) for root in roots],
+                "stamps": completion_stamps(roots, list(multi_host_files.values())),
+                "hosts": sorted(hosts),
+                "metadata": {k: sorted(v) for k, v in sorted(metadata.items())},
+            },
+            separators=(",", ":"),
+        )
+    )
+
+
+def load_completion_index(base_dir: Path) -> dict[str, Any] | None:
+    """Load the completion index, None if it is missing or unreadable
+
+    Check it with `is_completion_index_current` before using it.
+    """
+    path = base_dir.joinpath(CACHE_DIR, "completion.json")
+    try:
+        data = json.loads(path.read_text())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable completion index {path}: {e}")
+        return None
+    if data.get("version") != COMPLETION_INDEX_VERSION:
+        return None
+    return data
+
+
+def is_completion_index_current(index: dict[str, Any]) -> bool:
+    """Check the stamps of the index, without walking any directory"""
+    return all(
+        fingerprint(Path(path)) == stamp for path, stamp in index["stamps"].items()
+    )
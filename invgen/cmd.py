@@ -1,11 +1,33 @@
+import json
+import sys
 import typer
+from click.core import ParameterSource
 from pathlib import Path
 import shutil
 import os
 
+from invgen.api import Inventory, write_jsonl
+from invgen.archive import ArchivePath, open_source
+from invgen.completion import (
+    complete_host,
+    complete_metadata_option,
+    complete_metadata_type,
+)
 from invgen.logging import init_logger, logger
-from invgen.hosts import generate_hosts, get_all_host_files
+from invgen.hosts import (
+    GENERATED_FORMATS,
+    generate_hosts,
+    get_all_host_files,
+    iter_host_entries,
+    parse_where,
+)
+from invgen.export import export_inventory
 from invgen.inventory import inventory_app
+from invgen.metadata import build_metadata_vars
+from invgen.provenance import load_provenance_index
+from invgen.rules import load_rules
+from invgen.stats import collect_stats, render_stats
+from invgen.tables import BUNDLE_SUFFIX, append_to_bundle
 from invgen.templates import render_template
 from invgen.watcher import watch_for_changes
 
@@ -19,13 +41,78 @@ app.add_typer(app_validate, name="validate")
 
 @app.command()
 def generate(
-    source: Path = typer.Option(
-        Path().cwd(), "-s", "--source", envvar="INVGEN_SOURCE", help="Source directory"
+    ctx: typer.Context,
+    source: list[Path] = typer.Option(
+        [Path().cwd()],
+        "-s",
+        "--source",
+        envvar="INVGEN_SOURCE",
+        help="Source directory or .tar, .tar.zst, .zip archive. "
+        + "Can be given multiple times (or separated by ':') to layer sources, "
+        + "later sources override earlier ones.",
+    ),
+    output: Path = typer.Option(
+        None,
+        "-o",
+        "--output",
+        envvar="INVGEN_OUTPUT",
+        help="Output directory, defaults to the source directory",
     ),
     verbose: bool = False,
     debug: bool = False,
     watch: bool = typer.Option(False, "-w", "--watch", help="Watch for changes"),
     clean: bool = typer.Option(False, "-c", "--clean", help="Clean generated directory before generating"),
+    render_vars: bool = typer.Option(
+        False,
+        "--render-vars",
+        help="Resolve self-contained Jinja expressions in vars at generate time",
+    ),
+    format: str = typer.Option(
+        "yaml",
+        "-f",
+        "--format",
+        help="Format of generated files: yaml (with source comments) or json "
+        + "(faster to load, without source comments)",
+    ),
+    only: list[str] = typer.Option(
+        None,
+        "--only",
+        help="Only generate hosts whose name matches this glob. Can be given multiple times.",
+    ),
+    where: list[str] = typer.Option(
+        None,
+        "--where",
+        help="Only generate hosts with matching metadata, e.g. environment=production. "
+        + "Can be given multiple times, all conditions must match.",
+        autocompletion=complete_metadata_option,
+    ),
+    metrics_file: Path = typer.Option(
+        None,
+        "--metrics-file",
+        help="Periodically write Prometheus metrics to this file in watch mode",
+    ),
+    metrics_port: int = typer.Option(
+        None,
+        "--metrics-port",
+        help="Serve Prometheus metrics on this local port in watch mode",
+    ),
+    export: Path = typer.Option(
+        None,
+        "--export",
+        help="Also write a static Ansible inventory to this file, "
+        + "INI for .ini files and yaml otherwise",
+    ),
+    stdout: str = typer.Option(
+        None,
+        "--stdout",
+        help="Stream the merged hosts to stdout instead of writing files, "
+        + "one json line per host (jsonl)",
+    ),
+    provenance: bool = typer.Option(
+        False,
+        "--provenance",
+        help="Include the sources of each var in the records of --stdout",
+    ),
 ):
     if verbose:
         init_logger("INFO")
@@ -34,19 +121,285 @@ def generate(
     else:
         init_logger()
 
+    data_dirs = [open_source(s) for s in source]
+    if stdout is not None:
+        if watch or export is not None or clean:
+            typer.echo(
+                typer.style(
+                    "=> Error: --stdout can't be combined with --watch, --export "
+                    + "or --clean",
+                    fg=typer.colors.RED,
+                ),
+                err=True,
+            )
+            raise typer.Exit(1)
+        for name, option in (("format", "--format"), ("output", "--output")):
+            if ctx.get_parameter_source(name) != ParameterSource.DEFAULT:
+                raise typer.BadParameter(
+                    "can't be combined with --stdout, which writes jsonl to stdout",
+                    param_hint=f"'{option}'",
+                )
+        _stream_hosts(data_dirs, stdout, render_vars, only, where, provenance)
+        return
+
+    has_archive = any(isinstance(d, ArchivePath) for d in data_dirs)
+    if output is None and (has_archive or len(data_dirs) > 1):
+        typer.echo(
+            typer.style(
+                "=> Error: --output is required when the source is an archive "
+                + "or multiple sources are given",
+                fg=typer.colors.RED,
+            )
+        )
+        raise typer.Exit(1)
+    output_dir = output or source[0]
+
+    if watch and has_archive:
+        typer.echo(
+            typer.style("=> Error: Cannot watch an archive source", fg=typer.colors.RED)
+        )
+        raise typer.Exit(1)
+
+    if format not in GENERATED_FORMATS:
+        typer.echo(
+            typer.style(
+                f"=> Error: Invalid format {format}, expected one of "
+                + ", ".join(GENERATED_FORMATS),
+                fg=typer.colors.RED,
+            )
+        )
+        raise typer.Exit(1)
+
+    try:
+        parse_where(where or [])
+    except ValueError as e:
+        typer.echo(typer.style(f"=> Error: {e}", fg=typer.colors.RED))
+        raise typer.Exit(1)
+
     if clean:
-        generated_dir = source.joinpath("generated/")
+        generated_dir = output_dir.joinpath("generated/")
         if generated_dir.exists():
             typer.echo(f"=> Cleaning {generated_dir}")
             shutil.rmtree(generated_dir)
             os.makedirs(generated_dir)
 
-    typer.echo(f"=> Generating hosts from {source}/hosts/")
-    generate_hosts(source)
-    typer.echo(f"=> Done! Generated hosts in {source}/generated/")
+    for data_dir in data_dirs:
+        typer.echo(f"=> Generating hosts from {data_dir}/hosts/")
+    try:
+        generate_hosts(
+            data_dirs,
+            output_dir,
+            render_vars=render_vars,
+            format=format,
+            only=only,
+            where=where,
+        )
+    except ValueError as e:
+        typer.echo(typer.style(f"=> Error: {e}", fg=typer.colors.RED))
+        raise typer.Exit(1)
+    typer.echo(f"=> Done! Generated hosts in {output_dir}/generated/")
+    if export is not None:
+        try:
+            export_inventory(output_dir, export)
+        except ValueError as e:
+            typer.echo(typer.style(f"=> Error: {e}", fg=typer.colors.RED))
+            raise typer.Exit(1)
+        typer.echo(f"=> Exported inventory to {export}")
 
     if watch:
-        watch_for_changes(source)
+        watch_for_changes(
+            source,
+            output,
+            metrics_file=metrics_file,
+            metrics_port=metrics_port,
+            export=export,
+            render_vars=render_vars,
+            format=format,
+            only=only,
+            where=where,
+        )
+
+
+def _stream_hosts(
+    data_dirs: list,
+    format: str,
+    render_vars: bool,
+    only: list[str] | None,
+    where: list[str] | None,
+    provenance: bool,
+) -> None:
+    """Write the merged hosts to stdout, messages go to stderr"""
+    if format != "jsonl":
+        typer.echo(
+            typer.style(
+                f"=> Error: Invalid stdout format {format}, expected jsonl",
+                fg=typer.colors.RED,
+            ),
+            err=True,
+        )
+        raise typer.Exit(1)
+
+    inventory = Inventory(*data_dirs, render_vars=render_vars)
+    hosts = inventory.iter_hosts(only=only, where=where, provenance=provenance)
+    try:
+        count = write_jsonl(hosts, sys.stdout)
+    except ValueError as e:
+        typer.echo(typer.style(f"=> Error: {e}", fg=typer.colors.RED), err=True)
+        raise typer.Exit(1)
+    except BrokenPipeError:
+        # The reader stopped early, e.g. `| head`, don't fail flushing at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
+    logger.info(f"Streamed {count} hosts")
+
+
+@app.command()
+def stats(
+    source: list[Path] = typer.Option(
+        [Path().cwd()],
+        "-s",
+        "--source",
+        envvar="INVGEN_SOURCE",
+        help="Source directory or archive, can be given multiple times",
+    ),
+    output: Path = typer.Option(
+        None,
+        "-o",
+        "--output",
+        envvar="INVGEN_OUTPUT",
+        help="Directory of the generated files, defaults to the source directory",
+    ),
+    top: int = typer.Option(10, "--top", help="Number of entries per ranking"),
+    json_output: bool = typer.Option(False, "--json", help="Output the report as json"),
+):
+    """Report the size of the inventory and where duplicated bytes come from"""
+    init_logger()
+
+    data_dirs = [open_source(s) for s in source]
+    try:
+        inventory_stats = collect_stats(data_dirs, output)
+    except ValueError as e:
+        typer.echo(typer.style(f"=> Error: {e}", fg=typer.colors.RED))
+        raise typer.Exit(1)
+
+    if json_output:
+        typer.echo(json.dumps(inventory_stats.to_dict(top), indent=2))
+    else:
+        typer.echo(render_stats(inventory_stats, top))
+
+
+@app.command(name="export")
+def export_command(
+    path: Path = typer.Argument(..., help="File to write the inventory to"),
+    source: Path = typer.Option(
+        Path().cwd(),
+        "-s",
+        "--source",
+        envvar="INVGEN_SOURCE",
+        help="Source directory or .tar, .tar.zst, .zip archive",
+    ),
+    format: str = typer.Option(
+        None,
+        "-f",
+        "--format",
+        help="yaml or ini, detected from the file suffix by default",
+    ),
+    group_vars: bool = typer.Option(
+        False,
+        "--group-vars",
+        help="Attach metadata vars to their groups instead of every host",
+    ),
+    limit: str = typer.Option(
+        "", "--limit", help="Only export hosts matching an Ansible --limit pattern"
+    ),
+):
+    """Write a static Ansible inventory from the generated hosts"""
+    init_logger()
+
+    data_dir = open_source(source)
+    metadata = build_metadata_vars(data_dir) if group_vars else None
+    try:
+        stats = export_inventory(data_dir, path, format, metadata=metadata, limit=limit)
+    except ValueError as e:
+        typer.echo(typer.style(f"=> Error: {e}", fg=typer.colors.RED))
+        raise typer.Exit(1)
+    typer.echo(
+        f"=> Done! Exported {stats.written + stats.reused} hosts to {path} "
+        + f"({stats.reused} unchanged)"
+    )
+
+
+@app.command()
+def explain(
+    host: str = typer.Argument(
+        ...,
+        help="Host to explain, or the var with --from",
+        autocompletion=complete_host,
+    ),
+    var: str = typer.Argument(None, help="Var to explain, all vars by default"),
+    from_source: str = typer.Option(
+        None,
+        "--from",
+        help="List the hosts whose var is set by a metadata value (os/rhel-9) or file",
+    ),
+    source: list[Path] = typer.Option(
+        [Path().cwd()],
+        "-s",
+        "--source",
+        envvar="INVGEN_SOURCE",
+        help="Source directory, the first one holds the generated files",
+    ),
+    output: Path = typer.Option(
+        None,
+        "-o",
+        "--output",
+        envvar="INVGEN_OUTPUT",
+        help="Directory of the generated files, defaults to the source directory",
+    ),
+):
+    """Show which layers set the vars of a host, from the last generate run"""
+    init_logger()
+
+    base_dir = output or open_source(source[0])
+    provenance = load_provenance_index(base_dir)
+    if provenance is None:
+        typer.echo(
+            typer.style(
+                f"=> Error: No current provenance index in {base_dir}, "
+                + "run invgen generate first",
+                fg=typer.colors.RED,
+            )
+        )
+        raise typer.Exit(1)
+
+    if from_source is not None:
+        key = var or host
+        hosts = provenance.hosts_from(from_source, key)
+        typer.echo(f"=> {len(hosts)} hosts get {key} from {from_source}")
+        for name in hosts:
+            typer.echo(f"  {name}")
+        return
+
+    if host not in provenance.hosts:
+        typer.echo(typer.style(f"=> Error: Unknown host {host}", fg=typer.colors.RED))
+        raise typer.Exit(1)
+    keys = provenance.hosts[host].keys
+    if var is None:
+        typer.echo(f"=> Vars of {host}")
+        for key, layers in keys.items():
+            shadowed = f" (overrides {', '.join(layers[1:])})" if len(layers) > 1 else ""
+            typer.echo(f"  {key}: {layers[0]}{shadowed}")
+        return
+    if var not in keys:
+        typer.echo(
+            typer.style(f"=> Error: Host {host} has no var {var}", fg=typer.colors.RED)
+        )
+        raise typer.Exit(1)
+
+    (winner, file), *shadowed = provenance.explain(host, var)
+    typer.echo(f"=> {var} of {host} is set by {winner} ({file})")
+    for layer, layer_file in shadowed:
+        typer.echo(f"  overrides {layer} ({layer_file})")
 
 
 @app_new.command(name="host")
@@ -72,6 +425,7 @@ def new_host(
         "--options",
         help="Additional options as key=value pairs, separated by spaces. "
         + "Can be a list seperated by commas.",
+        autocompletion=complete_metadata_option,
     ),
     ignore_errors: bool = typer.Option(
         False, "--ignore-errors", help="Ignore errors in the template"
@@ -97,9 +451,22 @@ def new_host(
     typer.echo(f"=> Done! Created new host in {destination}/{name}.yaml")
 
 
+def _template_kwargs(name: str, metadata_type: str, options: str) -> dict[str, str]:
+    kwargs = {"name": name, "type": metadata_type}
+    if options:
+        for option in options.split(" "):
+            key, value = option.split("=")
+            kwargs[key.strip()] = value.strip()
+    return kwargs
+
+
 @app_new.command(name="metadata")
 def new_metadata(
-    metadata_type: str = typer.Option(..., help="Type of metadata (e.g., tags, platform)"),
+    metadata_type: str = typer.Option(
+        ...,
+        help="Type of metadata (e.g., tags, platform)",
+        autocompletion=complete_metadata_type,
+    ),
     name: str = typer.Option(..., help="Name of the metadata file"),
     source: Path = typer.Option(
         Path().cwd(),
@@ -120,8 +487,36 @@ def new_metadata(
         "--options",
         help="Additional options as key=value pairs, separated by spaces",
     ),
+    bundle: bool = typer.Option(
+        False,
+        "--bundle",
+        help="Append to metadata/<type>.bundle.yaml, the default if the bundle exists "
+        + "and metadata/<type>/ doesn't",
+    ),
 ):
     metadata_dir = source.joinpath(f"metadata/{metadata_type}")
+    bundle_path = source.joinpath(f"metadata/{metadata_type}{BUNDLE_SUFFIX}")
+    if bundle or (bundle_path.is_file() and not metadata_dir.is_dir()):
+        if metadata_dir.joinpath(f"{name}.yaml").exists():
+            typer.echo(
+                typer.style(
+                    f"=> Error: Metadata file {metadata_dir / name}.yaml already exists",
+                    fg=typer.colors.RED,
+                )
+            )
+            raise typer.Exit(1)
+        rendered = None
+        if template:
+            kwargs = _template_kwargs(name, metadata_type, options)
+            rendered = render_template(template, **kwargs)
+        try:
+            append_to_bundle(bundle_path, name, rendered, source)
+        except ValueError as e:
+            typer.echo(typer.style(f"=> Error: {e}", fg=typer.colors.RED))
+            raise typer.Exit(1)
+        typer.echo(f"=> Done! Added metadata {metadata_type}/{name} to {bundle_path}")
+        return
+
     metadata_dir.mkdir(parents=True, exist_ok=True)
 
     output_path = metadata_dir.joinpath(f"{name}.yaml")
@@ -133,12 +528,7 @@ def new_metadata(
     typer.echo(f"=> Creating new metadata {metadata_type}/{name}")
 
     if template:
-        kwargs = {"name": name, "type": metadata_type}
-        if options:
-            for option in options.split(" "):
-                key, value = option.split("=")
-                kwargs[key.strip()] = value.strip()
-
+        kwargs = _template_kwargs(name, metadata_type, options)
         rendered = render_template(template, **kwargs)
         with open(output_path, "w") as f:
             f.write(rendered)
@@ -154,27 +544,41 @@ def new_metadata(
 @app_validate.command(name="hosts")
 def validate_hosts(
     source: Path = typer.Option(
-        Path().cwd(), "-s", "--source", envvar="INVGEN_SOURCE", help="Source directory"
+        Path().cwd(),
+        "-s",
+        "--source",
+        envvar="INVGEN_SOURCE",
+        help="Source directory or .tar, .tar.zst, .zip archive",
     ),
 ):
     """Validate all host files in the inventory"""
     init_logger("INFO")
 
-    host_files = get_all_host_files(source)
+    root = open_source(source)
+    host_files = get_all_host_files(root)
     errors = []
 
+    try:
+        rules = load_rules(root)
+    except ValueError as e:
+        errors.append(str(e))
+        rules = None
+
     typer.echo(f"=> Validating {len(host_files)} host files")
 
     for host_file in host_files:
         try:
-            from invgen.files import load_yaml_cached
-            host_data = load_yaml_cached(host_file)
-
-            # Check for required fields
-            if "metadata" not in host_data:
-                errors.append(f"{host_file.name}: Missing 'metadata' section")
-            elif not isinstance(host_data["metadata"], dict):
-                errors.append(f"{host_file.name}: 'metadata' must be a dictionary")
+            for entry in iter_host_entries(host_file, root, rules):
+                host_data = entry.vars
+                label = host_file.name
+                if entry.name != host_file.stem:
+                    label = f"{host_file.name} ({entry.name})"
+
+                # Check for required fields
+                if "metadata" not in host_data:
+                    errors.append(f"{label}: Missing 'metadata' section")
+                elif not isinstance(host_data["metadata"], dict):
+                    errors.append(f"{label}: 'metadata' must be a dictionary")
 
         except Exception as e:
             errors.append(f"{host_file.name}: {str(e)}")
@@ -0,0 +1,115 @@
+import os
+from pathlib import Path
+from typing import Any
+
+import typer
+
+from invgen.archive import open_source
+from invgen.cache import (
+    CACHE_DIR,
+    is_completion_index_current,
+    load_completion_index,
+    write_completion_index,
+)
+from invgen.hosts import get_all_host_files, get_host_names
+from invgen.logging import logger
+from invgen.metadata import build_metadata_vars
+
+
+def get_completion_index(base_dir: Path) -> dict[str, Any]:
+    """Return the host names and metadata values of a directory
+
+    The index written by `invgen generate` is used while the directories it
+    was built from are unchanged. Otherwise it is rebuilt from its sources,
+    or from `base_dir` without an index, and written back if `base_dir` was
+    generated before.
+    """
+    index = load_completion_index(base_dir)
+    if index is not None and is_completion_index_current(index):
+        return index
+
+    sources = index["sources"] if index is not None else [str(base_dir)]
+    roots = [open_source(Path(s)) for s in sources]
+    hosts = {}
+    for root in roots:
+        for host_file in get_all_host_files(root):
+            try:
+                names = get_host_names(host_file, root)
+            except ValueError:
+                continue
+            for name in names:
+                hosts[name] = host_file
+    metadata = build_metadata_vars(roots)
+    values = {t: sorted(metadata.names(t)) for t in sorted(metadata.types())}
+
+    if base_dir.joinpath(CACHE_DIR).is_dir():
+        write_completion_index(base_dir, roots, hosts, values)
+    return {"hosts": sorted(hosts), "metadata": values}
+
+
+def _base_dir(ctx: typer.Context) -> Path:
+    """The directory a command reads, from its options or their defaults"""
+    for key in ("output", "source"):
+        value = ctx.params.get(key)
+        if isinstance(value, (list, tuple)):
+            value = value[0] if value else None
+        if value:
+            return Path(value)
+    if os.environ.get("INVGEN_SOURCE"):
+        return Path(os.environ["INVGEN_SOURCE"].split(":")[0])
+    if ctx.params.get("destination"):
+        return Path(ctx.params["destination"]).parent
+    return Path.cwd()
+
+
+def _load(ctx: typer.Context) -> dict[str, Any] | None:
+    # Completion must not print anything or fail in the shell
+    logger.disabled = True
+    try:
+        return get_completion_index(_base_dir(ctx))
+    except Exception:
+        return None
+    finally:
+        logger.disabled = False
+
+
+def complete_host(ctx: typer.Context, incomplete: str) -> list[str]:
+    """Complete host names"""
+    index = _load(ctx)
+    if index is None:
+        return []
+    return [name for name in index["hosts"] if name.startswith(incomplete)]
+
+
+def complete_metadata_type(ctx: typer.Context, incomplete: str) -> list[str]:
+    """Complete metadata types"""
+    index = _load(ctx)
+    if index is None:
+        return []
+    return [name for name in index["metadata"] if name.startswith(incomplete)]
+
+
+def complete_metadata_option(ctx: typer.Context, incomplete: str) -> list[str]:
+    """Complete "<type>=<value>" pairs, the last one of a space separated list
+
+    Values can be comma separated lists.
+    """
+    index = _load(ctx)
+    if index is None:
+        return []
+    head, _, last = incomplete.rpartition(" ")
+    prefix = f"{head} " if head else ""
+    metadata_type, sep, value = last.partition("=")
+    if not sep:
+        return [
+            f"{prefix}{name}="
+            for name in index["metadata"]
+            if name.startswith(metadata_type)
+        ]
+    done, _, current = value.rpartition(",")
+    prefix += f"{metadata_type}={done}," if done else f"{metadata_type}="
+    return [
+        f"{prefix}{name}"
+        for name in index["metadata"].get(metadata_type, [])
+        if name.startswith(current)
+    ]
@@ -0,0 +1,268 @@
+import ast
+import datetime
+import hashlib
+import json
+import os
+import re
+import shlex
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO
+
+import yaml
+
+from invgen.archive import SourcePath
+from invgen.cache import fingerprint, load_host_index
+from invgen.files import SafeDumper, VaultPass
+from invgen.hosts import GENERATED_FORMATS, load_generated_host
+from invgen.inventory import (
+    Group,
+    attach_group_vars,
+    get_group_names,
+    group_priorities,
+    reduce_hostvars,
+    select_hosts,
+)
+from invgen.logging import logger
+from invgen.metadata import MetadataVars
+
+EXPORT_FORMATS = ("yaml", "ini")
+EXPORT_MANIFEST_VERSION = 1
+
+
+@dataclass
+class ExportStats:
+    """Counts of an export run"""
+
+    written: int = 0
+    reused: int = 0
+
+
+def get_export_format(path: Path) -> str:
+    """Detect the export format from the file suffix"""
+    return "ini" if path.suffix in (".ini", ".cfg", "") else "yaml"
+
+
+def _scan_generated(data_dir: SourcePath) -> dict[str, dict[str, Any]]:
+    """Index generated files by loading them one at a time"""
+    index = {}
+    generated_dir = data_dir.joinpath("generated")
+    for format in GENERATED_FORMATS:
+        for file in generated_dir.rglob(f"*.{format}"):
+            if file.is_file():
+                host = load_generated_host(file)
+                index[host.name] = {"path": file, "metadata": host.vars.get("metadata")}
+    return index
+
+
+def _python_literal(value: Any) -> str:
+    """Serialize a value as the Python literal Ansible's INI parser evaluates"""
+    if isinstance(value, VaultPass):
+        raise ValueError("Vault values can't be exported as INI, use the yaml format")
+    elif isinstance(value, (bool, int, float, str)) or value is None:
+        return repr(str(value) if isinstance(value, str) else value)
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        return repr(value.isoformat())
+    elif isinstance(value, (list, tuple)):
+        return "[" + ", ".join(_python_literal(v) for v in value) + "]"
+    elif isinstance(value, dict):
+        items = (
+            f"{_python_literal(k)}: {_python_literal(v)}" for k, v in value.items()
+        )
+        return "{" + ", ".join(items) + "}"
+    raise ValueError(f"Can't export {type(value).__name__} values as INI")
+
+
+_plain_ini_value = re.compile(r"^[\w./@:+-]+$")
+
+
+def _ini_host_value(value: Any) -> str:
+    """Serialize a value for a host line, which Ansible splits like a shell"""
+    if isinstance(value, str) and not isinstance(value, VaultPass):
+        if _plain_ini_value.match(value):
+            try:
+                ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                return value
+    return shlex.quote(_python_literal(value))
+
+
+def _yaml(data: Any, indent: int) -> str:
+    content = yaml.dump(
+        data,
+        Dumper=SafeDumper,
+        sort_keys=False,
+        indent=2,
+        default_flow_style=False,
+        allow_unicode=True,
+    )
+    prefix = " " * indent
+    return "".join(prefix + line for line in content.splitlines(keepends=True))
+
+
+def _render_host(name: str, vars: dict[str, Any], format: str) -> str:
+    if format == "ini":
+        values = [f"{k}={_ini_host_value(v)}" for k, v in vars.items()]
+        return " ".join([name] + values) + "\n"
+    return _yaml({name: vars or None}, 4)
+
+
+def _render_groups(groups: list[Group], format: str) -> str:
+    if format == "ini":
+        sections = []
+        for group in groups:
+            hosts = "".join(f"{h}\n" for h in group.hosts)
+            sections.append(f"\n[{group.name}]\n{hosts}")
+            if group.vars:
+                vars = "".join(
+                    f"{k}={_python_literal(v)}\n" for k, v in group.vars.items()
+                )
+                sections.append(f"\n[{group.name}:vars]\n{vars}")
+        return "".join(sections)
+
+    if not groups:
+        return ""
+    children = {}
+    for group in groups:
+        children[group.name] = {"hosts": dict.fromkeys(group.hosts)}
+        if group.vars:
+            children[group.name]["vars"] = group.vars
+    return "  children:\n" + _yaml(children, 4)
+
+
+def _manifest_path(path: Path) -> Path:
+    return path.with_name(f".{path.name}.invgen.json")
+
+
+def _load_manifest(path: Path, options: dict[str, Any]) -> dict[str, list]:
+    """Return the host chunks of the previous export if it can be reused"""
+    try:
+        manifest = json.loads(_manifest_path(path).read_text())
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable export manifest of {path}: {e}")
+        return {}
+    if (
+        manifest.get("version") != EXPORT_MANIFEST_VERSION
+        or manifest.get("options") != options
+        or manifest.get("file") != fingerprint(path)
+    ):
+        return {}
+    return manifest["hosts"]
+
+
+def _read_chunk(f: BinaryIO, offset: int, length: int) -> bytes:
+    f.seek(offset)
+    return f.read(length)
+
+
+def export_inventory(
+    data_dir: SourcePath,
+    path: Path,
+    format: str | None = None,
+    metadata: MetadataVars | None = None,
+    limit: str = "",
+) -> ExportStats:
+    """Write a static Ansible inventory in the native yaml or INI format
+
+    The inventory has the same hosts, groups and vars as `AnsibleInventory`.
+    Host vars are written once per host, with `metadata` the vars of each
+    metadata value are written once to its group instead. Hosts are read
+    and written one at a time. The entries of hosts whose generated file is
+    unchanged are copied from the previous export instead of serializing them
+    again.
+    """
+    format = format or get_export_format(path)
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid format {format}, expected one of {EXPORT_FORMATS}")
+
+    index = load_host_index(data_dir)
+    if index is None:
+        logger.info("No current host index, reading all generated hosts")
+        index = _scan_generated(data_dir)
+
+    names = list(index)
+    group_hosts: dict[str, list[str]] = defaultdict(list)
+    for name in names:
+        for group in get_group_names(index[name]["metadata"]):
+            group_hosts[group].append(name)
+    if limit:
+        names = select_hosts(limit, group_hosts, names)
+        selected = set(names)
+        group_hosts = {
+            group: [h for h in hosts if h in selected]
+            for group, hosts in group_hosts.items()
+        }
+    groups = [Group(name=k, hosts=v) for k, v in group_hosts.items() if v]
+
+    order: dict[str, int] = {}
+    group_vars: dict[str, dict[str, Any]] = {}
+    if metadata is not None:
+        order, refs = group_priorities(index[n]["metadata"] or {} for n in names)
+        group_vars = attach_group_vars(groups, metadata, order, refs)
+    membership: dict[str, list[str]] = defaultdict(list)
+    for group in groups:
+        for host in group.hosts:
+            membership[host].append(group.name)
+
+    # Host entries only depend on their generated file and the group vars
+    options = {
+        "format": format,
+        "group_vars": hashlib.sha1(
+            json.dumps([group_vars, order], sort_keys=True, default=str).encode()
+        ).hexdigest(),
+    }
+    previous = _load_manifest(path, options)
+    chunks: dict[str, list] = {}
+    stats = ExportStats()
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    old = open(path, "rb") if previous else None
+    try:
+        with open(tmp, "wb") as f:
+            if format == "ini":
+                f.write(b"[all]\n")
+            else:
+                f.write(b"all:\n  hosts:\n" if names else b"all:\n  hosts: {}\n")
+            for name in names:
+                file = index[name].get("path") or data_dir.joinpath(index[name]["file"])
+                file_fingerprint = fingerprint(file)
+                entry = previous.get(name)
+                if old is not None and entry and entry[0] == file_fingerprint:
+                    chunk = _read_chunk(old, entry[1], entry[2])
+                    stats.reused += 1
+                else:
+                    host = load_generated_host(file)
+                    vars = host.vars
+                    if metadata is not None:
+                        vars = reduce_hostvars(
+                            name, vars, membership[name], group_vars, order
+                        )
+                    chunk = _render_host(name, vars, format).encode()
+                    stats.written += 1
+                chunks[name] = [file_fingerprint, f.tell(), len(chunk)]
+                f.write(chunk)
+            f.write(_render_groups(groups, format).encode())
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    finally:
+        if old is not None:
+            old.close()
+
+    os.replace(tmp, path)
+    _manifest_path(path).write_text(
+        json.dumps(
+            {
+                "version": EXPORT_MANIFEST_VERSION,
+                "options": options,
+                "file": fingerprint(path),
+                "hosts": chunks,
+            }
+        )
+    )
+    logger.info(f"Exported {len(names)} hosts to {path}")
+    return stats
@@ -1,8 +1,16 @@
+import datetime
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
 from io import TextIOWrapper
+from typing import IO, Any
+from invgen.archive import ArchivePath
 from invgen.logging import logger
 from pathlib import Path
 import yaml
-from functools import lru_cache
 
 try:
     from yaml import CSafeLoader as SafeLoader
@@ -36,40 +44,306 @@ def ansible_vault_representer(dumper, data: VaultPass) -> yaml.nodes.ScalarNode:
     )
 
 
-# Register the custom constructor and representer
+# Source root `!include` paths are resolved against and the files being loaded
+_include_root: ContextVar[Path | ArchivePath | None] = ContextVar(
+    "include_root", default=None
+)
+_loading: ContextVar[tuple[str, ...]] = ContextVar("loading", default=())
+
+# Included files are parsed once and shared by reference while they and the
+# files they include keep the stamps they were parsed with
+_included: dict[str, tuple[Any, dict[str, tuple | None]]] = {}
+_includes: dict[str, dict[str, Path | ArchivePath]] = {}
+
+
+def include_constructor(loader, node: yaml.nodes.ScalarNode) -> Any:
+    """Construct the content of an included file, relative to the source root"""
+    if not isinstance(node, yaml.ScalarNode):
+        raise yaml.constructor.ConstructorError(
+            None, None, f"expected a scalar node, but found {node.id}", node.start_mark
+        )
+    root = _include_root.get()
+    if root is None:
+        raise yaml.constructor.ConstructorError(
+            None, None, "!include is only supported in source files", node.start_mark
+        )
+
+    target = root.joinpath(loader.construct_scalar(node))
+    key = str(target)
+    loading = _loading.get()
+    if loading:
+        _includes.setdefault(loading[-1], {})[key] = target
+    if key in loading:
+        chain = " -> ".join(loading[loading.index(key) :] + (key,))
+        raise yaml.constructor.ConstructorError(
+            None, None, f"Include cycle: {chain}", node.start_mark
+        )
+
+    if not _is_included_current(key, target):
+        _includes.pop(key, None)
+        token = _loading.set(loading + (key,))
+        try:
+            value = yaml.load(target.read_text(), Loader=SafeLoader)
+        finally:
+            _loading.reset(token)
+        stamps = {str(f): _stamp(f) for f in [target, *get_includes(target)]}
+        _included[key] = (value, stamps)
+    return _included[key][0]
+
+
+def _is_included_current(key: str, target: Path | ArchivePath) -> bool:
+    """Check if an included file and its own includes are unchanged"""
+    if key not in _included:
+        return False
+    _, stamps = _included[key]
+    targets = {str(f): f for f in get_includes(target)}
+    targets[key] = target
+    return all(
+        k in targets and stamp is not None and _stamp(targets[k]) == stamp
+        for k, stamp in stamps.items()
+    )
+
+
+# Register the custom constructors and representer
 SafeLoader.add_constructor("!vault", ansible_vault_constructor)
+SafeLoader.add_constructor("!include", include_constructor)
 SafeDumper.add_representer(VaultPass, ansible_vault_representer)
 
 
-@lru_cache
-def load_yaml_cached(file: Path) -> dict:
-    """Load a yaml file and cache the result"""
-    return load_yaml(file)
+def get_includes(file: Path | ArchivePath) -> list[Path | ArchivePath]:
+    """Return the files included by a loaded file, directly or transitively"""
+    found: dict[str, Path | ArchivePath] = {}
+    pending = [str(file)]
+    while pending:
+        for key, target in _includes.get(pending.pop(), {}).items():
+            if key not in found:
+                found[key] = target
+                pending.append(key)
+    return list(found.values())
+
+
+def clear_includes() -> None:
+    """Forget included files, e.g. before regenerating after a change"""
+    _included.clear()
+    _includes.clear()
+
+
+PARSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
 
 
-def load_yaml(file: Path | TextIOWrapper) -> dict:
-    """Load a yaml file"""
+def _stamp(file: Path | ArchivePath) -> tuple | None:
+    """Identify the content of a file by its mtime and size
+
+    Archive members change with the mtime and size of their archive file,
+    members of in-memory archives never change.
+    """
+    if isinstance(file, ArchivePath):
+        if not file.is_file():
+            return None
+        archive = file.archive
+        version: tuple = ("memory", archive.token)
+        if archive.from_file:
+            try:
+                stat = archive.path.stat()
+                version = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                pass
+        return (version, len(file.read_bytes()))
     try:
-        if isinstance(file, Path):
-            return yaml.load(file.read_text(), Loader=SafeLoader)
-        else:
-            return yaml.load(file.read(), Loader=SafeLoader)
+        stat = file.stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+@dataclass
+class ParseCacheStats:
+    """Counters of a `ParseCache`"""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+
+@dataclass
+class _ParseCacheEntry:
+    value: Any
+    size: int
+    stamps: dict[str, tuple | None]
+    includes: dict[str, dict[str, Path | ArchivePath]]
+
+
+class ParseCache:
+    """Parsed yaml files, validated against the mtime and size of each file.
+
+    An entry is reused while the file and the files it includes are
+    unchanged. The cache holds at most `max_bytes`, weighed by the size of
+    the parsed source, and evicts the least recently used entries first.
+    It is safe to use from several threads, a file parsed concurrently is
+    parsed twice and stored once.
+    """
+
+    def __init__(self, max_bytes: int = PARSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, _ParseCacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = ParseCacheStats()
+
+    def get(self, file: Path | ArchivePath, root, load) -> Any:
+        """Return the cached result of `load(file, root)`, loading it if stale"""
+        key = (load.__name__, str(file), None if root is None else str(root))
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            targets = {k: t for deps in entry.includes.values() for k, t in deps.items()}
+            targets[str(file)] = file
+            if all(_stamp(targets[k]) == v for k, v in entry.stamps.items()):
+                with self._lock:
+                    self._stats.hits += 1
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                # Files included by the cached file are still its dependencies
+                _includes.update({k: dict(v) for k, v in entry.includes.items()})
+                return entry.value
+            with self._lock:
+                self._stats.invalidations += 1
+                self._remove(key)
+
+        stamp = _stamp(file)
+        value = load(file, root)
+        includes = {str(file): dict(_includes.get(str(file), {}))}
+        stamps = {str(file): stamp}
+        for include in get_includes(file):
+            includes[str(include)] = dict(_includes.get(str(include), {}))
+            stamps[str(include)] = _stamp(include)
+        size = stamp[1] if stamp is not None else 0
+        size += sum(s[1] for k, s in stamps.items() if k != str(file) and s)
+
+        with self._lock:
+            self._stats.misses += 1
+            self._remove(key)
+            if size <= self.max_bytes:
+                self._entries[key] = _ParseCacheEntry(value, size, stamps, includes)
+                self._stats.bytes += size
+                while self._stats.bytes > self.max_bytes:
+                    self._remove(next(iter(self._entries)))
+                    self._stats.evictions += 1
+        return value
+
+    def _remove(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._stats.bytes -= entry.size
+
+    def stats(self) -> ParseCacheStats:
+        with self._lock:
+            return ParseCacheStats(
+                **{**vars(self._stats), "entries": len(self._entries)}
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats = ParseCacheStats()
+
+
+parse_cache = ParseCache()
+
+
+def load_yaml_cached(
+    file: Path | ArchivePath | IO[str], root: Path | ArchivePath | None = None
+) -> dict:
+    """Load a yaml file through the parse cache, open files are never cached"""
+    if not isinstance(file, (Path, ArchivePath)):
+        return load_yaml(file, root)
+    return parse_cache.get(file, root, load_yaml)
+
+
+def load_yaml_all_cached(
+    file: Path | ArchivePath | IO[str], root: Path | ArchivePath | None = None
+) -> list:
+    """Load all documents of a yaml file through the parse cache"""
+    if not isinstance(file, (Path, ArchivePath)):
+        return load_yaml_all(file, root)
+    return parse_cache.get(file, root, load_yaml_all)
+
+
+def load_yaml_fragments(
+    directory: Path | ArchivePath, root: Path | ArchivePath | None = None
+) -> list[tuple[Path | ArchivePath, Any]]:
+    """Load the yaml files of a directory in name order, each through the parse cache
+
+    The fragments count as included by the directory, so a change to one of
+    them invalidates what was built from the directory.
+    """
+    fragments = sorted(
+        f for f in directory.iterdir() if f.suffix == ".yaml" and f.is_file()
+    )
+    _includes[str(directory)] = {str(f): f for f in fragments}
+    return [(f, load_yaml_cached(f, root)) for f in fragments]
+
+
+@contextmanager
+def _loading_file(
+    file: Path | ArchivePath | TextIOWrapper, root: Path | ArchivePath | None
+):
+    root_token = _include_root.set(root)
+    loading_token = None
+    if isinstance(file, (Path, ArchivePath)):
+        _includes.pop(str(file), None)
+        loading_token = _loading.set(_loading.get() + (str(file),))
+    try:
+        yield
     except (yaml.YAMLError, OSError) as e:
         logger.error(f"Error processing file: {e}")
         raise
+    finally:
+        if loading_token is not None:
+            _loading.reset(loading_token)
+        _include_root.reset(root_token)
+
+
+def _read(file: Path | ArchivePath | TextIOWrapper) -> str:
+    if isinstance(file, (Path, ArchivePath)):
+        return file.read_text()
+    return file.read()
+
+
+def load_yaml(
+    file: Path | ArchivePath | TextIOWrapper, root: Path | ArchivePath | None = None
+) -> dict:
+    """Load a yaml file, `!include` paths are resolved relative to `root`"""
+    with _loading_file(file, root):
+        return yaml.load(_read(file), Loader=SafeLoader)
+
+
+def load_yaml_all(
+    file: Path | ArchivePath | TextIOWrapper, root: Path | ArchivePath | None = None
+) -> list:
+    """Load all documents of a yaml file"""
+    with _loading_file(file, root):
+        return list(yaml.load_all(_read(file), Loader=SafeLoader))
+
+
+def dump_yaml(data: dict, sort_keys: bool = False) -> str:
+    """Serialize data as yaml, the way `save_yaml` writes it"""
+    return yaml.dump(
+        data,
+        Dumper=SafeDumper,
+        sort_keys=sort_keys,
+        indent=2,
+        default_flow_style=False,
+        allow_unicode=True,
+    )
 
 
 def save_yaml(file: Path | TextIOWrapper, data: dict, sort_keys: bool = False) -> None:
     """Save a yaml file"""
     try:
-        content = yaml.dump(
-            data,
-            Dumper=SafeDumper,
-            sort_keys=sort_keys,
-            indent=2,
-            default_flow_style=False,
-            allow_unicode=True,
-        )
+        content = dump_yaml(data, sort_keys=sort_keys)
         if isinstance(file, Path):
             file.write_text(content)
         else:
@@ -77,3 +351,86 @@ def save_yaml(file: Path | TextIOWrapper, data: dict, sort_keys: bool = False) -
     except (yaml.YAMLError, OSError) as e:
         logger.error(f"Error processing file: {e}")
         raise
+
+
+def dump_yaml_var(key: str, value: Any) -> str:
+    """Serialize a single var as a yaml mapping and check that it loads again
+
+    raises yaml.YAMLError
+    """
+    content = dump_yaml({key: value})
+    yaml.load(content, Loader=SafeLoader)
+    return content
+
+
+class YamlFragments:
+    """Yaml text of the vars of metadata values, serialized once per run
+
+    Fragments are keyed by the layer that defines a var ("os/rhel-9") and
+    the var, and are only reused for the same value object, so values
+    rendered per host are serialized again.
+    """
+
+    def __init__(self):
+        self._fragments: dict[tuple[str, str], tuple[Any, str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, layer: str, key: str, value: Any) -> str:
+        """Return the yaml text of a var, see `dump_yaml_var`
+
+        raises yaml.YAMLError
+        """
+        cached = self._fragments.get((layer, key))
+        if cached is not None and cached[0] is value:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        content = dump_yaml_var(key, value)
+        # The value is kept so its id can't be reused by another object
+        self._fragments[(layer, key)] = (value, content)
+        return content
+
+    def clear(self) -> None:
+        self._fragments.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+yaml_fragments = YamlFragments()
+
+
+def _to_json(value: Any) -> Any:
+    """Convert values JSON can't represent, vault values use Ansible's JSON format"""
+    if isinstance(value, VaultPass):
+        return {"__ansible_vault": str(value)}
+    elif isinstance(value, dict):
+        return {k: _to_json(v) for k, v in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def _from_json(obj: dict) -> Any:
+    if len(obj) == 1 and "__ansible_vault" in obj:
+        return VaultPass(obj["__ansible_vault"])
+    return obj
+
+
+def dump_json(data: dict) -> str:
+    """Serialize data compactly as json"""
+    return json.dumps(_to_json(data), separators=(",", ":"), ensure_ascii=False)
+
+
+def load_json(file: Path | ArchivePath | TextIOWrapper) -> dict:
+    """Load a json file written by `dump_json`"""
+    try:
+        if isinstance(file, (Path, ArchivePath)):
+            return json.loads(file.read_text(), object_hook=_from_json)
+        else:
+            return json.loads(file.read(), object_hook=_from_json)
+    except (ValueError, OSError) as e:
+        logger.error(f"Error processing file: {e}")
+        raise
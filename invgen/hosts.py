@@ -1,97 +1,639 @@
-from dataclasses import dataclass
+import re
+from dataclasses import dataclass, replace
+from fnmatch import fnmatch
+from functools import cached_property
+from itertools import product
 from pathlib import Path
-from tempfile import TemporaryFile
+from typing import Any, Iterator
 
 import yaml
 
-from invgen.files import load_yaml, load_yaml_cached, save_yaml
+from invgen.archive import ArchivePath, SourcePath
+from invgen.cache import (
+    BuildCache,
+    load_host_index,
+    write_completion_index,
+    write_host_index,
+)
+from invgen.files import (
+    clear_includes,
+    dump_json,
+    dump_yaml_var,
+    get_includes,
+    load_json,
+    load_yaml,
+    load_yaml_all_cached,
+    load_yaml_fragments,
+    yaml_fragments,
+)
 from invgen.logging import logger
-from invgen.metadata import MetadataVars, build_metadata_vars
+from invgen.metadata import (
+    MetadataVars,
+    ValueWithSource,
+    build_metadata_vars,
+    merge_history,
+)
+from invgen.provenance import Provenance, write_provenance_index
+from invgen.rules import Rule, RuleSet, assign_metadata, load_rules
+from invgen.templates import render_index_vars
+from invgen.templates import render_vars as render_templated_vars
 
 
-def generate_hosts(data_dir: Path):
-    metadata = build_metadata_vars(data_dir)
-    files = get_all_host_files(data_dir)
-    logger.info(f"Generating {len(files)} hosts")
-    for host in files:
-        logger.info(f"Generating host {host.stem}")
-        path = get_generated_host_path(data_dir, host.stem)
-        content = generate_host_file(host, metadata)
-
-        path.parent.mkdir(parents=True, exist_ok=True)
-        with open(path, "w") as f:
-            f.write(content)
+GENERATED_FORMATS = ("yaml", "json")
 
 
 @dataclass
-class ValueWithSource:
-    value: dict
-    source: str
+class GenerateStats:
+    """Counts of a generate run"""
 
+    regenerated: int = 0
+    skipped: int = 0
 
-def generate_host_file(host: Path, metadata: MetadataVars) -> str:
-    """Generate the content of a host file based on the provided metadata."""
-    host_vars = load_yaml_cached(host)
-    if "metadata" not in host_vars:
-        logger.warning(f"Host {host.stem} has no metadata")
-        host_vars["metadata"] = {}
-
-    host_vars_struct: dict[str, ValueWithSource] = {}
-
-    with TemporaryFile("w+") as f:
-        for metadata_type, metadata_value in host_vars["metadata"].items():
-            if isinstance(metadata_value, str):
-                logger.debug(f"Processing metadata {metadata_type}/{metadata_value}")
-                source = f"{metadata_type}/{metadata_value}"
-                if metadata.lookup(metadata_type, host_vars["metadata"][metadata_type]):
-                    for k, v in metadata.lookup(
-                        metadata_type, host_vars["metadata"][metadata_type]
-                    ).items():
-                        host_vars_struct[k] = ValueWithSource(v, source)
-            elif isinstance(metadata_value, list):
-                for item in metadata_value:
-                    logger.debug(f"Processing metadata {metadata_type}/{item}")
-                    source = f"{metadata_type}/{item}"
-                    if metadata.lookup(metadata_type, item):
-                        for k, v in metadata.lookup(metadata_type, item).items():
-                            host_vars_struct[k] = ValueWithSource(v, source)
+
+def generate_hosts(
+    data_dir: SourcePath | list[SourcePath],
+    output_dir: Path | None = None,
+    render_vars: bool = False,
+    format: str = "yaml",
+    only: list[str] | None = None,
+    where: list[str] | None = None,
+) -> GenerateStats:
+    """Generate all hosts, writing to `output_dir` (defaults to `data_dir`)
+
+    `data_dir` can be a list of layered source roots, where hosts and metadata
+    values of later roots override those of earlier roots. Each root keeps its
+    own build cache, host files whose inputs didn't change are skipped
+    without being parsed. Generated files whose content didn't change are not
+    rewritten.
+
+    `format` is either "yaml", which keeps comments with the source of each
+    var, or "json", which is faster to load for the inventory.
+
+    `only` (host name globs) and `where` ("<type>=<value glob>" conditions)
+    restrict generation to matching hosts. Metadata of unchanged host files
+    is taken from the build cache instead of parsing them.
+
+    A host file can declare several hosts, see `iter_host_entries`. Hosts are
+    expanded and generated one at a time. Metadata assigned by the rules
+    files of the roots is added to each host before merging.
+    """
+    roots = data_dir if isinstance(data_dir, list) else [data_dir]
+    if output_dir is None:
+        if len(roots) > 1 or isinstance(roots[0], ArchivePath):
+            raise ValueError(
+                "An output directory is required for archive or multiple sources"
+            )
+        output_dir = roots[0]
+
+    # Parsed host files are validated by the parse cache, included files are
+    # parsed again once per run
+    clear_includes()
+    yaml_fragments.clear()
+    metadata = build_metadata_vars(roots)
+    rules = load_rules(roots)
+    if format not in GENERATED_FORMATS:
+        raise ValueError(f"Invalid format {format}, expected one of {GENERATED_FORMATS}")
+    options = {"render_vars": render_vars, "format": format}
+    conditions = parse_where(where or [])
+
+    caches = {root: BuildCache.load(root, output_dir, options) for root in roots}
+
+    # Host names of unchanged host files are taken from the build cache
+    files: list[tuple[SourcePath, SourcePath, list[str]]] = []
+    owners: dict[str, SourcePath] = {}
+    for root in roots:
+        for host_file in get_all_host_files(root):
+            cached = caches[root].get_hosts(host_file)
+            names = list(cached) if cached is not None else get_host_names(host_file, root)
+            for name in names:
+                if name in owners:
+                    logger.info(f"Host {name} from {host_file} overrides {owners[name]}")
+                owners[name] = host_file
+            files.append((root, host_file, names))
+
+    logger.info(f"Generating {len(owners)} hosts")
+    stats = GenerateStats()
+    provenance: dict[str, dict[str, list[str]]] = {}
+    generated: dict[str, dict] = {}
+    for root, host_file, names in files:
+        cache = caches[root]
+        hosts = [name for name in names if owners[name] == host_file]
+        selected = [name for name in hosts if not only or any(fnmatch(name, p) for p in only)]
+        if conditions and selected:
+            host_metadata = cache.get_hosts(host_file)
+            if host_metadata is None:
+                host_metadata = {
+                    entry.name: entry.vars.get("metadata", {})
+                    for entry in iter_host_entries(host_file, root, rules)
+                }
+            selected = [
+                name
+                for name in selected
+                if matches_where(host_metadata.get(name, {}), conditions)
+            ]
+        if not selected:
+            cache.keep(host_file)
+            continue
+
+        outputs = [
+            str(get_generated_host_path(output_dir, name, format).relative_to(output_dir))
+            for name in hosts
+        ]
+        if cache.is_fresh(host_file, metadata.get_file, output_dir, outputs):
+            logger.debug(f"Hosts of {host_file} are up to date")
+            stats.skipped += len(selected)
+            continue
+
+        # A partial selection leaves the previous build cache entry in place
+        complete = len(selected) == len(hosts)
+        selected_names = set(selected)
+        hosts_metadata: dict[str, dict] = {}
+        metadata_files: dict[str, SourcePath | None] = {}
+        for entry in iter_host_entries(host_file, root, rules):
+            hosts_metadata[entry.name] = entry.vars.get("metadata", {})
+            if entry.name not in selected_names:
+                continue
+
+            logger.info(f"Generating host {entry.name}")
+            path = get_generated_host_path(output_dir, entry.name, format)
+            host_vars_struct = build_host_vars(entry, metadata, render_vars=render_vars)
+            content = render_host_file(host_vars_struct, entry.name, format)
+            provenance[entry.name] = {
+                k: v.history[::-1] for k, v in host_vars_struct.items()
+            }
+            generated[entry.name] = hosts_metadata[entry.name]
+
+            if path.is_file() and path.read_text() == content:
+                logger.debug(f"Host {entry.name} is unchanged")
+                stats.skipped += 1
             else:
-                raise ValueError(
-                    f"Invalid metadata type {type(metadata_value)} ({metadata_type}/{metadata_value})"
-                )
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, "w") as f:
+                    f.write(content)
+                stats.regenerated += 1
+
+            # Don't leave a file in another format behind for the inventory to load
+            for other in GENERATED_FORMATS:
+                if other != format:
+                    get_generated_host_path(output_dir, entry.name, other).unlink(
+                        missing_ok=True
+                    )
+
+            # Extended metadata values are dependencies as well
+            for metadata_type, value in iter_metadata(entry.vars):
+                for ref in metadata.get_chain(metadata_type, value):
+                    metadata_files[ref] = metadata.get_file(*ref.split("/", 1))
+
+        if not complete:
+            cache.keep(host_file)
+            continue
+
+        # Any change to the rules can change which of them match
+        includes = get_includes(host_file) + rules.files
+        for file in metadata_files.values():
+            if file is not None:
+                includes.extend(get_includes(file))
+        cache.update(
+            host_file,
+            hosts_metadata,
+            metadata_files,
+            outputs,
+            output_dir,
+            includes=includes,
+            provenance={name: provenance[name] for name in hosts},
+        )
+
+    for cache in caches.values():
+        cache.save()
+    index = _build_host_index(files, owners, caches, generated, output_dir, format)
+    write_host_index(output_dir, index)
+    write_completion_index(
+        output_dir, roots, owners, {t: metadata.names(t) for t in metadata.types()}
+    )
+    write_provenance_index(
+        output_dir,
+        _build_provenance(files, index, caches, provenance, metadata, rules),
+    )
+
+    return stats
+
+
+def _build_host_index(
+    files: list[tuple[SourcePath, SourcePath, list[str]]],
+    owners: dict[str, SourcePath],
+    caches: dict[SourcePath, BuildCache],
+    generated: dict[str, dict],
+    output_dir: Path,
+    format: str,
+) -> dict[str, dict]:
+    """Index the generated file and metadata of each host with a generated file
+
+    `generated` maps the hosts generated in this run to their metadata. Hosts
+    that were not, e.g. outside of `--only`, keep the metadata recorded when
+    their file was generated, from the build cache or the previous index.
+    """
+    previous = load_host_index(output_dir, current=False) or {}
+    index = {}
+    for root, host_file, names in files:
+        recorded = caches[root].get_recorded_hosts(host_file) or {}
+        for name in names:
+            if owners[name] != host_file:
+                continue
+            if name in generated:
+                host_metadata = generated[name]
+            elif name in recorded:
+                host_metadata = recorded[name]
+            elif name in previous:
+                host_metadata = previous[name]["metadata"]
+            else:
+                continue
+            # A kept file can be left in the format of an earlier run
+            paths = [
+                get_generated_host_path(output_dir, name, other)
+                for other in (format, *GENERATED_FORMATS)
+            ]
+            path = next((p for p in paths if p.is_file()), None)
+            if path is not None:
+                index[name] = {
+                    "file": str(path.relative_to(output_dir)),
+                    "metadata": host_metadata,
+                }
+    return index
+
+
+def _build_provenance(
+    files: list[tuple[SourcePath, SourcePath, list[str]]],
+    index: dict[str, dict],
+    caches: dict[SourcePath, BuildCache],
+    generated: dict[str, dict[str, list[str]]],
+    metadata: MetadataVars,
+    rules: RuleSet,
+) -> Provenance:
+    """Collect the provenance of the indexed hosts and the files of their layers"""
+    provenance = Provenance()
+    for root, host_file, names in files:
+        cached = caches[root].get_provenance(host_file) or {}
+        for name in names:
+            if name not in index:
+                continue
+            keys = generated.get(name) or cached.get(name)
+            if keys is None:
+                continue
+            for sources in keys.values():
+                for source in sources:
+                    if source not in provenance.files and not source.startswith("hosts/"):
+                        if source.startswith("rules/"):
+                            file = rules.get_file(source)
+                        else:
+                            file = metadata.get_file(*source.split("/", 1))
+                        provenance.files[source] = None if file is None else str(file)
+            provenance.add_host(name, str(host_file), keys)
+    return provenance
+
+
+def parse_where(conditions: list[str]) -> list[tuple[str, str]]:
+    """Parse "<type>=<value glob>" conditions
+
+    raises ValueError for conditions without "="
+    """
+    parsed = []
+    for condition in conditions:
+        metadata_type, sep, pattern = condition.partition("=")
+        if not sep or not metadata_type:
+            raise ValueError(f'Invalid condition "{condition}", expected <type>=<value>')
+        parsed.append((metadata_type.strip(), pattern.strip()))
+    return parsed
+
+
+def matches_where(host_metadata: dict, conditions: list[tuple[str, str]]) -> bool:
+    """Check if a host's metadata matches all conditions"""
+    for metadata_type, pattern in conditions:
+        value = host_metadata.get(metadata_type)
+        values = value if isinstance(value, list) else [value]
+        if not any(isinstance(v, str) and fnmatch(v, pattern) for v in values):
+            return False
+    return True
+
+
+def iter_metadata(host_vars: dict):
+    """Yield the (type, value) pairs of a host's metadata in order
+
+    raises ValueError for values that are neither a string nor a list
+    """
+    for metadata_type, metadata_value in host_vars.get("metadata", {}).items():
+        if isinstance(metadata_value, str):
+            yield metadata_type, metadata_value
+        elif isinstance(metadata_value, list):
+            for item in metadata_value:
+                yield metadata_type, item
+        else:
+            raise ValueError(
+                f"Invalid metadata type {type(metadata_value)} ({metadata_type}/{metadata_value})"
+            )
+
+
+def build_host_vars(
+    host: "HostEntry | SourcePath",
+    metadata: MetadataVars,
+    render_vars: bool = False,
+    root: SourcePath | None = None,
+) -> dict[str, ValueWithSource]:
+    """Merge the metadata vars and the vars of a host, keeping their source
+
+    `host` is an entry of a host file or a host file declaring a single host,
+    `!include` paths in it are resolved relative to `root`. The metadata vars
+    are merged once per combination of metadata, see `MetadataVars.merge`,
+    and only the vars of the host are merged per host.
+    """
+    entry = host if isinstance(host, HostEntry) else get_host_entry(host, root)
+    host_vars = entry.vars
+    if "metadata" not in host_vars:
+        logger.warning(f"Host {entry.name} has no metadata")
+        host_vars = {**host_vars, "metadata": {}}
+
+    # The merged metadata layer is shared, its values are replaced, not changed
+    host_vars_struct = dict(metadata.merge(tuple(iter_metadata(host_vars))))
+
+    source = f"hosts/{entry.file.stem}"
+    for k, v in host_vars.items():
+        sources = [source]
+        if k == "metadata" and entry.assigned:
+            # Metadata assigned by rules is merged with that of the host
+            sources = [rule.source for rule in entry.assigned]
+            if "metadata" in entry.own_vars:
+                sources.append(source)
+        previous = host_vars_struct[k].history if k in host_vars_struct else []
+        host_vars_struct[k] = ValueWithSource(
+            v, sources[-1], merge_history(previous, sources)
+        )
+
+    if render_vars:
+        try:
+            rendered = render_templated_vars(
+                {k: v.value for k, v in host_vars_struct.items()}
+            )
+        except ValueError as e:
+            raise ValueError(f"Error rendering vars for host {entry.name}: {e}")
+        for k, v in rendered.items():
+            if v is not host_vars_struct[k].value:
+                host_vars_struct[k] = replace(host_vars_struct[k], value=v)
+
+    return host_vars_struct
+
 
-        source = f"hosts/{host.stem}"
-        for k, v in host_vars.items():
-            host_vars_struct[k] = ValueWithSource(v, source)
+def generate_host_file(
+    host: "HostEntry | SourcePath",
+    metadata: MetadataVars,
+    render_vars: bool = False,
+    format: str = "yaml",
+    root: SourcePath | None = None,
+) -> str:
+    """Generate the content of a host file based on the provided metadata.
 
-        previous_source: str | None = None
+    With `render_vars`, self-contained Jinja expressions are resolved against
+    the merged vars instead of being left for Ansible. The "json" format
+    drops the comments with the source of each var.
+    """
+    host_vars_struct = build_host_vars(
+        host, metadata, render_vars=render_vars, root=root
+    )
+    name = host.name if isinstance(host, HostEntry) else host.stem
+    return render_host_file(host_vars_struct, name, format)
+
+
+def render_host_file(
+    host_vars_struct: dict[str, ValueWithSource], name: str, format: str = "yaml"
+) -> str:
+    """Serialize merged host vars as a generated host file
+
+    Vars of metadata values are serialized once per run and shared by all
+    hosts using them, only the vars of the host are serialized per host.
+    Each var is checked to load as valid yaml.
+    """
+    if format == "json":
+        return dump_json({k: v.value for k, v in host_vars_struct.items()})
+
+    parts = []
+    previous_source: str | None = None
+    try:
         for k, v in host_vars_struct.items():
             if previous_source is None:
-                f.write(f"# {v.source}\n")
+                parts.append(f"# {v.source}\n")
                 previous_source = v.source
             elif previous_source != v.source:
-                f.write(f"\n# {v.source}\n")
+                parts.append(f"\n# {v.source}\n")
                 previous_source = v.source
 
-            save_yaml(f, {k: v.value})
+            if v.source.startswith(("hosts/", "rules/")) or not v.history:
+                parts.append(dump_yaml_var(k, v.value))
+            else:
+                parts.append(yaml_fragments.get(v.history[-1], k, v.value))
+    except yaml.YAMLError as e:
+        raise ValueError(f"Error reading generated file for host {name}: {e}")
+    return "".join(parts)
+
+
+def get_generated_host_path(base_dir: Path, host: str, format: str = "yaml") -> Path:
+    return base_dir.joinpath(f"generated/{host}.{format}")
+
+
+FRAGMENT_DIR_SUFFIX = ".d"
+
+
+def get_all_host_files(base_path: Path | ArchivePath) -> list[Path | ArchivePath]:
+    """Return the host files and the fragment directories (`<name>.d/`) of a root
+
+    Other directories only group host files.
+    """
+    hosts_dir = base_path.joinpath("hosts/")
+    host_files: dict[str, Path | ArchivePath] = {}
+    for file in hosts_dir.rglob("*.yaml"):
+        if not file.is_file():
+            continue
+        parts = str(file)[len(str(hosts_dir)) + 1 :].split("/")
+        for i, part in enumerate(parts[:-1]):
+            if part.endswith(FRAGMENT_DIR_SUFFIX):
+                file = hosts_dir.joinpath(*parts[: i + 1])
+                break
+        host_files.setdefault(str(file), file)
+    return list(host_files.values())
 
-        # Test if generated file is valid yaml
+
+def _load_host_fragments(directory: SourcePath, root: SourcePath | None) -> dict:
+    """Merge the fragments of a host directory in name order
+
+    Later fragments override vars of earlier ones, `metadata` is merged.
+    """
+    host_vars: dict = {}
+    for fragment, vars in load_yaml_fragments(directory, root):
+        if vars is None:
+            continue
+        if not isinstance(vars, dict):
+            raise ValueError(f"{fragment}: fragment is not a mapping")
+        host_vars = _merge_host_vars(host_vars, vars, directory.stem)
+    return host_vars
+
+
+_host_range = re.compile(r"\[([0-9]+|[a-zA-Z]):([0-9]+|[a-zA-Z])(?::([0-9]+))?\]")
+
+
+def _expand_range(start: str, end: str, step: str | None) -> list[tuple[str, Any]]:
+    """Expand one `[start:end:step]` range to (text, value) pairs"""
+    stride = int(step) if step else 1
+    if start.isdigit() and end.isdigit():
+        # Like Ansible, numbers are padded to the width of the start
+        values = [
+            (f"{i:0{len(start)}d}", i) for i in range(int(start), int(end) + 1, stride)
+        ]
+    elif start.isalpha() and end.isalpha():
+        values = [(chr(c), chr(c)) for c in range(ord(start), ord(end) + 1, stride)]
+    else:
+        raise ValueError(f"Invalid range [{start}:{end}], mixes numbers and letters")
+    if not values or stride < 1:
+        raise ValueError(f"Invalid range [{start}:{end}], it is empty")
+    return values
+
+
+def expand_host_pattern(pattern: str) -> Iterator[tuple[str, tuple]]:
+    """Expand a host name pattern like "web[001:200].dc1" or "db-[a:c]"
+
+    Yields each host name with the values of its ranges, names without a range
+    are yielded as is. Several ranges expand to all combinations.
+    raises ValueError for invalid ranges
+    """
+    parts = _host_range.split(pattern)
+    if len(parts) == 1:
+        yield pattern, ()
+        return
+
+    literals = parts[0::4]
+    ranges = [
+        _expand_range(*parts[i : i + 3]) for i in range(1, len(parts), 4)
+    ]
+    for combination in product(*ranges):
+        name = literals[0] + "".join(
+            text + literal for (text, _), literal in zip(combination, literals[1:])
+        )
+        yield name, tuple(value for _, value in combination)
+
+
+@dataclass
+class HostEntry:
+    """A host declared in a host file"""
+
+    name: str
+    file: SourcePath
+    template: dict
+    indexes: tuple = ()
+    rules: RuleSet | None = None
+
+    @cached_property
+    def own_vars(self) -> dict:
+        """The vars of the host, `${ }` expressions are rendered for ranges"""
+        if not self.indexes:
+            return self.template
+        context = {"name": self.name, "index": self.indexes[0], "indexes": self.indexes}
         try:
-            load_yaml_cached(f)
-        except yaml.YAMLError as e:
-            raise ValueError(f"Error reading generated file for host {host.stem}: {e}")
+            return render_index_vars(self.template, context)
+        except ValueError as e:
+            raise ValueError(f"Error rendering vars for host {self.name}: {e}")
+
+    @cached_property
+    def assigned(self) -> list[Rule]:
+        """The rules assigning metadata to the host"""
+        return self.rules.match(self.name, self.own_vars) if self.rules else []
+
+    @cached_property
+    def vars(self) -> dict:
+        """The vars of the host with the metadata assigned by rules"""
+        if not self.assigned:
+            return self.own_vars
+        return assign_metadata(self.own_vars, self.assigned)
+
+
+def _merge_host_vars(defaults: dict, host_vars: Any, name: str) -> dict:
+    """Merge shared vars of a `hosts:` mapping with the vars of one entry"""
+    if host_vars is None:
+        host_vars = {}
+    elif not isinstance(host_vars, dict):
+        raise ValueError(f"Vars of host {name} must be a mapping")
+    merged = {**defaults, **host_vars}
+    if isinstance(defaults.get("metadata"), dict) and isinstance(
+        host_vars.get("metadata"), dict
+    ):
+        merged["metadata"] = {**defaults["metadata"], **host_vars["metadata"]}
+    return merged
+
 
-        f.seek(0)
-        return f.read()
+def iter_host_entries(
+    file: SourcePath, root: SourcePath | None = None, rules: RuleSet | None = None
+) -> Iterator[HostEntry]:
+    """Yield the hosts declared in a host file
 
+    A plain host file declares the host named after the file. Files with
+    several hosts name them per YAML document, either with
+    `inventory_hostname` or with a `hosts:` mapping of names to vars, where
+    the other keys of the document are shared by all of its hosts. Names can
+    be range patterns like "web[001:200].dc1", which are expanded lazily.
+    A fragment directory declares the host it is named after. Hosts get the
+    metadata of the `rules` they match.
+    raises ValueError for documents that don't declare a host
+    """
+    if file.is_dir():
+        yield HostEntry(file.stem, file, _load_host_fragments(file, root), rules=rules)
+        return
 
-def get_generated_host_path(base_dir: Path, host: str) -> Path:
-    return base_dir.joinpath(f"generated/{host}.yaml")
+    documents = [d for d in load_yaml_all_cached(file, root) if d is not None]
+    if not documents:
+        yield HostEntry(file.stem, file, {}, rules=rules)
+        return
 
+    for i, document in enumerate(documents, 1):
+        if not isinstance(document, dict):
+            raise ValueError(f"{file}: document {i} is not a mapping")
 
-def get_all_host_files(base_path: Path) -> list[Path]:
-    host_files = base_path.joinpath("hosts/").rglob("*.yaml")
-    return [f for f in host_files if f.is_file()]
+        if isinstance(document.get("hosts"), dict):
+            defaults = {k: v for k, v in document.items() if k != "hosts"}
+            for pattern, host_vars in document["hosts"].items():
+                template = _merge_host_vars(defaults, host_vars, str(pattern))
+                for name, indexes in expand_host_pattern(str(pattern)):
+                    yield HostEntry(name, file, template, indexes, rules)
+        elif "inventory_hostname" in document:
+            template = {k: v for k, v in document.items() if k != "inventory_hostname"}
+            for name, indexes in expand_host_pattern(str(document["inventory_hostname"])):
+                yield HostEntry(name, file, template, indexes, rules)
+        elif len(documents) == 1:
+            yield HostEntry(file.stem, file, document, rules=rules)
+        else:
+            raise ValueError(
+                f"{file}: document {i} declares no host, "
+                "add inventory_hostname or a hosts mapping"
+            )
+
+
+def get_host_names(file: SourcePath, root: SourcePath | None = None) -> list[str]:
+    """Return the names of the hosts declared in a host file
+
+    raises ValueError if a host is declared twice
+    """
+    names: dict[str, None] = {}
+    for entry in iter_host_entries(file, root):
+        if entry.name in names:
+            raise ValueError(f"Host {entry.name} is declared twice in {file}")
+        names[entry.name] = None
+    return list(names)
+
+
+def get_host_entry(file: SourcePath, root: SourcePath | None = None) -> HostEntry:
+    """Return the host of a host file that declares a single host
+
+    raises ValueError if the file declares several hosts
+    """
+    entries = iter_host_entries(file, root)
+    entry = next(entries)
+    if next(entries, None) is not None:
+        raise ValueError(f"{file} declares several hosts")
+    return entry
 
 
 @dataclass
@@ -102,8 +644,21 @@ class GeneratedHost:
     vars: dict
 
 
-def get_all_generated_hosts(base_path: Path) -> list[GeneratedHost]:
-    host_files = base_path.joinpath("generated/").rglob("*.yaml")
-    return [
-        GeneratedHost(name=f.stem, vars=load_yaml(f)) for f in host_files if f.is_file()
-    ]
+def load_generated_host(file: Path | ArchivePath) -> GeneratedHost:
+    """Load a generated host file, json files are detected by their suffix"""
+    if file.suffix == ".json":
+        return GeneratedHost(name=file.stem, vars=load_json(file))
+    return GeneratedHost(name=file.stem, vars=load_yaml(file))
+
+
+def iter_generated_hosts(base_path: Path | ArchivePath) -> Iterator[GeneratedHost]:
+    """Yield the generated hosts of a directory, loading one file at a time"""
+    generated_dir = base_path.joinpath("generated/")
+    for format in GENERATED_FORMATS:
+        for file in generated_dir.rglob(f"*.{format}"):
+            if file.is_file():
+                yield load_generated_host(file)
+
+
+def get_all_generated_hosts(base_path: Path | ArchivePath) -> list[GeneratedHost]:
+    return list(iter_generated_hosts(base_path))
@@ -1,24 +1,36 @@
 import json
+import re
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from fnmatch import fnmatchcase
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterable
 
 import typer
 
-from invgen.hosts import GeneratedHost, get_all_generated_hosts
+from invgen.archive import SourcePath, open_source
+from invgen.cache import load_host_index
+from invgen.completion import complete_host
+from invgen.hosts import GeneratedHost, get_all_generated_hosts, load_generated_host
 from invgen.logging import init_logger, logger
+from invgen.metadata import MetadataVars, build_metadata_vars
 
 
 @dataclass
 class Group:
     name: str
     hosts: list[str]
+    vars: dict[str, Any] = field(default_factory=dict)
 
 
 class AnsibleInventory:
-    def __init__(self, hosts: list[GeneratedHost]):
+    def __init__(
+        self, hosts: list[GeneratedHost], metadata: MetadataVars | None = None
+    ):
+        """With `metadata`, the vars of each metadata value are attached to
+        its group and only host-specific values are left in the hostvars."""
         self.hosts = hosts
+        self.metadata = metadata
 
     def _build_groups(self) -> list[Group]:
         group_filter: dict[str, list[str]] = defaultdict(list)
@@ -45,15 +57,43 @@ class AnsibleInventory:
     def _build_hostvars(self) -> dict[str, dict[str, Any]]:
         return {host.name: host.vars for host in self.hosts}
 
+    def _build_group_vars(self, groups: list[Group]) -> dict[str, dict[str, Any]]:
+        """Attach metadata vars to groups, returns the remaining hostvars
+
+        See `attach_group_vars` and `reduce_hostvars`.
+        """
+        assert self.metadata is not None
+        order, refs = group_priorities(
+            host.vars.get("metadata", {}) for host in self.hosts
+        )
+        group_vars = attach_group_vars(groups, self.metadata, order, refs)
+
+        membership: dict[str, list[str]] = defaultdict(list)
+        for group in groups:
+            for host in group.hosts:
+                membership[host].append(group.name)
+
+        return {
+            host.name: reduce_hostvars(
+                host.name, host.vars, membership[host.name], group_vars, order
+            )
+            for host in self.hosts
+        }
+
     def build(self) -> dict[str, Any]:
         """Builds the inventory"""
         groups = self._build_groups()
         inventory: dict[str, Any] = {}
-        inventory["_meta"] = {"hostvars": self._build_hostvars()}
+        if self.metadata is not None:
+            inventory["_meta"] = {"hostvars": self._build_group_vars(groups)}
+        else:
+            inventory["_meta"] = {"hostvars": self._build_hostvars()}
         all_hosts = set()
 
         for group in groups:
             inventory[group.name] = {"hosts": group.hosts}
+            if group.vars:
+                inventory[group.name]["vars"] = group.vars
             all_hosts.update(group.hosts)
 
         inventory["all"] = {"hosts": list(all_hosts)}
@@ -80,24 +120,242 @@ class AnsibleInventory:
         return str(self.hosts)
 
 
+def group_priorities(
+    hosts_metadata: Iterable[dict],
+) -> tuple[dict[str, int], dict[str, tuple[str, str]]]:
+    """Number groups in the order their metadata first appears on hosts
+
+    Returns the priority of each group and the (type, value) it stands for.
+    """
+    order: dict[str, int] = {}
+    refs: dict[str, tuple[str, str]] = {}
+    for metadata in hosts_metadata:
+        for k, v in metadata.items():
+            for item in v if isinstance(v, list) else [v]:
+                order.setdefault(f"{k}_{item}", len(order) + 1)
+                refs[f"{k}_{item}"] = (k, item)
+    return order, refs
+
+
+def attach_group_vars(
+    groups: list[Group],
+    metadata: MetadataVars,
+    order: dict[str, int],
+    refs: dict[str, tuple[str, str]],
+) -> dict[str, dict[str, Any]]:
+    """Set the metadata vars of each group, returns the vars by group name
+
+    Ansible merges the vars of sibling groups ordered by
+    `ansible_group_priority` and name, which is set from `order`.
+    """
+    group_vars: dict[str, dict[str, Any]] = {}
+    for group in groups:
+        if group.name not in refs:
+            continue
+        metadata_type, value = refs[group.name]
+        try:
+            vars = metadata.lookup(metadata_type, value)
+        except ValueError as e:
+            logger.warning(e)
+            continue
+        if vars:
+            group.vars = {**vars, "ansible_group_priority": order[group.name]}
+            group_vars[group.name] = vars
+    return group_vars
+
+
+def reduce_hostvars(
+    name: str,
+    vars: dict[str, Any],
+    groups: list[str],
+    group_vars: dict[str, dict[str, Any]],
+    order: dict[str, int],
+) -> dict[str, Any]:
+    """Leave out the vars Ansible resolves to the same value from the groups
+
+    Any value that differs from what Ansible would resolve from the groups
+    of the host stays, hostvars always take precedence over group vars.
+    """
+    resolved: dict[str, Any] = {}
+    for group in sorted(groups, key=lambda g: (order.get(g, 0), g)):
+        resolved.update(group_vars.get(group, {}))
+
+    if resolved.keys() - vars.keys():
+        logger.warning(
+            f"Groups of {name} define vars that are missing in its "
+            "generated file, consider regenerating the inventory"
+        )
+    return {k: v for k, v in vars.items() if k not in resolved or resolved[k] != v}
+
+
+def get_group_names(metadata: dict | None) -> list[str]:
+    """Return the `<type>_<value>` groups of a host's metadata"""
+    if metadata is None:
+        return ["ungrouped"]
+    groups = []
+    for k, v in metadata.items():
+        for item in v if isinstance(v, list) else [v]:
+            if isinstance(item, str):
+                groups.append(f"{k}_{item}")
+    return groups
+
+
+_subscript = re.compile(r"^(.+)\[(-?[0-9]+)(?:(:)(-?[0-9]*))?\]$")
+
+
+def _split_limit(limit: str) -> list[str]:
+    """Split a limit like Ansible, on commas or else on colons"""
+    separator = "," if "," in limit else ":"
+    patterns = []
+    for pattern in limit.split(separator):
+        pattern = pattern.strip()
+        if pattern.startswith("@"):
+            patterns.extend(
+                line.strip() for line in Path(pattern[1:]).read_text().splitlines()
+            )
+        elif pattern:
+            patterns.append(pattern)
+    return [p for p in patterns if p]
+
+
+def _match_pattern(
+    pattern: str, groups: dict[str, list[str]], hosts: list[str], known: set[str]
+) -> list[str]:
+    """Return the hosts matching one pattern, in inventory order"""
+    subscript = _subscript.match(pattern) if not pattern.startswith("~") else None
+    if subscript:
+        pattern = subscript.group(1)
+
+    if pattern in ("all", "*"):
+        matched = list(hosts)
+    elif pattern.startswith("~") or any(c in pattern for c in "*?["):
+        regex = re.compile(pattern[1:]) if pattern.startswith("~") else None
+        matches = regex.match if regex else lambda name: fnmatchcase(name, pattern)
+        found = {}
+        for group, members in groups.items():
+            if matches(group):
+                found.update(dict.fromkeys(members))
+        found.update(dict.fromkeys(h for h in hosts if matches(h)))
+        matched = list(found)
+    else:
+        matched = list(groups.get(pattern, []))
+        if pattern in known and pattern not in matched:
+            matched.append(pattern)
+
+    if subscript:
+        start = int(subscript.group(2))
+        if not subscript.group(3):
+            return matched[start : start + 1 or None]
+        end = subscript.group(4)
+        if not end or int(end) == -1:
+            return matched[start:]
+        return matched[start : int(end) + 1]
+    return matched
+
+
+def select_hosts(
+    limit: str, groups: dict[str, list[str]], hosts: list[str]
+) -> list[str]:
+    """Select hosts with an Ansible `--limit` pattern
+
+    Patterns are host or group names, globs, regexes starting with "~" and
+    "@file" with one pattern per line. Patterns starting with "&" intersect
+    and patterns starting with "!" exclude, they are applied after all others.
+    """
+    patterns = _split_limit(limit)
+    known = set(hosts)
+    positive = [p for p in patterns if p[0] not in "&!"]
+    selected: dict[str, None] = {}
+    for pattern in positive or ["all"]:
+        selected.update(dict.fromkeys(_match_pattern(pattern, groups, hosts, known)))
+
+    for pattern in (p for p in patterns if p[0] == "&"):
+        keep = set(_match_pattern(pattern[1:], groups, hosts, known))
+        selected = {h: None for h in selected if h in keep}
+    for pattern in (p for p in patterns if p[0] == "!"):
+        drop = set(_match_pattern(pattern[1:], groups, hosts, known))
+        selected = {h: None for h in selected if h not in drop}
+
+    return [h for h in hosts if h in selected]
+
+
+def get_limited_hosts(data_dir: SourcePath, limit: str) -> list[GeneratedHost]:
+    """Load the generated hosts matching a limit
+
+    With the host index written by `invgen generate`, only the generated files
+    of matching hosts are read.
+    """
+    groups: dict[str, list[str]] = defaultdict(list)
+    index = load_host_index(data_dir)
+    if index is None:
+        logger.info("No current host index, loading all generated hosts")
+        all_hosts = get_all_generated_hosts(data_dir)
+        for host in all_hosts:
+            for group in get_group_names(host.vars.get("metadata")):
+                groups[group].append(host.name)
+        selected = set(select_hosts(limit, groups, [h.name for h in all_hosts]))
+        return [host for host in all_hosts if host.name in selected]
+
+    for name, entry in index.items():
+        for group in get_group_names(entry["metadata"]):
+            groups[group].append(name)
+    selected = select_hosts(limit, groups, list(index))
+    logger.info(f"Loading {len(selected)} of {len(index)} hosts matching {limit}")
+    return [
+        load_generated_host(data_dir.joinpath(index[name]["file"])) for name in selected
+    ]
+
+
 inventory_app = typer.Typer()
 
 
 @inventory_app.command()
 def inventory(
     source: Path = typer.Option(
-        Path().cwd(), envvar="INVGEN_SOURCE", help="Source directory"
+        Path().cwd(),
+        envvar="INVGEN_SOURCE",
+        help="Source directory or .tar, .tar.zst, .zip archive",
     ),
     pretty: bool = False,
     list_hosts: bool = typer.Option(False, "--list", help="Output inventory"),
-    host: str = typer.Option("", "--host", help="Output hostvars for a host"),
+    host: str = typer.Option(
+        "", "--host", help="Output hostvars for a host", autocompletion=complete_host
+    ),
+    group_vars: bool = typer.Option(
+        False,
+        "--group-vars",
+        envvar="INVGEN_GROUP_VARS",
+        help="Attach metadata vars to their groups instead of every host",
+    ),
+    metadata_source: list[Path] = typer.Option(
+        None,
+        envvar="INVGEN_METADATA_SOURCE",
+        help="Source directories to read metadata from with --group-vars, "
+        + "defaults to the source",
+    ),
+    limit: str = typer.Option(
+        "",
+        "--limit",
+        envvar="INVGEN_LIMIT",
+        help="Only output hosts matching an Ansible --limit pattern",
+    ),
     log_level: str = typer.Option("INFO", help="Log level"),
 ):
     init_logger(log_level)
 
     logger.info(f"Generating inventory from {source}")
-    hosts = get_all_generated_hosts(source)
-    inventory = AnsibleInventory(hosts)
+    data_dir = open_source(source)
+    if limit:
+        hosts = get_limited_hosts(data_dir, limit)
+    else:
+        hosts = get_all_generated_hosts(data_dir)
+
+    metadata = None
+    if group_vars:
+        metadata = build_metadata_vars(
+            [open_source(s) for s in metadata_source] if metadata_source else data_dir
+        )
+    inventory = AnsibleInventory(hosts, metadata)
 
     if list_hosts:
         print(inventory.render(pretty=pretty))
@@ -1,61 +1,302 @@
-from pathlib import Path
-from invgen.files import load_yaml
+from dataclasses import dataclass, field
+
+from invgen.archive import SourcePath
+from invgen.files import load_yaml_cached
 from invgen.logging import logger
+from invgen.tables import (
+    TABLE_SUFFIXES,
+    MetadataTable,
+    is_table,
+    open_table,
+    table_suffix,
+    table_type,
+)
 
 
 class MetadataVars:
+    """Metadata vars by type and value.
+
+    Metadata values can declare `extends:` with other values ("rhel-9" of the
+    same type or "os/rhel-9"). The flattened vars of each value are resolved
+    once and shared by all hosts using it, as are the merged vars of each
+    combination of values. Values are read from their own
+    yaml file or from a row of a metadata table.
+    """
+
     def __init__(self):
         self._metadata = {}
+        self._files: dict[str, dict[str, SourcePath]] = {}
+        self._roots: dict[SourcePath, SourcePath] = {}
+        self._resolved: dict[str, ResolvedMetadata] = {}
+        self._layers: dict[tuple[tuple[str, str], ...], dict[str, ValueWithSource]] = {}
+        self._rows: dict[str, dict[str, MetadataTable]] = {}
 
     def add_metadata(self, name: str):
         logger.info(f"Adding metadata type {name}")
-        self._metadata[name] = {}
+        self._metadata.setdefault(name, {})
+        self._files.setdefault(name, {})
+        self._rows.setdefault(name, {})
 
     def set_vars(self, metadata_type: str, name: str, vars: dict):
         self._metadata[metadata_type][name] = vars
+        self._files[metadata_type].pop(name, None)
+        self._rows[metadata_type].pop(name, None)
+        self._resolved.clear()
+        self._layers.clear()
+
+    def set_file(
+        self,
+        metadata_type: str,
+        name: str,
+        file: SourcePath,
+        root: SourcePath | None = None,
+    ):
+        """Register a metadata file, it is parsed on the first lookup"""
+        self._files[metadata_type][name] = file
+        if root is not None:
+            self._roots[file] = root
+        self._resolved.clear()
+        self._layers.clear()
+        self._metadata[metadata_type].pop(name, None)
+        self._rows[metadata_type].pop(name, None)
+
+    def set_table(self, metadata_type: str, table: MetadataTable):
+        """Register the rows of a metadata table, they are read on the first lookup"""
+        for name in table.names():
+            self._files[metadata_type][name] = table.path
+            self._rows[metadata_type][name] = table
+            self._metadata[metadata_type].pop(name, None)
+        self._resolved.clear()
+        self._layers.clear()
+
+    def get_file(self, metadata_type: str, name: str) -> SourcePath | None:
+        """Return the file a metadata value is read from, if any"""
+        return self._files.get(metadata_type, {}).get(name)
+
+    def get_table(self, metadata_type: str, name: str) -> MetadataTable | None:
+        """Return the table a metadata value is read from, if any"""
+        return self._rows.get(metadata_type, {}).get(name)
+
+    def has(self, metadata_type: str, name: str) -> bool:
+        """Check if a metadata value exists, without parsing it"""
+        return name in self._metadata.get(metadata_type, {}) or (
+            name in self._files.get(metadata_type, {})
+        )
+
+    def types(self) -> list[str]:
+        """Return the names of all metadata types"""
+        return list(self._metadata)
+
+    def names(self, metadata_type: str) -> list[str]:
+        """Return the values of a metadata type, without parsing them"""
+        return list({**self._metadata[metadata_type], **self._files[metadata_type]})
+
+    def iter_files(self):
+        """Yield (type, value, file) of all registered metadata files"""
+        for metadata_type, files in self._files.items():
+            for name, file in files.items():
+                yield metadata_type, name, file
+
+    def _load(self, metadata_type: str, name: str) -> dict:
+        table = self._rows[metadata_type].get(name)
+        if table is not None:
+            vars = table.load(name)
+        else:
+            file = self._files[metadata_type][name]
+            vars = load_yaml_cached(file, self._roots.get(file)) or {}
+        self._metadata[metadata_type][name] = vars
+        return vars
 
     def __repr__(self) -> str:
         return f"MetadataVars({self._metadata})"
 
     def __getattr__(self, name: str):
-        if name in self._metadata:
+        if not name.startswith("_") and name in self._metadata:
+            for key in self._files[name]:
+                if key not in self._metadata[name]:
+                    self._load(name, key)
             return self._metadata[name]
         raise AttributeError(f"'MetadataVars' object has no attribute '{name}'")
 
-    def lookup(self, metadata: str, key: str) -> dict:
-        """
-        raises ValueError if metadata or key not found
-        """
-
-        logger.debug(f"Looking up metadata {metadata}/{key}")
-        try:
-            sub_metadata = dict(getattr(self, metadata))
-        except AttributeError:
+    def _raw(self, metadata: str, key: str) -> dict | None:
+        """Return the vars of a metadata value as written, None if it doesn't exist"""
+        if metadata not in self._metadata:
             raise ValueError(
                 f'Metadata type "{metadata}" not found. Consider adding a directory at "metadata/{metadata}"'
             )
 
-        if key not in sub_metadata:
+        if key in self._metadata[metadata]:
+            return self._metadata[metadata][key]
+        elif key in self._files[metadata]:
+            return self._load(metadata, key)
+        return None
+
+    def resolve(
+        self, metadata: str, key: str, resolving: tuple[str, ...] = ()
+    ) -> "ResolvedMetadata":
+        """Flatten a metadata value and the values it extends, memoized
+
+        raises ValueError if metadata is not found, for unknown parents and
+        for cycles
+        """
+        ref = f"{metadata}/{key}"
+        if ref in self._resolved:
+            return self._resolved[ref]
+        if ref in resolving:
+            cycle = resolving[resolving.index(ref) :] + (ref,)
+            raise ValueError(f"Cycle in metadata extends: {' -> '.join(cycle)}")
+
+        raw = self._raw(metadata, key)
+        if raw is None:
+            if resolving:
+                raise ValueError(f"Metadata {resolving[-1]} extends unknown {ref}")
             logger.warning(
                 f"Metadata {metadata}/{key} not found. "
                 f'Did you forget to add "{key}.yaml" to "metadata/{metadata}/"?'
             )
+            raw = {}
+
+        resolved = ResolvedMetadata({}, {}, [])
+        for parent in _parents(metadata, ref, raw.get("extends")):
+            parent_type, parent_key = parent.split("/", 1)
+            inherited = self.resolve(parent_type, parent_key, resolving + (ref,))
+            resolved.vars.update(inherited.vars)
+            resolved.sources.update(inherited.sources)
+            resolved.chain.extend(r for r in inherited.chain if r not in resolved.chain)
+            for k, sources in inherited.history.items():
+                resolved.history[k] = merge_history(resolved.history.get(k, []), sources)
+
+        for k, v in raw.items():
+            if k != "extends":
+                resolved.vars[k] = v
+                resolved.sources[k] = ref
+                resolved.history[k] = merge_history(resolved.history.get(k, []), [ref])
+        resolved.chain.append(ref)
+
+        self._resolved[ref] = resolved
+        return resolved
 
-        return sub_metadata.get(key, {})
+    def merge(
+        self, signature: tuple[tuple[str, str], ...]
+    ) -> dict[str, "ValueWithSource"]:
+        """Merge the vars of (type, value) pairs in order, memoized per signature
 
+        Hosts with the same metadata in the same order share the merged vars,
+        which must not be changed.
+        raises ValueError like `resolve`
+        """
+        if signature in self._layers:
+            return self._layers[signature]
+
+        layer: dict[str, ValueWithSource] = {}
+        for metadata_type, metadata_value in signature:
+            logger.debug(f"Processing metadata {metadata_type}/{metadata_value}")
+            ref = f"{metadata_type}/{metadata_value}"
+            resolved = self.resolve(metadata_type, metadata_value)
+            for k, v in resolved.vars.items():
+                # Inherited vars name the metadata value that defines them
+                source = resolved.sources[k]
+                previous = layer[k].history if k in layer else []
+                layer[k] = ValueWithSource(
+                    v,
+                    ref if source == ref else f"{ref} (from {source})",
+                    merge_history(previous, resolved.history[k]),
+                )
+
+        self._layers[signature] = layer
+        return layer
+
+    def lookup(self, metadata: str, key: str) -> dict:
+        """
+        raises ValueError if metadata or key not found
+        """
+
+        logger.debug(f"Looking up metadata {metadata}/{key}")
+        return self.resolve(metadata, key).vars
+
+    def get_chain(self, metadata: str, key: str) -> list[str]:
+        """Return the values a metadata value is built from, ending with itself"""
+        return self.resolve(metadata, key).chain
+
+
+@dataclass
+class ResolvedMetadata:
+    """Flattened vars of a metadata value
+
+    `sources` maps each var to the value that defined it, `history` to all
+    values that defined it in merge order. `chain` lists the extended values
+    in merge order, ending with the value itself.
+    """
 
-def build_metadata_vars(data_dir: Path) -> MetadataVars:
+    vars: dict
+    sources: dict[str, str]
+    chain: list[str]
+    history: dict[str, list[str]] = field(default_factory=dict)
+
+
+@dataclass
+class ValueWithSource:
+    """A merged var, `source` names where it comes from
+
+    `history` lists all layers that defined the var in merge order, the last
+    one is the layer whose value is kept.
+    """
+
+    value: dict
+    source: str
+    history: list[str] = field(default_factory=list)
+
+
+def merge_history(history: list[str], sources: list[str]) -> list[str]:
+    """Append sources that define a var, a source defining it again moves last"""
+    return [s for s in history if s not in sources] + sources
+
+
+def _parents(metadata: str, ref: str, extends) -> list[str]:
+    """Normalize `extends` to "<type>/<value>" references"""
+    if extends is None:
+        return []
+    if isinstance(extends, str):
+        extends = [extends]
+    if not isinstance(extends, list) or not all(isinstance(e, str) for e in extends):
+        raise ValueError(f"Invalid extends in metadata {ref}, expected a list of names")
+    return [e if "/" in e else f"{metadata}/{e}" for e in extends]
+
+
+def build_metadata_vars(data_dir: SourcePath | list[SourcePath]) -> MetadataVars:
+    """Index the metadata files of one or more source roots.
+
+    Later roots override metadata values of earlier ones. A metadata type is
+    a directory of yaml files, a bundle (`metadata/<type>.bundle.yaml`), a table
+    (`metadata/<type>.csv`, `.jsonl`, `.sqlite`) or several of them. In the
+    same root, files override values of a bundle, which override rows of a
+    table. Files and rows are only parsed when a host looks them up, bundles
+    are parsed once when they are indexed.
+    """
     vars = MetadataVars()
     logger.info("Getting metadata vars")
-    metadata_dir = data_dir.joinpath("metadata")
+    roots = data_dir if isinstance(data_dir, list) else [data_dir]
 
-    if not metadata_dir.exists():
-        logger.warning(f"Metadata directory {metadata_dir} does not exist")
-        return vars
+    for root in roots:
+        metadata_dir = root.joinpath("metadata")
+
+        if not metadata_dir.exists():
+            logger.warning(f"Metadata directory {metadata_dir} does not exist")
+            continue
 
-    for subdir in metadata_dir.iterdir():
-        if subdir.is_dir():
-            vars.add_metadata(subdir.name)
-            for file in subdir.rglob("*.yaml"):
-                vars.set_vars(subdir.name, file.stem, load_yaml(file))
+        # Sorted, so values declared twice in a root resolve the same way
+        entries = sorted(metadata_dir.iterdir(), key=lambda e: e.name)
+        tables = sorted(
+            (e for e in entries if is_table(e)),
+            key=lambda e: TABLE_SUFFIXES.index(table_suffix(e)),
+        )
+        for entry in tables:
+            metadata_type = table_type(entry)
+            vars.add_metadata(metadata_type)
+            vars.set_table(metadata_type, open_table(entry, metadata_type, root))
+        for subdir in entries:
+            if subdir.is_dir():
+                vars.add_metadata(subdir.name)
+                for file in sorted(subdir.rglob("*.yaml"), key=str):
+                    vars.set_file(subdir.name, file.stem, file, root)
     return vars
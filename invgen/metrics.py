@@ -0,0 +1,187 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from invgen.logging import logger
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def samples(self) -> list[str]: ...
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            lines.extend(self.samples())
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def samples(self) -> list[str]:
+        return [f"{self.name} {_format(self.value)}"]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = value
+
+    def samples(self) -> list[str]:
+        return [f"{self.name} {_format(self.value)}"]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def samples(self) -> list[str]:
+        lines = [
+            f'{self.name}_bucket{{le="{_format(bound)}"}} {count}'
+            for bound, count in zip(self.buckets, self.counts)
+        ]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {_format(self.sum)}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class WatchMetrics:
+    """Counters and histograms maintained by the watch loop"""
+
+    def __init__(self):
+        self.events_received = Counter(
+            "invgen_watch_events_total", "File events received"
+        )
+        self.events_coalesced = Counter(
+            "invgen_watch_events_coalesced_total",
+            "File events merged into an already pending regeneration",
+        )
+        self.pending_events = Gauge(
+            "invgen_watch_pending_events", "File events waiting for regeneration"
+        )
+        self.regenerations = Counter(
+            "invgen_regenerations_total", "Regeneration runs"
+        )
+        self.regeneration_failures = Counter(
+            "invgen_regeneration_failures_total", "Failed regeneration runs"
+        )
+        self.hosts_regenerated = Counter(
+            "invgen_hosts_regenerated_total", "Generated host files written"
+        )
+        self.hosts_skipped = Counter(
+            "invgen_hosts_skipped_total", "Generated host files left unchanged"
+        )
+        self.regeneration_duration = Histogram(
+            "invgen_regeneration_duration_seconds", "Duration of a regeneration run"
+        )
+        self.event_to_output = Histogram(
+            "invgen_event_to_output_seconds",
+            "Time from the first file event to written output",
+        )
+        self.parse_cache_hits = Gauge(
+            "invgen_parse_cache_hits", "Files read from the parse cache"
+        )
+        self.parse_cache_misses = Gauge(
+            "invgen_parse_cache_misses", "Files parsed because they weren't cached"
+        )
+        self.parse_cache_evictions = Gauge(
+            "invgen_parse_cache_evictions",
+            "Parsed files dropped to stay within the memory limit",
+        )
+        self.parse_cache_bytes = Gauge(
+            "invgen_parse_cache_bytes", "Size of the files in the parse cache"
+        )
+
+    def observe_parse_cache(self, stats) -> None:
+        """Copy the counters of the parse cache"""
+        self.parse_cache_hits.set(stats.hits)
+        self.parse_cache_misses.set(stats.misses)
+        self.parse_cache_evictions.set(stats.evictions)
+        self.parse_cache_bytes.set(stats.bytes)
+
+    def metrics(self) -> list[Metric]:
+        return [m for m in vars(self).values() if isinstance(m, Metric)]
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text format"""
+        return "".join(m.render() for m in self.metrics())
+
+
+def write_metrics_file(path: Path, metrics: WatchMetrics) -> None:
+    """Atomically rewrite a metrics file, e.g. for the node exporter textfile collector"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(metrics.render())
+    os.replace(tmp, path)
+
+
+def start_metrics_server(
+    port: int, metrics: WatchMetrics, address: str = "127.0.0.1"
+) -> ThreadingHTTPServer:
+    """Serve metrics on http://address:port/metrics in a background thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(f"Serving metrics on http://{address}:{server.server_port}/metrics")
+    return server
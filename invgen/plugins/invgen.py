@@ -0,0 +1,139 @@
+DOCUMENTATION = r"""
+name: invgen
+short_description: Reads an invgen inventory in-process
+description:
+  - Loads the hosts in the C(generated/) directory of an invgen source and
+    populates groups and hostvars directly, without running C(invgen-ansible)
+    as a script inventory.
+  - The configuration file name must end with C(invgen.yml) or C(invgen.yaml).
+extends_documentation_fragment:
+  - inventory_cache
+options:
+  plugin:
+    description: Token that ensures this is a source file for the invgen plugin.
+    required: true
+    choices: ["invgen"]
+  source:
+    description: Source directory or .tar, .tar.zst, .zip archive.
+    type: path
+    required: true
+    env:
+      - name: INVGEN_SOURCE
+  group_vars:
+    description:
+      - Attach metadata vars to their groups instead of every host.
+      - Metadata is read from the C(metadata/) directory of O(source).
+    type: bool
+    default: false
+    env:
+      - name: INVGEN_GROUP_VARS
+  limit:
+    description:
+      - Only add hosts matching an Ansible --limit pattern, like
+        C(invgen-ansible --limit).
+    type: str
+    default: ""
+    env:
+      - name: INVGEN_LIMIT
+"""
+
+EXAMPLES = r"""
+# inventory.invgen.yml
+plugin: invgen
+source: /srv/inventory
+cache: true
+cache_plugin: jsonfile
+cache_connection: /tmp/invgen-cache
+"""
+
+from pathlib import Path
+from typing import Any
+
+import yaml
+
+try:
+    from ansible.plugins.inventory import BaseInventoryPlugin, Cacheable
+except ImportError:  # pragma: no cover
+    raise ImportError("The invgen inventory plugin requires ansible-core")
+
+from invgen.archive import open_source
+from invgen.files import SafeDumper, VaultPass
+from invgen.hosts import get_all_generated_hosts
+from invgen.inventory import AnsibleInventory, get_limited_hosts
+from invgen.metadata import build_metadata_vars
+
+
+class InventoryModule(BaseInventoryPlugin, Cacheable):
+    NAME = "invgen"
+
+    def verify_file(self, path: str) -> bool:
+        return super().verify_file(path) and path.endswith(
+            ("invgen.yml", "invgen.yaml")
+        )
+
+    def parse(self, inventory, loader, path, cache=True):
+        super().parse(inventory, loader, path, cache)
+        self._read_config_data(path)
+
+        limit = self.get_option("limit") or ""
+        cache_key = self.get_cache_key(path)
+        if limit:
+            cache_key = f"{cache_key}_{limit}"
+        use_cache = self.get_option("cache") and cache
+        update_cache = self.get_option("cache") and not cache
+
+        data = None
+        if use_cache:
+            try:
+                data = self._cache[cache_key]
+            except KeyError:
+                update_cache = True
+
+        if data is None:
+            data = self._build(
+                Path(self.get_option("source")), self.get_option("group_vars"), limit
+            )
+
+        if update_cache:
+            self._cache[cache_key] = data
+
+        self._populate(data)
+
+    def _build(
+        self, source: Path, group_vars: bool = False, limit: str = ""
+    ) -> dict[str, Any]:
+        data_dir = open_source(source)
+        if limit:
+            hosts = get_limited_hosts(data_dir, limit)
+        else:
+            hosts = get_all_generated_hosts(data_dir)
+        metadata = build_metadata_vars(data_dir) if group_vars else None
+        return self._to_ansible(AnsibleInventory(hosts, metadata).build())
+
+    def _to_ansible(self, value: Any) -> Any:
+        """Convert VaultPass values to Ansible's vault objects"""
+        if isinstance(value, VaultPass):
+            # Let Ansible's own loader construct the vault object, its type
+            # differs between ansible-core versions
+            return self.loader.load(yaml.dump(value, Dumper=SafeDumper))
+        elif isinstance(value, dict):
+            return {k: self._to_ansible(v) for k, v in value.items()}
+        elif isinstance(value, list):
+            return [self._to_ansible(v) for v in value]
+        return value
+
+    def _populate(self, data: dict[str, Any]) -> None:
+        for name, group in data.items():
+            if name in ("_meta", "all"):
+                continue
+
+            self.inventory.add_group(name)
+            for host in group.get("hosts", []):
+                self.inventory.add_host(host, group=name)
+            for k, v in group.get("vars", {}).items():
+                self.inventory.set_variable(name, k, v)
+
+        for host, hostvars in data["_meta"]["hostvars"].items():
+            self.inventory.add_host(host)
+            for k, v in hostvars.items():
+                self.inventory.set_variable(host, k, v)
@@ -0,0 +1,155 @@
+import json
+from dataclasses import dataclass, field
+from pathlib import Path, PurePath
+from typing import Any
+
+from invgen.archive import SourcePath
+from invgen.cache import CACHE_DIR, fingerprint
+from invgen.logging import logger
+
+PROVENANCE_INDEX_VERSION = 1
+
+# Stands for the host file of a host in the index
+_HOST_SOURCE = -1
+
+
+@dataclass
+class HostProvenance:
+    """Sources of the vars of a host
+
+    `keys` maps each var to the layers that defined it, the layer whose
+    value is kept comes first, followed by the layers it shadowed.
+    """
+
+    file: str
+    keys: dict[str, list[str]]
+
+    @property
+    def source(self) -> str:
+        """The layer of the host file itself"""
+        return f"hosts/{PurePath(self.file).stem}"
+
+
+@dataclass
+class Provenance:
+    """Where the vars of each generated host come from
+
+    `files` maps metadata values ("os/rhel-9") to the file they were read
+    from. Layers of a host file resolve to the file of the host.
+    """
+
+    hosts: dict[str, HostProvenance] = field(default_factory=dict)
+    files: dict[str, str | None] = field(default_factory=dict)
+
+    def add_host(self, name: str, file: str, keys: dict[str, list[str]]) -> None:
+        self.hosts[name] = HostProvenance(file, keys)
+
+    def get_file(self, host: str, source: str) -> str | None:
+        """Return the file a layer of a host was read from"""
+        if source == self.hosts[host].source:
+            return self.hosts[host].file
+        return self.files.get(source)
+
+    def explain(self, host: str, key: str) -> list[tuple[str, str | None]]:
+        """Return (layer, file) of a var of a host, the winning layer first
+
+        raises KeyError for unknown hosts and vars
+        """
+        return [(s, self.get_file(host, s)) for s in self.hosts[host].keys[key]]
+
+    def hosts_from(self, source: str, key: str) -> list[str]:
+        """Return the hosts whose value for a var comes from a layer or a file"""
+        target = str(Path(source).resolve())
+        resolved: dict[str, str] = {}
+        found = []
+        for name, host in self.hosts.items():
+            sources = host.keys.get(key)
+            if not sources:
+                continue
+            if sources[0] == source:
+                found.append(name)
+                continue
+            file = self.get_file(name, sources[0])
+            if file is None:
+                continue
+            if file not in resolved:
+                resolved[file] = str(Path(file).resolve())
+            if resolved[file] == target:
+                found.append(name)
+        return found
+
+
+def _provenance_path(base_dir: SourcePath) -> SourcePath:
+    return base_dir.joinpath(CACHE_DIR, "provenance.json")
+
+
+def write_provenance_index(output_dir: Path, provenance: Provenance) -> None:
+    """Write the provenance of all hosts
+
+    Layers are stored once and referenced by position, and hosts with the
+    same layers for the same vars share one entry, so hosts using the same
+    metadata cost a few bytes each.
+    """
+    sources: dict[str, int] = {}
+    layouts: dict[str, int] = {}
+    layout_list: list[dict[str, list[int]]] = []
+    hosts: dict[str, list[Any]] = {}
+    for name, host in provenance.hosts.items():
+        layout = {
+            key: [
+                _HOST_SOURCE
+                if s == host.source
+                else sources.setdefault(s, len(sources))
+                for s in layers
+            ]
+            for key, layers in host.keys.items()
+        }
+        layout_key = json.dumps(layout)
+        if layout_key not in layouts:
+            layouts[layout_key] = len(layout_list)
+            layout_list.append(layout)
+        hosts[name] = [host.file, layouts[layout_key]]
+
+    path = _provenance_path(output_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(
+        json.dumps(
+            {
+                "version": PROVENANCE_INDEX_VERSION,
+                "generated": fingerprint(output_dir.joinpath("generated")),
+                "sources": [[s, provenance.files.get(s)] for s in sources],
+                "layouts": layout_list,
+                "hosts": hosts,
+            },
+            separators=(",", ":"),
+        )
+    )
+
+
+def load_provenance_index(base_dir: SourcePath) -> Provenance | None:
+    """Load the provenance of all hosts, None if it is missing or outdated"""
+    path = _provenance_path(base_dir)
+    try:
+        data = json.loads(path.read_text())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable provenance index {path}: {e}")
+        return None
+
+    if data.get("version") != PROVENANCE_INDEX_VERSION or data.get(
+        "generated"
+    ) != fingerprint(base_dir.joinpath("generated")):
+        logger.info(f"Provenance index {path} is outdated")
+        return None
+
+    provenance = Provenance(files=dict(data["sources"]))
+    sources = [s for s, _ in data["sources"]]
+    for name, (file, layout) in data["hosts"].items():
+        host_source = f"hosts/{PurePath(file).stem}"
+        keys = {
+            key: [host_source if i == _HOST_SOURCE else sources[i] for i in layers]
+            for key, layers in data["layouts"][layout].items()
+        }
+        provenance.add_host(name, file, keys)
+    return provenance
@@ -0,0 +1,229 @@
+import re
+from dataclasses import dataclass, field
+from fnmatch import fnmatch, translate
+from typing import Any
+
+from invgen.archive import SourcePath
+from invgen.files import get_includes, load_yaml_cached
+
+RULES_FILE = "rules.yaml"
+RULE_KEYS = ("name", "hosts", "regex", "vars", "metadata")
+
+
+@dataclass
+class Rule:
+    """Metadata assigned to the hosts matching a rule
+
+    A host matches if its name matches one of `hosts` (globs) or `regex`, and
+    all `vars` predicates ("<var>" or "<var>.<key>" to a glob or a value)
+    hold. Without name patterns, a rule matches hosts by their vars only.
+    """
+
+    name: str
+    metadata: dict[str, str | list[str]]
+    hosts: list[str] = field(default_factory=list)
+    regex: list[str] = field(default_factory=list)
+    vars: dict[str, Any] = field(default_factory=dict)
+    file: SourcePath | None = None
+
+    @property
+    def source(self) -> str:
+        """The layer of the rule in provenance"""
+        return f"rules/{self.name}"
+
+    def matches_vars(self, host_vars: dict) -> bool:
+        for path, expected in self.vars.items():
+            value = _get_var(host_vars, path)
+            values = value if isinstance(value, list) else [value]
+            if isinstance(expected, str):
+                if not any(isinstance(v, str) and fnmatch(v, expected) for v in values):
+                    return False
+            elif value != expected and expected not in values:
+                return False
+        return True
+
+
+_missing = object()
+
+
+def _get_var(host_vars: dict, path: str) -> Any:
+    """Look up a var by its dotted path, None if it doesn't exist"""
+    value: Any = host_vars
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key, _missing)
+        if value is _missing:
+            return None
+    return value
+
+
+class RuleSet:
+    """The rules of one or more source roots, in the order they are applied
+
+    The name patterns of all rules are compiled into one regex with a
+    lookahead per rule, so matching a host name against all rules is a
+    single regex match.
+    """
+
+    def __init__(
+        self, rules: list[Rule] | None = None, files: list[SourcePath] | None = None
+    ):
+        self.rules = rules or []
+        # Rules files and their includes, including missing ones, which
+        # are dependencies of every host
+        self.files = files or []
+        self._sources = {rule.source: rule.file for rule in self.rules}
+        try:
+            self._matcher = re.compile(
+                "".join(
+                    f"(?:(?=(?P<r{i}>{_name_pattern(rule)})))?"
+                    for i, rule in enumerate(self.rules)
+                    if rule.hosts or rule.regex
+                )
+            )
+        except re.error as e:
+            raise ValueError(f"Invalid combination of rule regexes: {e}")
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    def get_file(self, source: str) -> SourcePath | None:
+        """Return the rules file a rule layer ("rules/<name>") was read from"""
+        return self._sources.get(source)
+
+    def match(self, name: str, host_vars: dict) -> list[Rule]:
+        """Return the rules matching a host, in the order they are applied"""
+        if not self.rules:
+            return []
+        groups = self._matcher.match(name).groupdict()
+        return [
+            rule
+            for i, rule in enumerate(self.rules)
+            if (not (rule.hosts or rule.regex) or groups[f"r{i}"] is not None)
+            and rule.matches_vars(host_vars)
+        ]
+
+
+def _name_pattern(rule: Rule) -> str:
+    """A regex matching the host names of a rule from the start of the name"""
+    patterns = [translate(glob) for glob in rule.hosts]
+    patterns += [f"(?s:.*?)(?:{regex})" for regex in rule.regex]
+    return "|".join(f"(?:{p})" for p in patterns)
+
+
+def assign_metadata(host_vars: dict, rules: list[Rule]) -> dict:
+    """Add the metadata of matching rules to the vars of a host
+
+    Later rules override earlier ones, metadata of the host overrides both.
+    """
+    assigned: dict = {}
+    for rule in rules:
+        assigned.update(rule.metadata)
+    own = host_vars.get("metadata")
+    if own is None:
+        own = {}
+    elif not isinstance(own, dict):
+        return host_vars
+    assigned = {k: v for k, v in assigned.items() if k not in own}
+    return {**host_vars, "metadata": {**assigned, **own}}
+
+
+def _as_list(value: Any, what: str) -> list[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list) and all(isinstance(v, str) for v in value):
+        return value
+    raise ValueError(f"{what} must be a string or a list of strings")
+
+
+_global_flags = re.compile(r"\(\?([aiLmsux]+)\)")
+
+
+def _scope_flags(regex: str) -> str:
+    """Turn leading global inline flags into scoped ones, e.g. (?i)^db into (?i:^db)
+
+    Rules share one compiled regex, where global flags are only allowed at
+    its start.
+    """
+    flags = ""
+    while match := _global_flags.match(regex):
+        flags += match.group(1)
+        regex = regex[match.end() :]
+    return f"(?{flags}:{regex})" if flags else regex
+
+
+def parse_rules(data: Any, file: SourcePath) -> list[Rule]:
+    """Validate the rules of a rules file
+
+    raises ValueError for invalid rules
+    """
+    if data is None:
+        return []
+    if not isinstance(data, list):
+        raise ValueError(f"{file}: expected a list of rules")
+
+    rules = []
+    for i, item in enumerate(data, 1):
+        label = f"{file}: rule {i}"
+        if not isinstance(item, dict):
+            raise ValueError(f"{label} is not a mapping")
+        unknown = [k for k in item if k not in RULE_KEYS]
+        if unknown:
+            raise ValueError(f"{label} has unknown keys {', '.join(map(str, unknown))}")
+
+        metadata = item.get("metadata")
+        if not isinstance(metadata, dict) or not metadata:
+            raise ValueError(f"{label} assigns no metadata")
+        for metadata_type, value in metadata.items():
+            _as_list(value, f"{label} metadata {metadata_type}")
+
+        predicates = item.get("vars") or {}
+        if not isinstance(predicates, dict):
+            raise ValueError(f"{label} vars must be a mapping")
+
+        regexes = [
+            _scope_flags(regex) for regex in _as_list(item.get("regex"), f"{label} regex")
+        ]
+        for regex in regexes:
+            try:
+                compiled = re.compile(regex)
+            except re.error as e:
+                raise ValueError(f"{label} has an invalid regex {regex!r}: {e}")
+            # Rules share one compiled regex, references to groups would
+            # point to groups of other rules
+            if compiled.groupindex or re.search(r"\\[1-9]", regex):
+                raise ValueError(
+                    f"{label} regex {regex!r} must not use named groups or backreferences"
+                )
+
+        rule = Rule(
+            name=str(item.get("name", i)),
+            metadata=metadata,
+            hosts=_as_list(item.get("hosts"), f"{label} hosts"),
+            regex=regexes,
+            vars=predicates,
+            file=file,
+        )
+        rules.append(rule)
+    return rules
+
+
+def load_rules(data_dir: SourcePath | list[SourcePath]) -> RuleSet:
+    """Load the `rules.yaml` of one or more source roots
+
+    Rules of later roots are applied after those of earlier roots.
+    raises ValueError for invalid rules files
+    """
+    roots = data_dir if isinstance(data_dir, list) else [data_dir]
+    rules: list[Rule] = []
+    files: list[SourcePath] = []
+    for root in roots:
+        file = root.joinpath(RULES_FILE)
+        files.append(file)
+        if file.is_file():
+            rules.extend(parse_rules(load_yaml_cached(file, root), file))
+            files.extend(get_includes(file))
+    return RuleSet(rules, files)
@@ -0,0 +1,250 @@
+import hashlib
+import json
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any
+
+from invgen.archive import ArchivePath, SourcePath
+from invgen.hosts import (
+    GENERATED_FORMATS,
+    get_all_host_files,
+    get_generated_host_path,
+    iter_host_entries,
+    iter_metadata,
+)
+from invgen.inventory import get_group_names
+from invgen.logging import logger
+from invgen.metadata import build_metadata_vars
+from invgen.rules import load_rules
+
+
+@dataclass
+class MetadataStats:
+    """Size of a metadata file and the bytes its vars add to the inventory"""
+
+    ref: str
+    file: str
+    file_bytes: int
+    serialized_bytes: int | None = None
+    hosts: int = 0
+    contributed_bytes: int = 0
+
+
+@dataclass
+class InventoryStats:
+    hosts: int = 0
+    groups: Counter = field(default_factory=Counter)
+    host_bytes: dict[str, int] = field(default_factory=dict)
+    generated_bytes: dict[str, int] = field(default_factory=dict)
+    metadata: dict[str, MetadataStats] = field(default_factory=dict)
+    list_bytes: int = 0
+    unique_bytes: int = 0
+    unused_metadata: list[str] = field(default_factory=list)
+    unresolved: list[tuple[str, str]] = field(default_factory=list)
+
+    @property
+    def duplicated_bytes(self) -> int:
+        return self.list_bytes - self.unique_bytes
+
+    @property
+    def duplication_ratio(self) -> float:
+        return self.duplicated_bytes / self.unique_bytes if self.unique_bytes else 0.0
+
+    def to_dict(self, top: int | None = None) -> dict[str, Any]:
+        largest = sorted(self.host_bytes.items(), key=lambda i: -i[1])[:top]
+        contributors = sorted(
+            self.metadata.values(), key=lambda m: -m.contributed_bytes
+        )[:top]
+        return {
+            "hosts": self.hosts,
+            "groups": dict(self.groups.most_common(top)),
+            "group_count": len(self.groups),
+            "list_bytes": self.list_bytes,
+            "unique_bytes": self.unique_bytes,
+            "duplicated_bytes": self.duplicated_bytes,
+            "duplication_ratio": round(self.duplication_ratio, 3),
+            "largest_hosts": [
+                {
+                    "name": name,
+                    "bytes": size,
+                    "generated_bytes": self.generated_bytes.get(name),
+                }
+                for name, size in largest
+            ],
+            "metadata": [vars(m) for m in contributors],
+            "unused_metadata": self.unused_metadata,
+            "unresolved": [
+                {"host": host, "reference": ref} for host, ref in self.unresolved
+            ],
+        }
+
+
+def _fragment(key: str, value: Any) -> tuple[int, bytes]:
+    """Size and digest of a var as serialized in the `--list` hostvars"""
+    fragment = json.dumps({key: value}, default=str)[1:-1].encode()
+    return len(fragment), hashlib.blake2b(fragment, digest_size=8).digest()
+
+
+def _file_size(file: SourcePath) -> int:
+    if isinstance(file, ArchivePath):
+        return len(file.read_bytes())
+    return file.stat().st_size
+
+
+def collect_stats(
+    data_dir: SourcePath | list[SourcePath], output_dir: SourcePath | None = None
+) -> InventoryStats:
+    """Collect size statistics in a single pass over all hosts
+
+    Sizes of generated files are read from `output_dir`, which defaults to
+    the first root.
+
+    Each host is merged on its own and dropped afterwards. Only the digests of
+    distinct serialized vars are kept to measure duplication, and vars shared
+    by reference from metadata are serialized once.
+    """
+    roots = data_dir if isinstance(data_dir, list) else [data_dir]
+    output_dir = output_dir or roots[0]
+    metadata = build_metadata_vars(roots)
+    rules = load_rules(roots)
+    stats = InventoryStats()
+    for metadata_type, value, file in metadata.iter_files():
+        ref = f"{metadata_type}/{value}"
+        table = metadata.get_table(metadata_type, value)
+        if table is None:
+            stats.metadata[ref] = MetadataStats(ref, str(file), _file_size(file))
+        else:
+            stats.metadata[ref] = MetadataStats(
+                ref, f"{file}#{value}", table.size(value)
+            )
+
+    used: set[str] = set()
+    seen: set[str] = set()
+    unique: set[bytes] = set()
+    shared: dict[tuple[str, int], tuple[int, bytes]] = {}
+
+    # Later roots override hosts of earlier roots, so they are read first
+    for root in reversed(roots):
+        for host_file in get_all_host_files(root):
+            for entry in iter_host_entries(host_file, root, rules):
+                if entry.name in seen:
+                    continue
+                seen.add(entry.name)
+                host_vars = entry.vars
+
+                merged: dict[str, tuple[Any, str | None]] = {}
+                host_refs: set[str] = set()
+                try:
+                    references = list(iter_metadata(host_vars))
+                except ValueError as e:
+                    stats.unresolved.append((entry.name, str(e)))
+                    references = []
+                for metadata_type, value in references:
+                    ref = f"{metadata_type}/{value}"
+                    if not metadata.has(metadata_type, value):
+                        stats.unresolved.append((entry.name, ref))
+                        continue
+                    try:
+                        resolved = metadata.resolve(metadata_type, value)
+                    except ValueError as e:
+                        stats.unresolved.append((entry.name, str(e)))
+                        continue
+                    host_refs.update(resolved.chain)
+                    for k, v in resolved.vars.items():
+                        merged[k] = (v, resolved.sources[k])
+                for k, v in host_vars.items():
+                    merged[k] = (v, None)
+                merged.setdefault("metadata", ({}, None))
+
+                # Braces and separators count as unique bytes
+                size = 2 + max(len(merged) - 1, 0) * 2
+                stats.unique_bytes += size
+                for k, (v, source) in merged.items():
+                    if source is None:
+                        fragment_size, digest = _fragment(k, v)
+                    else:
+                        key = (k, id(v))
+                        if key not in shared:
+                            shared[key] = _fragment(k, v)
+                        fragment_size, digest = shared[key]
+                        if source in stats.metadata:
+                            stats.metadata[source].contributed_bytes += fragment_size
+                    size += fragment_size
+                    if digest not in unique:
+                        unique.add(digest)
+                        stats.unique_bytes += fragment_size
+
+                used.update(host_refs)
+                for ref in host_refs & stats.metadata.keys():
+                    stats.metadata[ref].hosts += 1
+                stats.hosts += 1
+                stats.list_bytes += size
+                stats.host_bytes[entry.name] = size
+                host_metadata = merged["metadata"][0]
+                if isinstance(host_metadata, dict):
+                    stats.groups.update(get_group_names(host_metadata))
+                for format in GENERATED_FORMATS:
+                    path = get_generated_host_path(output_dir, entry.name, format)
+                    if path.is_file():
+                        stats.generated_bytes[entry.name] = _file_size(path)
+
+    for ref, item in stats.metadata.items():
+        if ref not in used:
+            stats.unused_metadata.append(item.file)
+        elif item.serialized_bytes is None:
+            metadata_type, value = ref.split("/", 1)
+            resolved = metadata.resolve(metadata_type, value)
+            item.serialized_bytes = sum(
+                (shared.get((k, id(v))) or _fragment(k, v))[0]
+                for k, v in resolved.vars.items()
+                if resolved.sources[k] == ref
+            )
+
+    logger.info(f"Collected stats of {stats.hosts} hosts")
+    return stats
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def render_stats(stats: InventoryStats, top: int = 10) -> str:
+    """Render a human readable report"""
+    lines = [
+        f"=> Hosts: {stats.hosts}",
+        f"=> Hostvars in --list: {format_bytes(stats.list_bytes)}, "
+        + f"{format_bytes(stats.unique_bytes)} unique, "
+        + f"{format_bytes(stats.duplicated_bytes)} duplicated "
+        + f"(ratio {stats.duplication_ratio:.2f})",
+        f"=> Groups: {len(stats.groups)}",
+    ]
+    for group, count in stats.groups.most_common(top):
+        lines.append(f"  {group}: {count} hosts")
+
+    lines.append("=> Largest hosts")
+    for name, size in sorted(stats.host_bytes.items(), key=lambda i: -i[1])[:top]:
+        generated = stats.generated_bytes.get(name)
+        suffix = f" (generated {format_bytes(generated)})" if generated else ""
+        lines.append(f"  {name}: {format_bytes(size)}{suffix}")
+
+    lines.append("=> Metadata contributing the most bytes")
+    contributors = sorted(stats.metadata.values(), key=lambda m: -m.contributed_bytes)
+    for item in contributors[:top]:
+        if not item.contributed_bytes:
+            break
+        lines.append(
+            f"  {item.ref}: {format_bytes(item.contributed_bytes)} over "
+            + f"{item.hosts} hosts (file {format_bytes(item.file_bytes)})"
+        )
+
+    if stats.unused_metadata:
+        lines.append(f"=> Unused metadata files: {len(stats.unused_metadata)}")
+        lines.extend(f"  {file}" for file in stats.unused_metadata)
+    if stats.unresolved:
+        lines.append(f"=> Unresolved metadata references: {len(stats.unresolved)}")
+        lines.extend(f"  {host}: {ref}" for host, ref in stats.unresolved)
+    return "\n".join(lines)
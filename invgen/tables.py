@@ -0,0 +1,371 @@
+import csv
+import io
+import json
+import re
+import sqlite3
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, BinaryIO, Iterator
+
+import yaml
+
+from invgen.archive import ArchivePath, SourcePath
+from invgen.files import dump_yaml, load_yaml, load_yaml_cached
+from invgen.logging import logger
+
+# Other yaml files in metadata/, e.g. a README.yaml, are not metadata types
+BUNDLE_SUFFIX = ".bundle.yaml"
+# Tables of later suffixes override rows of the same name of earlier ones
+TABLE_SUFFIXES = (".csv", ".jsonl", ".sqlite", ".db", BUNDLE_SUFFIX)
+NAME_COLUMN = "name"
+
+
+def table_suffix(path: SourcePath) -> str | None:
+    """Return the table suffix of a path, None if it isn't a table"""
+    for suffix in TABLE_SUFFIXES:
+        if path.name.endswith(suffix) and path.name != suffix:
+            return suffix
+    return None
+
+
+def table_type(path: SourcePath) -> str:
+    """Return the metadata type of a table, its name without the suffix"""
+    return path.name.removesuffix(table_suffix(path) or path.suffix)
+
+
+def is_table(path: SourcePath) -> bool:
+    """Check if a path is a tabular metadata source"""
+    return table_suffix(path) is not None and path.is_file()
+
+
+class MetadataTable(ABC):
+    """A metadata type stored as rows of one file, one metadata value per row.
+
+    The `name` column (or field) of a row is its metadata value, the other
+    columns are its vars. Rows are indexed by name when the table is opened
+    and only turned into vars when a host references them.
+    """
+
+    def __init__(self, path: SourcePath, metadata_type: str):
+        self.path = path
+        self.metadata_type = metadata_type
+
+    @abstractmethod
+    def names(self) -> list[str]: ...
+
+    @abstractmethod
+    def load(self, name: str) -> dict[str, Any]: ...
+
+    @abstractmethod
+    def size(self, name: str) -> int:
+        """Size of a row in the table, in bytes"""
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({str(self.path)!r})"
+
+
+def _open_binary(path: SourcePath) -> BinaryIO:
+    if isinstance(path, ArchivePath):
+        return io.BytesIO(path.read_bytes())
+    return open(path, "rb")
+
+
+def _lines(f: BinaryIO) -> Iterator[tuple[int, bytes]]:
+    """Yield (offset, line) of a binary file"""
+    offset = f.tell()
+    for line in f:
+        yield offset, line
+        offset += len(line)
+
+
+class _OffsetTable(MetadataTable):
+    """A text table indexed by the byte range of each row"""
+
+    def __init__(self, path: SourcePath, metadata_type: str):
+        super().__init__(path, metadata_type)
+        self._index: dict[str, tuple[int, int]] = {}
+        with _open_binary(path) as f:
+            self._scan(f)
+        logger.info(f"Indexed {len(self._index)} rows of metadata table {path}")
+
+    def _add(self, name: Any, offset: int, length: int) -> None:
+        if not isinstance(name, str) or not name:
+            raise ValueError(
+                f"Row at byte {offset} of metadata table {self.path} has no "
+                + f"{NAME_COLUMN}"
+            )
+        if name in self._index:
+            logger.warning(f"Metadata {name} is declared twice in {self.path}")
+        self._index[name] = (offset, length)
+
+    @abstractmethod
+    def _scan(self, f: BinaryIO) -> None: ...
+
+    @abstractmethod
+    def _parse(self, row: bytes) -> dict[str, Any]: ...
+
+    def _read(self, name: str) -> bytes:
+        offset, length = self._index[name]
+        with _open_binary(self.path) as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def names(self) -> list[str]:
+        return list(self._index)
+
+    def load(self, name: str) -> dict[str, Any]:
+        return self._parse(self._read(name))
+
+    def size(self, name: str) -> int:
+        return self._index[name][1]
+
+
+_CELL_BOOL = r"true|True|TRUE|false|False|FALSE"
+_CELL_INT = r"-?(?:0|[1-9][0-9]*)"
+_CELL_FLOAT = r"-?(?:0|[1-9][0-9]*)\.[0-9]+(?:[eE][-+]?[0-9]+)?"
+# Cells that are typed, other cells are strings
+_typed_cell = re.compile(
+    rf"{_CELL_BOOL}|{_CELL_INT}|{_CELL_FLOAT}|\[.*\]|\{{.*\}}|'.*'|\".*\"",
+    re.DOTALL,
+)
+
+
+class _CellLoader(yaml.SafeLoader):
+    """Yaml loader that only resolves true, false and plain numbers
+
+    Octal and sexagesimal numbers, null, .inf or yes and no are strings.
+    """
+
+    yaml_implicit_resolvers: dict = {}
+
+
+for _tag, _pattern, _first in (
+    ("bool", _CELL_BOOL, "tTfF"),
+    ("int", _CELL_INT, "-0123456789"),
+    ("float", _CELL_FLOAT, "-0123456789"),
+):
+    _CellLoader.add_implicit_resolver(
+        f"tag:yaml.org,2002:{_tag}", re.compile(rf"^(?:{_pattern})$"), list(_first)
+    )
+
+
+def _cell(value: str) -> Any:
+    """Parse a CSV cell, cells are strings unless they are typed
+
+    Typed cells are plain numbers, true and false, quoted strings and flow
+    collections like [a, b].
+    """
+    if not _typed_cell.fullmatch(value):
+        return value
+    try:
+        return yaml.load(value, Loader=_CellLoader)
+    except yaml.YAMLError:
+        return value
+
+
+class CsvTable(_OffsetTable):
+    """CSV table with a header row, empty cells are left out of the vars"""
+
+    def _scan(self, f: BinaryIO) -> None:
+        lines = _lines(f)
+        position = [0]
+
+        def decoded():
+            for offset, line in lines:
+                position[0] = offset + len(line)
+                yield line.decode("utf-8-sig")
+
+        reader = csv.reader(decoded())
+        self._header = next(reader, [])
+        if NAME_COLUMN not in self._header:
+            raise ValueError(f"Metadata table {self.path} has no {NAME_COLUMN} column")
+        column = self._header.index(NAME_COLUMN)
+        start = position[0]
+        for row in reader:
+            if any(row):
+                name = row[column] if column < len(row) else None
+                self._add(name, start, position[0] - start)
+            start = position[0]
+
+    def _parse(self, row: bytes) -> dict[str, Any]:
+        values = next(csv.reader(io.StringIO(row.decode("utf-8"))))
+        return {
+            k: _cell(v)
+            for k, v in zip(self._header, values)
+            if k != NAME_COLUMN and v != ""
+        }
+
+
+class JsonlTable(_OffsetTable):
+    """JSON lines table, one object per line"""
+
+    def _scan(self, f: BinaryIO) -> None:
+        for offset, line in _lines(f):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Invalid row at byte {offset} of {self.path}: {e}")
+            if not isinstance(row, dict):
+                raise ValueError(f"Row at byte {offset} of {self.path} is not an object")
+            self._add(row.get(NAME_COLUMN), offset, len(line))
+
+    def _parse(self, row: bytes) -> dict[str, Any]:
+        vars = json.loads(row)
+        vars.pop(NAME_COLUMN, None)
+        return vars
+
+
+class SqliteTable(MetadataTable):
+    """SQLite table named after the metadata type, or the only table of the file
+
+    Rows are looked up with a query on the `name` column, declaring it as
+    primary key or indexing it keeps lookups fast. NULL values are left out
+    of the vars.
+    """
+
+    def __init__(self, path: SourcePath, metadata_type: str):
+        super().__init__(path, metadata_type)
+        if isinstance(path, ArchivePath):
+            self._db = sqlite3.connect(":memory:", check_same_thread=False)
+            self._db.deserialize(path.read_bytes())
+        else:
+            self._db = sqlite3.connect(
+                f"{path.resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False
+            )
+        tables = [
+            row[0]
+            for row in self._db.execute(
+                "SELECT name FROM sqlite_master WHERE type IN ('table', 'view')"
+            )
+        ]
+        if metadata_type in tables:
+            self._table = metadata_type
+        elif len(tables) == 1:
+            self._table = tables[0]
+        else:
+            raise ValueError(
+                f"Metadata table {path} needs a table named {metadata_type}"
+            )
+        columns = [
+            row[1] for row in self._db.execute(f"PRAGMA table_info({self._quoted})")
+        ]
+        if NAME_COLUMN not in columns:
+            raise ValueError(f"Metadata table {path} has no {NAME_COLUMN} column")
+
+    @property
+    def _quoted(self) -> str:
+        return '"' + self._table.replace('"', '""') + '"'
+
+    def names(self) -> list[str]:
+        return [
+            str(row[0])
+            for row in self._db.execute(f"SELECT {NAME_COLUMN} FROM {self._quoted}")
+            if row[0] is not None
+        ]
+
+    def load(self, name: str) -> dict[str, Any]:
+        cursor = self._db.execute(
+            f"SELECT * FROM {self._quoted} WHERE {NAME_COLUMN} = ?", (name,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            raise KeyError(name)
+        columns = [c[0] for c in cursor.description]
+        return {
+            k: v for k, v in zip(columns, row) if k != NAME_COLUMN and v is not None
+        }
+
+    def size(self, name: str) -> int:
+        return len(json.dumps(self.load(name), default=str))
+
+
+class YamlBundle(MetadataTable):
+    """A metadata type as one yaml mapping of values to their vars
+
+    The file is parsed once, through the parse cache, and indexed by value.
+    """
+
+    def __init__(
+        self, path: SourcePath, metadata_type: str, root: SourcePath | None = None
+    ):
+        super().__init__(path, metadata_type)
+        data = load_yaml_cached(path, root)
+        if data is None:
+            data = {}
+        if not isinstance(data, dict):
+            raise ValueError(f"Metadata bundle {path} is not a mapping of values to vars")
+        self._values: dict[str, dict[str, Any]] = {}
+        for name, vars in data.items():
+            if vars is None:
+                vars = {}
+            if not isinstance(vars, dict):
+                raise ValueError(f"Vars of {name} in metadata bundle {path} are not a mapping")
+            self._values[str(name)] = vars
+        logger.info(f"Indexed {len(self._values)} values of metadata bundle {path}")
+
+    def names(self) -> list[str]:
+        return list(self._values)
+
+    def load(self, name: str) -> dict[str, Any]:
+        return self._values[name]
+
+    def size(self, name: str) -> int:
+        return len(dump_yaml({name: self._values[name]}).encode())
+
+
+def append_to_bundle(
+    path: Path, name: str, content: str | None = None, root: Path | None = None
+) -> None:
+    """Append a metadata value to a bundle, the bundle is created if needed
+
+    `content` is the yaml of the vars of the value, e.g. a rendered template,
+    it is indented below the name.
+    raises ValueError if the value exists or the bundle would be invalid
+    """
+    existing = path.read_text() if path.is_file() else ""
+    metadata_type = table_type(path)
+    if existing and name in YamlBundle(path, metadata_type, root).names():
+        raise ValueError(f"Metadata {metadata_type}/{name} already exists in {path}")
+
+    lines = [line for line in (content or "").splitlines() if line.strip() != "---"]
+    key = name if yaml.safe_load(f"{name}: x") == {name: "x"} else json.dumps(name)
+    try:
+        empty = load_yaml(io.StringIO("\n".join(lines)), root) is None
+        if empty:
+            # Only comments, which are kept above the value
+            entry = "".join(f"{line}\n" for line in lines) + f"{key}: {{}}\n"
+        else:
+            entry = f"{key}:\n" + "".join(
+                f"  {line}\n" if line.strip() else "\n" for line in lines
+            )
+        if existing and not existing.endswith("\n"):
+            existing += "\n"
+        data = load_yaml(io.StringIO(existing + entry), root)
+    except yaml.YAMLError as e:
+        raise ValueError(f"Adding {name} to metadata bundle {path} failed: {e}")
+    if not isinstance(data, dict) or not isinstance(data.get(name), dict):
+        raise ValueError(f"Adding {name} to metadata bundle {path} failed, vars must be a mapping")
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(existing + entry)
+
+
+def open_table(
+    path: SourcePath, metadata_type: str, root: SourcePath | None = None
+) -> MetadataTable:
+    """Open and index a tabular metadata source by its suffix
+
+    `!include` paths of bundles are resolved relative to `root`.
+    """
+    suffix = table_suffix(path)
+    if suffix == BUNDLE_SUFFIX:
+        return YamlBundle(path, metadata_type, root)
+    elif suffix == ".csv":
+        return CsvTable(path, metadata_type)
+    elif suffix == ".jsonl":
+        return JsonlTable(path, metadata_type)
+    elif suffix in (".sqlite", ".db"):
+        return SqliteTable(path, metadata_type)
+    raise ValueError(f"Unsupported metadata table {path}")
@@ -1,8 +1,17 @@
-from jinja2 import Environment, FileSystemLoader
+import copy
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable
+
+from jinja2 import Environment, FileSystemLoader, meta, nodes
 from pathlib import Path
 
 import jinja2
 
+from invgen.files import VaultPass
+from invgen.logging import logger
+
 
 def render_template(template_path: Path, undefined_error: bool = True, **kwargs) -> str:
     env = Environment(loader=FileSystemLoader(template_path.parent))
@@ -11,3 +20,213 @@ def render_template(template_path: Path, undefined_error: bool = True, **kwargs)
 
     template = env.get_template(template_path.name)
     return template.render(**kwargs)
+
+
+_vars_env = Environment(undefined=jinja2.StrictUndefined)
+_single_expression = re.compile(r"^\{\{-?(.*?)-?\}\}$", re.DOTALL)
+
+
+@dataclass
+class CompiledExpression:
+    """A var value compiled once and shared by every host using it"""
+
+    render: Callable[[dict], Any]
+    names: frozenset[str]
+
+
+@lru_cache(maxsize=4096)
+def compile_expression(value: str) -> CompiledExpression | None:
+    """Compile a templated var value, returns None if it can't be rendered by invgen"""
+    try:
+        ast = _vars_env.parse(value)
+        names = frozenset(meta.find_undeclared_variables(ast))
+
+        # A value that is a single expression keeps its type, like in Ansible
+        match = _single_expression.match(value)
+        body = ast.body
+        if (
+            match
+            and len(body) == 1
+            and isinstance(body[0], nodes.Output)
+            and len(body[0].nodes) == 1
+            and not isinstance(body[0].nodes[0], nodes.TemplateData)
+        ):
+            expression = _vars_env.compile_expression(match.group(1).strip())
+            return CompiledExpression(lambda context: expression(**context), names)
+
+        template = _vars_env.from_string(value)
+        return CompiledExpression(template.render, names)
+    except jinja2.TemplateError as e:
+        # e.g. filters that only exist in Ansible
+        logger.debug(f"Not rendering {value!r}: {e}")
+        return None
+
+
+def is_templated(value: Any) -> bool:
+    return (
+        isinstance(value, str)
+        and not isinstance(value, VaultPass)
+        and ("{{" in value or "{%" in value)
+    )
+
+
+class VarsRenderer:
+    """Resolves self-contained Jinja expressions against a host's merged vars.
+
+    Expressions that reference a name which is not a var of the host (facts,
+    `hostvars`, `inventory_hostname`, lookups, ...), a vault encrypted var,
+    directly or through other vars, or that can't be compiled are left
+    untouched for Ansible to template at runtime.
+    """
+
+    def __init__(self, host_vars: dict[str, Any]):
+        self.vars = host_vars
+        self.resolved: dict[str, Any] = {}
+        self.unresolved: set[str] = set()
+        self.resolving: list[str] = []
+
+    def render(self) -> dict[str, Any]:
+        for name in self.vars:
+            self.resolve(name)
+        return self.resolved
+
+    def resolve(self, name: str) -> Any:
+        if name in self.resolved:
+            return self.resolved[name]
+        if name in self.resolving:
+            cycle = self.resolving[self.resolving.index(name) :] + [name]
+            raise ValueError(f"Cycle in templated vars: {' -> '.join(cycle)}")
+
+        self.resolving.append(name)
+        value, complete = self._render(self.vars[name])
+        self.resolving.pop()
+
+        if not complete:
+            self.unresolved.add(name)
+        self.resolved[name] = value
+        return value
+
+    def _render(self, value: Any) -> tuple[Any, bool]:
+        """Render a value, returns the value and if it was fully rendered"""
+        # Containers without rendered values are kept, so they stay shared
+        if isinstance(value, dict):
+            rendered = {k: self._render(v) for k, v in value.items()}
+            complete = all(c for _, c in rendered.values())
+            if all(v is value[k] for k, (v, _) in rendered.items()):
+                return value, complete
+            return {k: v for k, (v, _) in rendered.items()}, complete
+        elif isinstance(value, list):
+            items = [self._render(v) for v in value]
+            complete = all(c for _, c in items)
+            if all(v is item for (v, _), item in zip(items, value)):
+                return value, complete
+            return [v for v, _ in items], complete
+        elif isinstance(value, VaultPass):
+            # Only Ansible can decrypt it, expressions using it stay unrendered
+            return value, False
+        elif not is_templated(value):
+            return value, True
+
+        compiled = compile_expression(value)
+        if compiled is None or not compiled.names <= self.vars.keys():
+            return value, False
+
+        context = {name: self.resolve(name) for name in compiled.names}
+        if compiled.names & self.unresolved:
+            return value, False
+
+        try:
+            result = compiled.render(context)
+        except jinja2.TemplateError as e:
+            logger.debug(f"Not rendering {value!r}: {e}")
+            return value, False
+        # An expression can return another var, which must not be the same
+        # object in two places of the output
+        if isinstance(result, (dict, list)):
+            result = copy.deepcopy(result)
+        return result, True
+
+
+def render_vars(host_vars: dict[str, Any]) -> dict[str, Any]:
+    """Render self-contained Jinja expressions in host vars
+
+    raises ValueError if templated vars reference each other in a cycle
+    """
+    return VarsRenderer(host_vars).render()
+
+
+# Per-index values of hosts expanded from a range pattern use `${ }`, which
+# leaves `{{ }}` expressions for Ansible
+_index_env = Environment(
+    variable_start_string="${",
+    variable_end_string="}",
+    block_start_string="${%",
+    block_end_string="%}",
+    comment_start_string="${#",
+    comment_end_string="#}",
+    undefined=jinja2.StrictUndefined,
+    keep_trailing_newline=True,
+)
+_single_index_expression = re.compile(r"^\$\{([^}]*)\}$")
+_index_expression = re.compile(r"\$\{(?![%#])[^}]*\}")
+
+
+@lru_cache(maxsize=4096)
+def compile_index_expression(value: str) -> Callable[[dict], Any]:
+    """Compile a value with `${ }` expressions, shared by all hosts of a range"""
+    # A value that is a single expression keeps its type, e.g. `${ index + 100 }`
+    match = _single_index_expression.match(value)
+    if match:
+        expression = _index_env.compile_expression(match.group(1).strip())
+        return lambda context: expression(**context)
+    return _index_env.from_string(value).render
+
+
+@lru_cache(maxsize=4096)
+def index_expression_names(expression: str) -> frozenset[str] | None:
+    """Names used by a `${ }` expression, None if it isn't a valid expression"""
+    try:
+        return frozenset(meta.find_undeclared_variables(_index_env.parse(expression)))
+    except jinja2.TemplateAssertionError:
+        # e.g. an unknown filter
+        raise
+    except jinja2.TemplateSyntaxError:
+        return None
+
+
+def _render_index_expressions(value: str, context: dict[str, Any]) -> Any:
+    """Render the `${ }` expressions of a value that only use names of the context
+
+    Others, like `${HOME}` in a shell command, are kept as they are.
+    """
+
+    def render(match: re.Match) -> Any:
+        names = index_expression_names(match.group(0))
+        if names is None or not names <= context.keys():
+            return match.group(0)
+        return compile_index_expression(match.group(0))(context)
+
+    if _single_index_expression.match(value):
+        return render(_single_index_expression.match(value))
+    return _index_expression.sub(lambda m: str(render(m)), value)
+
+
+def render_index_vars(value: Any, context: dict[str, Any]) -> Any:
+    """Substitute `${ }` expressions in the vars of a host expanded from a range
+
+    raises ValueError if an expression can't be rendered
+    """
+    if isinstance(value, dict):
+        return {k: render_index_vars(v, context) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [render_index_vars(v, context) for v in value]
+    elif not isinstance(value, str) or isinstance(value, VaultPass) or "${" not in value:
+        return value
+
+    try:
+        # Blocks and comments are rendered as a whole
+        if "${%" in value or "${#" in value:
+            return compile_index_expression(value)(context)
+        return _render_index_expressions(value, context)
+    except jinja2.TemplateError as e:
+        raise ValueError(f"Error rendering {value!r}: {e}")
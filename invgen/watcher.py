@@ -6,24 +6,62 @@ import typer
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
-from invgen.hosts import generate_hosts
+from invgen.cache import CACHE_DIR
+from invgen.export import export_inventory
+from invgen.files import get_includes, parse_cache
+from invgen.hosts import GenerateStats, generate_hosts
 from invgen.logging import logger
+from invgen.metrics import WatchMetrics, start_metrics_server, write_metrics_file
+from invgen.rules import RULES_FILE
+from invgen.tables import TABLE_SUFFIXES
 
 
 class RegenerateHandler(FileSystemEventHandler):
-    def __init__(self, source: Path):
+    def __init__(
+        self,
+        source: Path | list[Path],
+        output: Path | None = None,
+        export: Path | None = None,
+        **generate_options,
+    ):
         self.source = source
+        self.output = output
+        self.export = export
+        self.generate_options = generate_options
         self.pending_regeneration = False
+        self.pending_since: float | None = None
+        self.pending_events = 0
         self.last_processed_time = 0
         self.debounce_time = 0.5  # seconds
+        self.metrics = WatchMetrics()
+
+    def _roots(self) -> list[Path]:
+        return self.source if isinstance(self.source, list) else [self.source]
+
+    def _root_files(self, root: Path) -> set[Path]:
+        """The rules file of a root and the files it includes"""
+        rules = root.joinpath(RULES_FILE)
+        return {
+            Path(os.path.abspath(f))
+            for f in [rules, *get_includes(rules)]
+            if isinstance(f, Path)
+        }
 
     def _should_process(self, event):
-        # Skip events in the generated directory
-        if "generated" in event.src_path:
+        # Skip events in the generated directory and the build state
+        if "generated" in event.src_path or CACHE_DIR in Path(event.src_path).parts:
             return False
 
-        # Only process yaml files
-        if not event.src_path.endswith(".yaml") and not event.is_directory:
+        # The root is only watched for the rules, not e.g. an export or metrics
+        # file written there, which would regenerate again and again
+        path = Path(os.path.abspath(event.src_path))
+        for root in self._roots():
+            root = Path(os.path.abspath(root))
+            if path == root or path.parent == root:
+                return not event.is_directory and path in self._root_files(root)
+
+        # Only process yaml files and metadata tables
+        if not event.src_path.endswith((".yaml",) + TABLE_SUFFIXES) and not event.is_directory:
             return False
 
         return True
@@ -32,10 +70,17 @@ class RegenerateHandler(FileSystemEventHandler):
         if not self._should_process(event):
             return
 
+        self.metrics.events_received.inc()
         current_time = time()
         if current_time - self.last_processed_time < self.debounce_time:
             # If we're within the debounce period, just mark that we need to regenerate
+            if self.pending_regeneration:
+                self.metrics.events_coalesced.inc()
+            else:
+                self.pending_since = current_time
             self.pending_regeneration = True
+            self.pending_events += 1
+            self.metrics.pending_events.set(self.pending_events)
             return
 
         # Otherwise, regenerate now
@@ -43,14 +88,34 @@ class RegenerateHandler(FileSystemEventHandler):
         self.pending_regeneration = False
         self.last_processed_time = current_time
 
-    def _regenerate(self, event):
-        print(f"=> File {event.event_type}: {event.src_path}")
+    def _run_generation(self, event_time: float):
+        """Regenerate hosts and record the run in the metrics"""
+        started = time()
         try:
-            generate_hosts(self.source)
-            print(f"=> Done! Regenerated hosts in {self.source}/generated/")
+            stats = generate_hosts(self.source, self.output, **self.generate_options)
+            print(f"=> Done! Regenerated hosts in {self._output_dir()}/generated/")
+            if self.export is not None:
+                export_inventory(self._output_dir(), self.export)
+            if isinstance(stats, GenerateStats):
+                self.metrics.hosts_regenerated.inc(stats.regenerated)
+                self.metrics.hosts_skipped.inc(stats.skipped)
+            self.metrics.event_to_output.observe(time() - event_time)
+            self.metrics.observe_parse_cache(parse_cache.stats())
         except Exception as e:
             print(f"=> Error regenerating hosts: {e}")
             logger.error(f"Error regenerating hosts: {e}")
+            self.metrics.regeneration_failures.inc()
+        self.metrics.regenerations.inc()
+        self.metrics.regeneration_duration.observe(time() - started)
+
+    def _output_dir(self) -> Path:
+        if self.output is not None:
+            return self.output
+        return self.source[0] if isinstance(self.source, list) else self.source
+
+    def _regenerate(self, event):
+        print(f"=> File {event.event_type}: {event.src_path}")
+        self._run_generation(time())
 
     def on_created(self, event):
         self._schedule_regeneration(event)
@@ -66,32 +131,59 @@ class RegenerateHandler(FileSystemEventHandler):
         current_time = time()
         if self.pending_regeneration and current_time - self.last_processed_time >= self.debounce_time:
             print("=> Processing pending changes...")
-            try:
-                generate_hosts(self.source)
-                print(f"=> Done! Regenerated hosts in {self.source}/generated/")
-            except Exception as e:
-                print(f"=> Error regenerating hosts: {e}")
-                logger.error(f"Error regenerating hosts: {e}")
+            self._run_generation(self.pending_since or current_time)
             self.pending_regeneration = False
+            self.pending_since = None
+            self.pending_events = 0
+            self.metrics.pending_events.set(0)
             self.last_processed_time = current_time
 
 
-def watch_for_changes(source: Path):
-    # Ensure the directories exist
-    os.makedirs(source.joinpath("hosts/"), exist_ok=True)
-    os.makedirs(source.joinpath("metadata/"), exist_ok=True)
-
-    event_handler = RegenerateHandler(source)
+def watch_for_changes(
+    source: Path | list[Path],
+    output: Path | None = None,
+    metrics_file: Path | None = None,
+    metrics_port: int | None = None,
+    metrics_interval: float = 10.0,
+    export: Path | None = None,
+    **generate_options,
+):
+    event_handler = RegenerateHandler(source, output, export, **generate_options)
     observer = Observer()
-    observer.schedule(event_handler, str(source.joinpath("hosts/")), recursive=True)
-    observer.schedule(event_handler, str(source.joinpath("metadata/")), recursive=True)
+    for root in source if isinstance(source, list) else [source]:
+        # Ensure the directories exist
+        os.makedirs(root.joinpath("hosts/"), exist_ok=True)
+        os.makedirs(root.joinpath("metadata/"), exist_ok=True)
+
+        observer.schedule(event_handler, str(root.joinpath("hosts/")), recursive=True)
+        observer.schedule(event_handler, str(root.joinpath("metadata/")), recursive=True)
+        # Shared files for `!include` are commonly kept next to hosts and metadata
+        if root.joinpath("includes/").is_dir():
+            observer.schedule(
+                event_handler, str(root.joinpath("includes/")), recursive=True
+            )
+        # The rules file is kept in the root
+        observer.schedule(event_handler, str(root), recursive=False)
     observer.start()
 
+    server = None
+    if metrics_port is not None:
+        server = start_metrics_server(metrics_port, event_handler.metrics)
+        typer.echo(f"=> Serving metrics on port {server.server_port}")
+
     typer.echo("=> Watching for changes... Press Ctrl+C to stop.")
+    last_metrics_write = 0.0
     try:
         while True:
             event_handler.check_pending()
+            if metrics_file is not None and time() - last_metrics_write >= metrics_interval:
+                write_metrics_file(metrics_file, event_handler.metrics)
+                last_metrics_write = time()
             sleep(0.5)
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+    if server is not None:
+        server.shutdown()
+    if metrics_file is not None:
+        write_metrics_file(metrics_file, event_handler.metrics)
@@ -0,0 +1,132 @@
+import io
+import json
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from invgen import Inventory, api, memory_source
+from invgen.api import write_jsonl
+
+FILES = {
+    "hosts/web.yaml": {
+        "metadata": {"env": "prod"},
+        "hosts": {"web[1:2]": {"ansible_host": "10.0.0.${ index }"}},
+    },
+    "hosts/db1.yaml": "metadata:\n  env: staging\n  role: db\n",
+    "metadata/env/prod.yaml": {"ntp": ["a"], "tier": "prod"},
+    "metadata/env/staging.yaml": {"tier": "staging"},
+    "metadata/role/db.yaml": {"port": 5432},
+}
+
+
+def test_inventory_from_files():
+    inventory = Inventory.from_files(FILES)
+
+    hosts = {host.name: host for host in inventory.iter_hosts()}
+    assert list(hosts) == ["db1", "web1", "web2"]
+    assert hosts["web2"].vars == {
+        "ntp": ["a"],
+        "tier": "prod",
+        "metadata": {"env": "prod"},
+        "ansible_host": "10.0.0.2",
+    }
+    assert hosts["db1"].metadata == {"env": "staging", "role": "db"}
+
+    assert inventory.host_names(limit="env_prod:!web1") == ["web2"]
+    assert [(g.name, g.hosts) for g in inventory.iter_groups()] == [
+        ("env_staging", ["db1"]),
+        ("role_db", ["db1"]),
+        ("env_prod", ["web1", "web2"]),
+    ]
+    assert inventory.get_host("db1").vars["port"] == 5432
+    with pytest.raises(KeyError):
+        inventory.get_host("missing")
+
+    listed = inventory.to_ansible(group_vars=True)
+    assert listed["role_db"]["vars"]["port"] == 5432
+    assert "port" not in listed["_meta"]["hostvars"]["db1"]
+
+
+def test_inventory_layered_sources():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        base = Path(tmpdir) / "base"
+        (base / "hosts").mkdir(parents=True)
+        (base / "metadata" / "env").mkdir(parents=True)
+        (base / "metadata" / "env" / "prod.yaml").write_text("tier: prod\n")
+        (base / "hosts" / "web1.yaml").write_text("metadata:\n  env: prod\n")
+
+        override = memory_source({"metadata/env/prod.yaml": {"tier": "override"}})
+        inventory = Inventory(base, override)
+        assert inventory.get_host("web1").vars["tier"] == "override"
+
+        # Parsed files are reused, edits are picked up
+        (base / "hosts" / "web1.yaml").write_text("metadata:\n  env: prod\nx: 1\n")
+        assert inventory.get_host("web1").vars["x"] == 1
+
+        output = Path(tmpdir) / "output"
+        stats = inventory.generate(output)
+        assert stats.regenerated == 1
+        assert (output / "generated" / "web1.yaml").is_file()
+
+
+def test_inventory_included_file_changed():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        (source / "hosts").mkdir()
+        (source / "shared").mkdir()
+        (source / "metadata" / "env").mkdir(parents=True)
+        (source / "shared" / "a.yaml").write_text("x: 1\n")
+        (source / "metadata" / "env" / "prod.yaml").write_text(
+            "shared: !include shared/a.yaml\n"
+        )
+        (source / "hosts" / "web1.yaml").write_text("metadata:\n  env: prod\n")
+
+        inventory = Inventory(source)
+        assert inventory.get_host("web1").vars["shared"] == {"x": 1}
+
+        (source / "shared" / "a.yaml").write_text("x: 22\n")
+        inventory.refresh()
+        assert inventory.get_host("web1").vars["shared"] == {"x": 22}
+        assert Inventory(source).get_host("web1").vars["shared"] == {"x": 22}
+
+
+def test_inventory_host_index(monkeypatch):
+    calls = []
+    iter_host_entries = api.iter_host_entries
+
+    def counting(host_file, *args):
+        calls.append(host_file.name)
+        return iter_host_entries(host_file, *args)
+
+    monkeypatch.setattr(api, "iter_host_entries", counting)
+    override = memory_source({"hosts/web.yaml": "hosts:\n  web2: {x: 1}\n"})
+    inventory = Inventory(memory_source(FILES), override)
+
+    assert inventory.get_host("web2").vars == {"x": 1, "metadata": {}}
+    calls.clear()
+    # Lookups only read the file declaring the host
+    assert inventory.get_host("db1").metadata["role"] == "db"
+    assert inventory.get_host("web1").vars["tier"] == "prod"
+    assert calls == ["db1.yaml", "web.yaml"]
+    assert [host.name for host in inventory.iter_hosts(limit="env_prod")] == ["web1"]
+    with pytest.raises(KeyError):
+        inventory.get_host("web3")
+
+    inventory.roots.append(memory_source({"hosts/web3.yaml": "metadata: {}\n"}))
+    inventory.refresh()
+    assert inventory.get_host("web3").vars == {"metadata": {}}
+    assert inventory.host_names() == ["db1", "web1", "web2", "web3"]
+
+
+def test_write_jsonl():
+    inventory = Inventory.from_files(FILES)
+    stream = io.StringIO()
+
+    count = write_jsonl(inventory.iter_hosts(only=["web*"], provenance=True), stream)
+
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert count == 2
+    assert records[0]["name"] == "web1"
+    assert records[0]["provenance"]["ansible_host"] == ["hosts/web"]
+    assert records[0]["provenance"]["tier"] == ["env/prod"]
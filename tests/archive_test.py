@@ -0,0 +1,134 @@
+import io
+import os
+import tarfile
+import tempfile
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from invgen.archive import Archive, ArchivePath, is_archive, open_source
+from invgen.files import ParseCache, VaultPass, load_yaml
+from invgen.hosts import generate_hosts, get_all_generated_hosts, get_all_host_files
+from invgen.metadata import build_metadata_vars
+
+MEMBERS = {
+    "hosts/host1.yaml": """metadata:
+  platform: x86-server
+ansible_host: 192.168.1.10
+password: !vault |
+  $ANSIBLE_VAULT;1.1;AES256
+  336366
+""",
+    "metadata/platform/x86-server.yaml": "cpu_arch: x86_64\n",
+    "generated/host1.yaml": "ansible_host: 192.168.1.10\n",
+}
+
+
+def write_tar(path: Path, members: dict[str, str], mode: str = "w"):
+    with tarfile.open(path, mode) as archive:
+        for name, content in members.items():
+            data = content.encode()
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+
+def write_zip(path: Path, members: dict[str, str]):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+
+
+@pytest.fixture
+def tmpdir_path():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        yield Path(tmpdir)
+
+
+@pytest.mark.parametrize("name", ["source.tar", "source.tar.gz", "source.zip"])
+def test_read_archive(tmpdir_path, name):
+    path = tmpdir_path / name
+    if name.endswith(".zip"):
+        write_zip(path, MEMBERS)
+    else:
+        write_tar(path, MEMBERS, "w:gz" if name.endswith(".gz") else "w")
+
+    assert is_archive(path)
+    root = open_source(path)
+    assert isinstance(root, ArchivePath)
+
+    host_files = get_all_host_files(root)
+    assert [f.stem for f in host_files] == ["host1"]
+    host_vars = load_yaml(host_files[0])
+    assert isinstance(host_vars["password"], VaultPass)
+
+    metadata = build_metadata_vars(root)
+    assert metadata.lookup("platform", "x86-server") == {"cpu_arch": "x86_64"}
+
+    generated = get_all_generated_hosts(root)
+    assert generated[0].name == "host1"
+    assert generated[0].vars == {"ansible_host": "192.168.1.10"}
+
+
+def test_read_tar_zst(tmpdir_path):
+    zstandard = pytest.importorskip("zstandard")
+    tar_path = tmpdir_path / "source.tar"
+    write_tar(tar_path, MEMBERS)
+    path = tmpdir_path / "source.tar.zst"
+    path.write_bytes(zstandard.ZstdCompressor().compress(tar_path.read_bytes()))
+
+    root = open_source(path)
+    assert [f.stem for f in get_all_host_files(root)] == ["host1"]
+
+
+def test_archive_strips_wrapping_directory(tmpdir_path):
+    path = tmpdir_path / "source.zip"
+    write_zip(path, {f"inventory/{name}": content for name, content in MEMBERS.items()})
+
+    archive = Archive.read(path)
+    assert set(archive.members) == set(MEMBERS)
+    assert [p.name for p in archive.root.iterdir()] == ["generated", "hosts", "metadata"]
+
+
+def test_generate_hosts_from_archive(tmpdir_path):
+    path = tmpdir_path / "source.tar"
+    write_tar(path, MEMBERS)
+    output = tmpdir_path / "output"
+
+    generate_hosts(open_source(path), output)
+
+    content = (output / "generated" / "host1.yaml").read_text()
+    assert "# platform/x86-server\ncpu_arch: x86_64" in content
+    assert "password: !vault |" in content
+
+    with pytest.raises(ValueError):
+        generate_hosts(open_source(path))
+
+
+def test_directory_is_not_an_archive(tmpdir_path):
+    assert not is_archive(tmpdir_path)
+    assert open_source(tmpdir_path) == tmpdir_path
+
+
+def test_parse_cache_archive_members(tmpdir_path):
+    cache = ParseCache()
+    # In-memory archives never share entries, even if one reuses the id of another
+    for i in range(50):
+        root = Archive(Path("<memory>"), {"a.yaml": f"x: {i % 10}\n".encode()}).root
+        assert cache.get(root / "a.yaml", root, load_yaml) == {"x": i % 10}
+
+    # Members of an archive file are reused until the file changes
+    path = tmpdir_path / "source.tar"
+    write_tar(path, {"a.yaml": "x: 1\n"})
+    first = open_source(path)
+    assert cache.get(first / "a.yaml", first, load_yaml) == {"x": 1}
+    second = open_source(path)
+    hits = cache.stats().hits
+    assert cache.get(second / "a.yaml", second, load_yaml) == {"x": 1}
+    assert cache.stats().hits == hits + 1
+
+    write_tar(path, {"a.yaml": "x: 2\n"})
+    os.utime(path, ns=(1, 1))
+    third = open_source(path)
+    assert cache.get(third / "a.yaml", third, load_yaml) == {"x": 2}
@@ -0,0 +1,60 @@
+import tempfile
+from pathlib import Path
+
+from invgen.cache import BuildCache, fingerprint, source_key
+
+
+def test_fingerprint():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "host.yaml"
+        assert fingerprint(path) is None
+
+        path.write_text("a: 1\n")
+        assert fingerprint(path) == [path.stat().st_mtime_ns, 5]
+
+
+def test_source_key_is_stable():
+    assert source_key(Path("/srv/inventory/team-a")) == source_key(
+        Path("/srv/inventory/team-a/")
+    )
+    assert source_key(Path("/srv/a/team")) != source_key(Path("/srv/b/team"))
+    assert source_key(Path("/srv/a/team")).startswith("team-")
+
+
+def test_build_cache_roundtrip():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root, output = Path(tmpdir, "root"), Path(tmpdir, "out")
+        host = root / "hosts" / "host1.yaml"
+        host.parent.mkdir(parents=True)
+        host.write_text("metadata:\n  os: rhel-9\n")
+        generated = output / "generated" / "host1.yaml"
+        generated.parent.mkdir(parents=True)
+        generated.write_text("content\n")
+
+        cache = BuildCache.load(root, output, {"render_vars": False})
+        assert not cache.is_fresh(host, lambda t, v: None, output)
+        cache.update(
+            host,
+            {"host1": {"os": "rhel-9"}},
+            {"os/rhel-9": None},
+            ["generated/host1.yaml"],
+            output,
+        )
+        cache.save()
+
+        cache = BuildCache.load(root, output, {"render_vars": False})
+        assert cache.is_fresh(host, lambda t, v: None, output)
+        assert cache.get_metadata(host, "host1") == {"os": "rhel-9"}
+
+        # A metadata value that now resolves to a file invalidates the host
+        metadata_file = root / "metadata" / "os" / "rhel-9.yaml"
+        assert not cache.is_fresh(host, lambda t, v: metadata_file, output)
+
+        # Changed options invalidate the whole cache
+        cache = BuildCache.load(root, output, {"render_vars": True})
+        assert cache.files == {}
+
+        # Host files that weren't seen are dropped on save
+        cache = BuildCache.load(root, output, {"render_vars": False})
+        cache.save()
+        assert BuildCache.load(root, output, {"render_vars": False}).files == {}
@@ -1,4 +1,6 @@
+import json
 import os
+import tarfile
 import tempfile
 from pathlib import Path
 from unittest.mock import patch
@@ -119,6 +121,32 @@ ansible_host: {{ name }}
         assert "ansible_host: new-test-host" in content
 
 
+def test_new_metadata_bundle(runner, temp_inventory_dir):
+    template = temp_inventory_dir / "metadata.yaml"
+    template.write_text("---\n# {{ type }}/{{ name }}\nregion: {{ region }}\nracks: [1, 2]\n")
+    bundle = temp_inventory_dir / "metadata" / "site.bundle.yaml"
+
+    def new(name, *args):
+        return runner.invoke(
+            app,
+            ["new", "metadata", "--metadata-type", "site", "--name", name]
+            + ["-s", str(temp_inventory_dir), *args],
+        )
+
+    result = new("fra1", "--bundle", "-t", str(template), "-o", "region=eu-central")
+    assert result.exit_code == 0, result.stdout
+    # An existing bundle is used without --bundle
+    assert new("ams1").exit_code == 0
+    assert not (temp_inventory_dir / "metadata" / "site").exists()
+    assert bundle.read_text() == (
+        "fra1:\n  # site/fra1\n  region: eu-central\n  racks: [1, 2]\nams1: {}\n"
+    )
+
+    result = new("fra1")
+    assert result.exit_code == 1
+    assert "already exists" in result.stdout
+
+
 @patch("invgen.cmd.watch_for_changes")
 def test_generate_with_watch(mock_watch, runner, temp_inventory_dir):
     result = runner.invoke(
@@ -126,7 +154,17 @@ def test_generate_with_watch(mock_watch, runner, temp_inventory_dir):
     )
 
     assert result.exit_code == 0
-    mock_watch.assert_called_once_with(temp_inventory_dir)
+    mock_watch.assert_called_once_with(
+        [temp_inventory_dir],
+        None,
+        metrics_file=None,
+        metrics_port=None,
+        export=None,
+        render_vars=False,
+        format="yaml",
+        only=[],
+        where=[],
+    )
 
 
 @patch("invgen.cmd.shutil.rmtree")
@@ -139,3 +177,128 @@ def test_generate_with_clean(mock_makedirs, mock_rmtree, runner, temp_inventory_
     assert result.exit_code == 0
     mock_rmtree.assert_called_once()
     mock_makedirs.assert_called_once()
+
+
+def test_generate_archive_requires_output(runner, temp_inventory_dir):
+    archive = temp_inventory_dir / "source.tar"
+    with tarfile.open(archive, "w") as f:
+        f.add(temp_inventory_dir / "hosts", arcname="hosts")
+        f.add(temp_inventory_dir / "metadata", arcname="metadata")
+
+    result = runner.invoke(app, ["generate", "--source", str(archive)])
+    assert result.exit_code == 1
+    assert "--output is required" in result.stdout
+
+    output = temp_inventory_dir / "output"
+    result = runner.invoke(
+        app, ["generate", "--source", str(archive), "--output", str(output)]
+    )
+    assert result.exit_code == 0
+    assert (output / "generated" / "test-host.yaml").exists()
+
+
+def test_generate_render_vars(runner, temp_inventory_dir):
+    with open(temp_inventory_dir / "hosts" / "test-host.yaml", "a") as f:
+        f.write('\nurl: "http://{{ ansible_host }}:8080"\n')
+
+    result = runner.invoke(
+        app, ["generate", "--source", str(temp_inventory_dir), "--render-vars"]
+    )
+
+    assert result.exit_code == 0
+    content = (temp_inventory_dir / "generated" / "test-host.yaml").read_text()
+    assert "url: http://192.168.1.100:8080" in content
+
+    with open(temp_inventory_dir / "hosts" / "test-host.yaml", "a") as f:
+        f.write('c1: "{{ c2 }}"\nc2: "{{ c1 }}"\n')
+    result = runner.invoke(
+        app, ["generate", "--source", str(temp_inventory_dir), "--render-vars"]
+    )
+    assert result.exit_code == 1
+    assert "=> Error: Error rendering vars for host test-host" in result.stdout
+
+
+def test_generate_multiple_sources(runner, temp_inventory_dir):
+    team = temp_inventory_dir / "team"
+    os.makedirs(team / "metadata" / "platform")
+    with open(team / "metadata" / "platform" / "test-platform.yaml", "w") as f:
+        f.write("cpu_arch: arm64\n")
+
+    result = runner.invoke(
+        app, ["generate", "-s", str(temp_inventory_dir), "-s", str(team)]
+    )
+    assert result.exit_code == 1
+    assert "--output is required" in result.stdout
+
+    output = temp_inventory_dir / "output"
+    result = runner.invoke(
+        app,
+        ["generate", "-s", str(temp_inventory_dir), "-s", str(team), "-o", str(output)],
+    )
+    assert result.exit_code == 0
+    content = (output / "generated" / "test-host.yaml").read_text()
+    assert "cpu_arch: arm64" in content
+
+
+def test_stats_command(runner, temp_inventory_dir):
+    result = runner.invoke(
+        app, ["stats", "--source", str(temp_inventory_dir), "--json"]
+    )
+    assert result.exit_code == 0
+    report = json.loads(result.stdout)
+    assert report["hosts"] == 1
+    assert report["groups"] == {
+        "platform_test-platform": 1,
+        "environment_test-env": 1,
+    }
+    assert report["unresolved"] == []
+
+
+def test_explain_command(runner, temp_inventory_dir):
+    source = str(temp_inventory_dir)
+    result = runner.invoke(app, ["explain", "--source", source, "test-host", "memory"])
+    assert result.exit_code == 1
+    assert "run invgen generate first" in result.stdout
+
+    assert runner.invoke(app, ["generate", "--source", source]).exit_code == 0
+    result = runner.invoke(app, ["explain", "--source", source, "test-host", "memory"])
+    assert result.exit_code == 0
+    assert "memory of test-host is set by platform/test-platform" in result.stdout
+
+    platform_file = temp_inventory_dir / "metadata" / "platform" / "test-platform.yaml"
+    result = runner.invoke(
+        app, ["explain", "--source", source, "--from", str(platform_file), "cpu_arch"]
+    )
+    assert result.exit_code == 0
+    assert result.stdout.splitlines()[1:] == ["  test-host"]
+
+
+def test_generate_stdout_jsonl(runner, temp_inventory_dir):
+    result = runner.invoke(
+        app,
+        [
+            "generate",
+            "--source",
+            str(temp_inventory_dir),
+            "--stdout",
+            "jsonl",
+            "--provenance",
+        ],
+    )
+    assert result.exit_code == 0
+    records = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [r["name"] for r in records] == ["test-host"]
+    assert records[0]["vars"]["memory"] == "8GB"
+    assert records[0]["provenance"]["memory"] == ["platform/test-platform"]
+    assert not list((temp_inventory_dir / "generated").iterdir())
+
+
+@pytest.mark.parametrize("option", [["--format", "json"], ["--output", "out"]])
+def test_generate_stdout_rejects_file_options(runner, temp_inventory_dir, option):
+    result = runner.invoke(
+        app,
+        ["generate", "--source", str(temp_inventory_dir), "--stdout", "jsonl", *option],
+    )
+    assert result.exit_code == 2
+    assert f"'{option[0]}'" in result.output
+    assert "can't be combined with --stdout" in result.output
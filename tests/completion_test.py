@@ -0,0 +1,78 @@
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from invgen.cache import is_completion_index_current, load_completion_index
+from invgen.completion import (
+    complete_host,
+    complete_metadata_option,
+    complete_metadata_type,
+    get_completion_index,
+)
+from invgen.hosts import generate_hosts
+
+
+def _source(tmpdir: str) -> Path:
+    source = Path(tmpdir)
+    (source / "hosts").mkdir()
+    (source / "metadata" / "os").mkdir(parents=True)
+    (source / "metadata" / "env").mkdir()
+    (source / "metadata" / "os" / "rhel-9.yaml").write_text("{}\n")
+    (source / "metadata" / "os" / "rhel-10.yaml").write_text("{}\n")
+    (source / "metadata" / "env" / "prod.yaml").write_text("{}\n")
+    (source / "hosts" / "web1.yaml").write_text("metadata:\n  os: rhel-9\n")
+    (source / "hosts" / "rack1.yaml").write_text(
+        "hosts:\n  db[1:2]:\n    metadata:\n      os: rhel-10\n"
+    )
+    return source
+
+
+def test_completion_index():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = _source(tmpdir)
+        generate_hosts(source)
+
+        index = load_completion_index(source)
+        assert is_completion_index_current(index)
+        assert index["hosts"] == ["db1", "db2", "web1"]
+        assert index["metadata"] == {"env": ["prod"], "os": ["rhel-10", "rhel-9"]}
+
+        # A current index is used without reading the sources
+        with patch("invgen.completion.get_all_host_files") as walk:
+            assert get_completion_index(source)["hosts"] == ["db1", "db2", "web1"]
+            walk.assert_not_called()
+
+        # Out-of-band edits are picked up and written back
+        time.sleep(0.01)
+        (source / "hosts" / "web2.yaml").write_text("metadata: {}\n")
+        (source / "metadata" / "os" / "rhel-10.yaml").unlink()
+        assert not is_completion_index_current(load_completion_index(source))
+        assert get_completion_index(source)["hosts"] == ["db1", "db2", "web1", "web2"]
+        assert is_completion_index_current(load_completion_index(source))
+        assert load_completion_index(source)["metadata"]["os"] == ["rhel-9"]
+
+        # Host files declaring other names are checked on their own
+        time.sleep(0.01)
+        (source / "hosts" / "rack1.yaml").write_text("hosts:\n  db3: {}\n")
+        assert get_completion_index(source)["hosts"] == ["db3", "web1", "web2"]
+
+
+def test_complete():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = _source(tmpdir)
+        ctx = SimpleNamespace(params={"source": [source], "output": None})
+
+        assert complete_host(ctx, "d") == ["db1", "db2"]
+        assert complete_metadata_type(ctx, "") == ["env", "os"]
+        assert complete_metadata_option(ctx, "o") == ["os="]
+        assert complete_metadata_option(ctx, "os=rhel-1") == ["os=rhel-10"]
+        assert complete_metadata_option(ctx, "name=a os=rhel-9,rhel-1") == [
+            "name=a os=rhel-9,rhel-10"
+        ]
+        # Without a generate run nothing is written
+        assert load_completion_index(source) is None
+
+        ctx = SimpleNamespace(params={"source": Path(tmpdir) / "missing"})
+        assert complete_host(ctx, "") == []
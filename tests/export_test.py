@@ -0,0 +1,115 @@
+import ast
+import shlex
+import tempfile
+from pathlib import Path
+
+import pytest
+import yaml
+
+from invgen.export import export_inventory
+from invgen.files import SafeLoader, VaultPass
+from invgen.hosts import generate_hosts, get_all_generated_hosts
+from invgen.inventory import AnsibleInventory
+from invgen.metadata import build_metadata_vars
+
+
+@pytest.fixture
+def source():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        (source / "hosts").mkdir()
+        (source / "metadata" / "os").mkdir(parents=True)
+        (source / "metadata" / "os" / "rhel-9.yaml").write_text(
+            "selinux: enforcing\npackages: [vim, git]\n"
+        )
+        (source / "hosts" / "web1.yaml").write_text(
+            "metadata:\n  os: rhel-9\nansible_host: 10.0.0.1\nport: 80\n"
+        )
+        (source / "hosts" / "web2.yaml").write_text(
+            "metadata:\n  os: rhel-9\nansible_host: 10.0.0.2\n"
+            + "motd: \"it's a 'test' #1\"\nsettings: {enabled: true, limit: null}\n"
+        )
+        generate_hosts(source)
+        yield source
+
+
+def _parse_ini(content: str) -> tuple[dict, dict, dict]:
+    """Parse the subset of Ansible's INI format the export writes"""
+    hostvars, groups, group_vars = {}, {}, {}
+    section = None
+    for line in content.splitlines():
+        if not line:
+            continue
+        if line.startswith("["):
+            section = line[1:-1]
+            continue
+        if section == "all":
+            name, *values = shlex.split(line, comments=True)
+            hostvars[name] = {}
+            for value in values:
+                k, v = value.split("=", 1)
+                try:
+                    hostvars[name][k] = ast.literal_eval(v)
+                except (ValueError, SyntaxError):
+                    hostvars[name][k] = v
+        elif section.endswith(":vars"):
+            k, v = line.split("=", 1)
+            group_vars.setdefault(section[:-5], {})[k] = ast.literal_eval(v)
+        else:
+            groups.setdefault(section, []).append(line)
+    return hostvars, groups, group_vars
+
+
+def test_export_yaml(source):
+    path = source / "inventory.yaml"
+    metadata = build_metadata_vars(source)
+    export_inventory(source, path, metadata=metadata)
+
+    expected = AnsibleInventory(get_all_generated_hosts(source), metadata).build()
+    exported = yaml.load(path.read_text(), Loader=SafeLoader)["all"]
+    assert exported["hosts"] == expected["_meta"]["hostvars"]
+    assert exported["children"]["os_rhel-9"] == {
+        "hosts": {"web1": None, "web2": None},
+        "vars": expected["os_rhel-9"]["vars"],
+    }
+
+
+def test_export_ini(source):
+    path = source / "inventory.ini"
+    export_inventory(source, path)
+
+    hostvars, groups, _ = _parse_ini(path.read_text())
+    assert hostvars == {h.name: h.vars for h in get_all_generated_hosts(source)}
+    assert groups == {"os_rhel-9": ["web1", "web2"]}
+
+    (source / "hosts" / "web1.yaml").write_text(
+        "metadata:\n  os: rhel-9\npassword: !vault |\n  $ANSIBLE_VAULT;1.1;AES256\n"
+    )
+    generate_hosts(source)
+    with pytest.raises(ValueError, match="Vault"):
+        export_inventory(source, path)
+
+    export_inventory(source, source / "vault.yaml")
+    exported = yaml.load((source / "vault.yaml").read_text(), Loader=SafeLoader)
+    assert isinstance(exported["all"]["hosts"]["web1"]["password"], VaultPass)
+
+
+def test_export_is_incremental(source):
+    path = source / "inventory.yaml"
+    assert export_inventory(source, path).written == 2
+
+    stats = export_inventory(source, path)
+    assert (stats.written, stats.reused) == (0, 2)
+
+    (source / "hosts" / "web2.yaml").write_text(
+        "metadata:\n  os: rhel-9\nansible_host: 10.0.0.20\n"
+    )
+    generate_hosts(source)
+    stats = export_inventory(source, path)
+    assert (stats.written, stats.reused) == (1, 1)
+
+    # Reused entries give the same file as a full export
+    fresh = source / "fresh.yaml"
+    export_inventory(source, fresh)
+    assert path.read_text() == fresh.read_text()
+    assert "10.0.0.20" in path.read_text()
@@ -1,5 +1,20 @@
-from invgen.files import save_yaml, load_yaml
-from tempfile import TemporaryFile
+from invgen.files import (
+    ParseCache,
+    VaultPass,
+    YamlFragments,
+    clear_includes,
+    dump_json,
+    get_includes,
+    load_json,
+    load_yaml_cached,
+    save_yaml,
+    load_yaml,
+)
+from pathlib import Path
+from tempfile import TemporaryDirectory, TemporaryFile
+
+import pytest
+import yaml
 
 
 def test_ansible_yaml_tag():
@@ -19,3 +34,134 @@ def test_ansible_yaml_tag():
             save_yaml(f2, load_yaml(f))
             f2.seek(0)
             assert f2.read() == input
+
+
+def test_json_vault_roundtrip():
+    data = {"password": VaultPass("$ANSIBLE_VAULT;1.1;AES256\n336366\n"), "port": 80}
+
+    content = dump_json(data)
+    assert content == (
+        '{"password":{"__ansible_vault":"$ANSIBLE_VAULT;1.1;AES256\\n336366\\n"},'
+        '"port":80}'
+    )
+
+    with TemporaryFile(mode="w+") as f:
+        f.write(content)
+        f.seek(0)
+        loaded = load_json(f)
+
+    assert loaded == data
+    assert isinstance(loaded["password"], VaultPass)
+
+
+def test_include_tag():
+    with TemporaryDirectory() as tmpdir:
+        root = Path(tmpdir)
+        (root / "includes").mkdir()
+        (root / "includes" / "ca.yaml").write_text("- cert-a\n- cert-b\n")
+        (root / "a.yaml").write_text("ca: !include includes/ca.yaml\n")
+        (root / "b.yaml").write_text("bundle: !include includes/ca.yaml\n")
+
+        clear_includes()
+        a = load_yaml(root / "a.yaml", root)
+        b = load_yaml(root / "b.yaml", root)
+
+        assert a["ca"] == ["cert-a", "cert-b"]
+        # The included file is parsed once and shared by reference
+        assert a["ca"] is b["bundle"]
+        assert get_includes(root / "b.yaml") == [root / "includes" / "ca.yaml"]
+
+        # Without a source root includes can't be resolved
+        with pytest.raises(yaml.YAMLError):
+            load_yaml(root / "a.yaml")
+
+
+def test_include_tag_changed():
+    with TemporaryDirectory() as tmpdir:
+        root = Path(tmpdir)
+        (root / "ntp.yaml").write_text("- a\n")
+        (root / "ca.yaml").write_text("ntp: !include ntp.yaml\n")
+        (root / "host.yaml").write_text("ca: !include ca.yaml\n")
+
+        clear_includes()
+        assert load_yaml(root / "host.yaml", root) == {"ca": {"ntp": ["a"]}}
+
+        # Changes to included files are picked up without clearing includes
+        (root / "ntp.yaml").write_text("- a\n- b\n")
+        assert load_yaml(root / "host.yaml", root) == {"ca": {"ntp": ["a", "b"]}}
+        (root / "ca.yaml").write_text("ntp: !include ntp.yaml\nx: 1\n")
+        assert load_yaml(root / "host.yaml", root)["ca"]["x"] == 1
+
+
+def test_include_cycle():
+    with TemporaryDirectory() as tmpdir:
+        root = Path(tmpdir)
+        (root / "a.yaml").write_text("b: !include b.yaml\n")
+        (root / "b.yaml").write_text("a: !include a.yaml\n")
+
+        clear_includes()
+        with pytest.raises(yaml.YAMLError, match="Include cycle"):
+            load_yaml(root / "a.yaml", root)
+
+
+def test_parse_cache():
+    with TemporaryDirectory() as tmpdir:
+        root = Path(tmpdir)
+        (root / "ca.yaml").write_text("- cert-a\n")
+        host = root / "host.yaml"
+        host.write_text("ca: !include ca.yaml\n")
+        cache = ParseCache(max_bytes=100)
+
+        clear_includes()
+        first = cache.get(host, root, load_yaml)
+        assert cache.get(host, root, load_yaml) is first
+        assert cache.stats().hits == 1
+
+        # Hits restore the includes of the cached file after they were cleared
+        clear_includes()
+        cache.get(host, root, load_yaml)
+        assert get_includes(host) == [root / "ca.yaml"]
+
+        # Changing an included file invalidates the entry
+        (root / "ca.yaml").write_text("- cert-a\n- cert-b\n")
+        assert cache.get(host, root, load_yaml) == {"ca": ["cert-a", "cert-b"]}
+        assert cache.stats().invalidations == 1
+
+        # Entries are evicted by size, least recently used first
+        big = root / "big.yaml"
+        big.write_text(f"data: {'x' * 80}\n")
+        cache.get(big, root, load_yaml)
+        stats = cache.stats()
+        assert stats.evictions == 1
+        assert stats.entries == 1
+        assert stats.bytes <= 100
+
+
+def test_load_yaml_cached_open_file():
+    with TemporaryFile(mode="w+") as f:
+        f.write("a: 1\n")
+        f.seek(0)
+        assert load_yaml_cached(f) == {"a": 1}
+        f.seek(0)
+        f.truncate()
+        f.write("a: 2\n")
+        f.seek(0)
+        assert load_yaml_cached(f) == {"a": 2}
+
+
+def test_yaml_fragments():
+    fragments = YamlFragments()
+    vault = VaultPass("$ANSIBLE_VAULT;1.1;AES256\n336366\n")
+    value = {"password": vault, "users": ["a", "b"]}
+
+    content = fragments.get("os/rhel-9", "secrets", value)
+    with TemporaryFile(mode="w+") as f:
+        save_yaml(f, {"secrets": value})
+        f.seek(0)
+        assert content == f.read()
+    assert fragments.get("os/rhel-9", "secrets", value) is content
+    assert (fragments.hits, fragments.misses) == (1, 1)
+
+    # Other values of the same var, e.g. rendered per host, are dumped again
+    assert fragments.get("os/rhel-9", "secrets", {"users": []}) == "secrets:\n  users: []\n"
+    assert fragments.misses == 2
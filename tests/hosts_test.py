@@ -1,7 +1,21 @@
 from invgen.metadata import MetadataVars
 from tempfile import NamedTemporaryFile
-from invgen.hosts import generate_host_file
+from invgen.files import VaultPass, parse_cache
+from invgen.hosts import (
+    GenerateStats,
+    HostEntry,
+    build_host_vars,
+    expand_host_pattern,
+    generate_host_file,
+    generate_hosts,
+    get_all_generated_hosts,
+    get_all_host_files,
+)
 from pathlib import Path
+import tempfile
+from unittest.mock import patch
+
+import pytest
 import yaml
 
 
@@ -95,3 +109,346 @@ metadata:
   - tag1
 """
         )
+
+
+def test_generate_hosts_skips_unchanged():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        (source / "hosts").mkdir()
+        (source / "hosts" / "host1.yaml").write_text("ansible_host: 192.168.1.10\n")
+        (source / "hosts" / "host2.yaml").write_text("ansible_host: 192.168.1.11\n")
+
+        assert generate_hosts(source) == GenerateStats(regenerated=2, skipped=0)
+        assert generate_hosts(source) == GenerateStats(regenerated=0, skipped=2)
+
+
+def test_generate_hosts_tracks_includes():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        (source / "hosts").mkdir()
+        (source / "metadata" / "env").mkdir(parents=True)
+        (source / "includes").mkdir()
+        (source / "includes" / "rules.yaml").write_text("- allow ssh\n")
+        (source / "metadata" / "env" / "prod.yaml").write_text(
+            "firewall: !include includes/rules.yaml\n"
+        )
+        (source / "hosts" / "host1.yaml").write_text("metadata:\n  env: prod\n")
+        (source / "hosts" / "host2.yaml").write_text("ansible_host: 192.168.1.11\n")
+
+        assert generate_hosts(source) == GenerateStats(regenerated=2, skipped=0)
+        assert "- allow ssh" in (source / "generated" / "host1.yaml").read_text()
+
+        # Changing an included file regenerates the hosts depending on it
+        (source / "includes" / "rules.yaml").write_text("- allow ssh\n- allow http\n")
+        assert generate_hosts(source) == GenerateStats(regenerated=1, skipped=1)
+        assert "- allow http" in (source / "generated" / "host1.yaml").read_text()
+
+
+def test_build_host_vars_shared_metadata():
+    metadata = MetadataVars()
+    metadata.add_metadata("os")
+    metadata.set_vars("os", "rhel-9", {"url": "http://{{ ansible_host }}", "ntp": ["a"]})
+
+    hosts = [
+        HostEntry(
+            name,
+            Path(f"hosts/{name}.yaml"),
+            {"metadata": {"os": "rhel-9"}, "ansible_host": f"{name}.local"},
+        )
+        for name in ("web1", "web2")
+    ]
+    web1, web2 = (build_host_vars(h, metadata, render_vars=True) for h in hosts)
+
+    assert web1["url"].value == "http://web1.local"
+    assert web2["url"].value == "http://web2.local"
+    # Without rendering, hosts with the same metadata share its merged vars
+    plain = [build_host_vars(h, metadata) for h in hosts]
+    assert plain[0]["ntp"] is plain[1]["ntp"]
+    # Rendering a host doesn't change the vars shared with other hosts
+    assert metadata.merge((("os", "rhel-9"),))["url"].value == "http://{{ ansible_host }}"
+
+
+def test_generate_hosts_fragment_directories():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        fragments = source / "hosts" / "dc1" / "db01.d"
+        fragments.mkdir(parents=True)
+        (source / "hosts" / "dc1" / "web01.yaml").write_text("ansible_host: 10.0.0.1\n")
+        (fragments / "00-base.yaml").write_text(
+            "metadata:\n  env: prod\nansible_host: 10.0.0.2\nport: 5432\n"
+        )
+        (fragments / "10-dba.yaml").write_text("metadata:\n  role: db\nport: 5433\n")
+        (fragments / "notes.txt").write_text("ignored\n")
+        for ref in ("env/prod", "role/db"):
+            (source / "metadata" / ref).parent.mkdir(parents=True)
+            (source / "metadata" / f"{ref}.yaml").write_text("{}\n")
+
+        assert sorted(f.name for f in get_all_host_files(source)) == [
+            "db01.d",
+            "web01.yaml",
+        ]
+        assert generate_hosts(source) == GenerateStats(regenerated=2, skipped=0)
+        generated = yaml.safe_load((source / "generated" / "db01.yaml").read_text())
+        assert generated == {
+            "metadata": {"env": "prod", "role": "db"},
+            "ansible_host": "10.0.0.2",
+            "port": 5433,
+        }
+
+        # A change to one fragment only parses that fragment again
+        (fragments / "10-dba.yaml").write_text("metadata:\n  role: db\nport: 6432\n")
+        misses = parse_cache.stats().misses
+        assert generate_hosts(source) == GenerateStats(regenerated=1, skipped=1)
+        assert parse_cache.stats().misses == misses + 1
+        assert "port: 6432" in (source / "generated" / "db01.yaml").read_text()
+
+        # New fragments are picked up
+        (fragments / "20-extra.yaml").write_text("extra: true\n")
+        assert generate_hosts(source) == GenerateStats(regenerated=1, skipped=1)
+        assert "extra: true" in (source / "generated" / "db01.yaml").read_text()
+
+
+def test_generate_hosts_metadata_extends():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        (source / "hosts").mkdir()
+        (source / "metadata" / "os").mkdir(parents=True)
+        (source / "metadata" / "os" / "rhel-9.yaml").write_text("os_family: RedHat\n")
+        (source / "metadata" / "os" / "rhel-9-fips.yaml").write_text(
+            "extends: rhel-9\nfips: true\n"
+        )
+        (source / "hosts" / "host1.yaml").write_text("metadata:\n  os: rhel-9-fips\n")
+
+        generate_hosts(source)
+        assert (source / "generated" / "host1.yaml").read_text() == (
+            "# os/rhel-9-fips (from os/rhel-9)\n"
+            "os_family: RedHat\n"
+            "\n"
+            "# os/rhel-9-fips\n"
+            "fips: true\n"
+            "\n"
+            "# hosts/host1\n"
+            "metadata:\n"
+            "  os: rhel-9-fips\n"
+        )
+
+        # Extended metadata values are dependencies of the host
+        (source / "metadata" / "os" / "rhel-9.yaml").write_text("os_family: Rocky\n")
+        assert generate_hosts(source) == GenerateStats(regenerated=1, skipped=0)
+        assert "os_family: Rocky" in (source / "generated" / "host1.yaml").read_text()
+
+
+def test_generate_hosts_layered_sources():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        base, team, output = Path(tmpdir, "base"), Path(tmpdir, "team"), Path(tmpdir, "out")
+        for root in (base, team):
+            (root / "hosts").mkdir(parents=True)
+            (root / "metadata" / "os").mkdir(parents=True)
+
+        (base / "metadata" / "os" / "rhel-9.yaml").write_text("selinux: enforcing\n")
+        (base / "metadata" / "os" / "debian.yaml").write_text("apt: true\n")
+        (team / "metadata" / "os" / "rhel-9.yaml").write_text("selinux: permissive\n")
+        (base / "hosts" / "base1.yaml").write_text("metadata:\n  os: debian\n")
+        (base / "hosts" / "shared.yaml").write_text("metadata:\n  os: debian\n")
+        (team / "hosts" / "team1.yaml").write_text("metadata:\n  os: rhel-9\n")
+        (team / "hosts" / "shared.yaml").write_text("metadata:\n  os: rhel-9\n")
+
+        stats = generate_hosts([base, team], output)
+        assert stats == GenerateStats(regenerated=3, skipped=0)
+
+        generated = output / "generated"
+        assert "apt: true" in (generated / "base1.yaml").read_text()
+        # Later sources override hosts and metadata values of earlier ones
+        assert "selinux: permissive" in (generated / "team1.yaml").read_text()
+        assert "selinux: permissive" in (generated / "shared.yaml").read_text()
+
+        # Each source root keeps its own build cache
+        assert len(list((output / ".invgen" / "build").iterdir())) == 2
+
+        # Unchanged hosts are skipped without parsing them
+        with patch("invgen.hosts.build_host_vars") as mock_generate:
+            stats = generate_hosts([base, team], output)
+        mock_generate.assert_not_called()
+        assert stats == GenerateStats(regenerated=0, skipped=3)
+
+        # A change in one root only regenerates the hosts depending on it
+        (team / "metadata" / "os" / "rhel-9.yaml").write_text("selinux: disabled\n")
+        stats = generate_hosts([base, team], output)
+        assert stats == GenerateStats(regenerated=2, skipped=1)
+        assert "selinux: disabled" in (generated / "team1.yaml").read_text()
+
+        # A new override in a later root is picked up
+        (team / "metadata" / "os" / "debian.yaml").write_text("apt: false\n")
+        stats = generate_hosts([base, team], output)
+        assert stats == GenerateStats(regenerated=1, skipped=2)
+        assert "apt: false" in (generated / "base1.yaml").read_text()
+
+
+def test_generate_hosts_multiple_sources_require_output():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with pytest.raises(ValueError):
+            generate_hosts([Path(tmpdir), Path(tmpdir)])
+
+
+def test_generate_hosts_json_format():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        (source / "hosts").mkdir()
+        (source / "metadata" / "os").mkdir(parents=True)
+        (source / "metadata" / "os" / "rhel-9.yaml").write_text("selinux: enforcing\n")
+        (source / "hosts" / "host1.yaml").write_text(
+            "metadata:\n  os: rhel-9\npassword: !vault |\n  $ANSIBLE_VAULT;1.1;AES256\n"
+        )
+
+        generate_hosts(source)
+        yaml_hosts = get_all_generated_hosts(source)
+
+        generate_hosts(source, format="json")
+        generated = source / "generated"
+        assert [f.name for f in generated.iterdir()] == ["host1.json"]
+        assert (generated / "host1.json").read_text().startswith(
+            '{"selinux":"enforcing","metadata":{"os":"rhel-9"}'
+        )
+
+        json_hosts = get_all_generated_hosts(source)
+        assert json_hosts == yaml_hosts
+        assert isinstance(json_hosts[0].vars["password"], VaultPass)
+
+        with pytest.raises(ValueError):
+            generate_hosts(source, format="toml")
+
+
+def test_generate_hosts_selection():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        (source / "hosts").mkdir()
+        (source / "metadata" / "environment").mkdir(parents=True)
+        (source / "metadata" / "tags").mkdir(parents=True)
+        (source / "hosts" / "ap01.test.local.yaml").write_text(
+            "metadata:\n  environment: production\n  tags: [web]\n"
+        )
+        (source / "hosts" / "ap02.test.local.yaml").write_text(
+            "metadata:\n  environment: staging\n  tags: [web, db]\n"
+        )
+        (source / "hosts" / "db01.test.local.yaml").write_text(
+            "metadata:\n  environment: production\n  tags: [db]\n"
+        )
+        generated = source / "generated"
+
+        stats = generate_hosts(source, only=["ap*.test.local"])
+        assert stats == GenerateStats(regenerated=2, skipped=0)
+        assert sorted(f.stem for f in generated.iterdir()) == [
+            "ap01.test.local",
+            "ap02.test.local",
+        ]
+
+        stats = generate_hosts(source, where=["environment=production", "tags=db"])
+        assert stats == GenerateStats(regenerated=1, skipped=0)
+        assert (generated / "db01.test.local.yaml").exists()
+
+        # Metadata of unchanged host files is read from the build cache
+        with patch("invgen.hosts.load_yaml_all_cached") as mock_load:
+            stats = generate_hosts(source, where=["tags=web"])
+        mock_load.assert_not_called()
+        assert stats == GenerateStats(regenerated=0, skipped=2)
+
+        with pytest.raises(ValueError):
+            generate_hosts(source, where=["environment"])
+
+
+def test_expand_host_pattern():
+    assert list(expand_host_pattern("db01")) == [("db01", ())]
+    assert [name for name, _ in expand_host_pattern("web[008:010].dc1")] == [
+        "web008.dc1",
+        "web009.dc1",
+        "web010.dc1",
+    ]
+    assert list(expand_host_pattern("sw-[a:c:2]-[1:2]")) == [
+        ("sw-a-1", ("a", 1)),
+        ("sw-a-2", ("a", 2)),
+        ("sw-c-1", ("c", 1)),
+        ("sw-c-2", ("c", 2)),
+    ]
+
+    with pytest.raises(ValueError):
+        list(expand_host_pattern("web[10:1]"))
+
+
+def test_generate_hosts_multi_host_files():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        (source / "hosts").mkdir()
+        (source / "metadata" / "rack").mkdir(parents=True)
+        (source / "metadata" / "role").mkdir(parents=True)
+        (source / "metadata" / "rack" / "r12.yaml").write_text("rack_vlan: 112\n")
+        (source / "hosts" / "rack12.yaml").write_text(
+            """metadata:
+  rack: r12
+hosts:
+  web[01:03].dc1:
+    metadata:
+      role: web
+    ansible_host: "10.0.12.${ index }"
+    port: "${ 8000 + index }"
+    url: "http://{{ ansible_host }}"
+    cmd: "echo ${HOME} ${ name } ${PATH:-/bin}"
+  db01.dc1:
+    ansible_host: 10.0.12.250
+"""
+        )
+        (source / "hosts" / "switches.yaml").write_text(
+            """inventory_hostname: sw1
+ansible_host: 10.0.0.1
+---
+inventory_hostname: sw2
+ansible_host: 10.0.0.2
+"""
+        )
+
+        stats = generate_hosts(source)
+        assert stats == GenerateStats(regenerated=6, skipped=0)
+
+        hosts = {h.name: h.vars for h in get_all_generated_hosts(source)}
+        assert sorted(hosts) == [
+            "db01.dc1",
+            "sw1",
+            "sw2",
+            "web01.dc1",
+            "web02.dc1",
+            "web03.dc1",
+        ]
+        assert hosts["web02.dc1"] == {
+            "rack_vlan": 112,
+            "metadata": {"rack": "r12", "role": "web"},
+            "ansible_host": "10.0.12.2",
+            "port": 8002,
+            "url": "http://{{ ansible_host }}",
+            # Only names of the range are rendered, not shell variables
+            "cmd": "echo ${HOME} web02.dc1 ${PATH:-/bin}",
+        }
+        assert hosts["db01.dc1"]["metadata"] == {"rack": "r12"}
+        assert hosts["sw2"] == {"ansible_host": "10.0.0.2", "metadata": {}}
+
+        # Unchanged multi-host files are skipped as a whole
+        with patch("invgen.hosts.load_yaml_all_cached") as mock_load:
+            stats = generate_hosts(source, only=["web*"])
+        mock_load.assert_not_called()
+        assert stats == GenerateStats(regenerated=0, skipped=3)
+
+        (source / "metadata" / "rack" / "r12.yaml").write_text("rack_vlan: 212\n")
+        assert generate_hosts(source) == GenerateStats(regenerated=4, skipped=2)
+
+
+def test_generate_hosts_multi_host_errors():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        (source / "hosts").mkdir()
+        (source / "hosts" / "hosts.yaml").write_text("a: 1\n---\nb: 2\n")
+        with pytest.raises(ValueError, match="declares no host"):
+            generate_hosts(source)
+
+        (source / "hosts" / "hosts.yaml").write_text(
+            "hosts:\n  web[1:2]: {}\n  web2: {}\n"
+        )
+        with pytest.raises(ValueError, match="declared twice"):
+            generate_hosts(source)
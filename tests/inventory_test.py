@@ -1,8 +1,13 @@
 import json
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
 
 import pytest
-from invgen.inventory import AnsibleInventory
-from invgen.hosts import GeneratedHost
+from invgen.inventory import AnsibleInventory, get_limited_hosts, select_hosts
+from invgen.hosts import GeneratedHost, generate_hosts, load_generated_host
+from invgen.metadata import MetadataVars
+from invgen.provenance import load_provenance_index
 
 
 @pytest.fixture
@@ -132,3 +137,137 @@ def test_render_host(sample_hosts):
     # Test with pretty printing
     pretty_result = inventory.render_host("host1", pretty=True)
     assert "  " in pretty_result  # Should have indentation
+
+
+def test_build_inventory_with_group_vars():
+    metadata = MetadataVars()
+    metadata.add_metadata("os")
+    metadata.set_vars("os", "rhel-9", {"selinux": "enforcing", "packages": ["vim"]})
+    metadata.add_metadata("my_tags")
+    metadata.set_vars("my_tags", "web", {"selinux": "permissive", "http_port": 80})
+
+    hosts = [
+        GeneratedHost(
+            name="host1",
+            vars={
+                "selinux": "permissive",
+                "packages": ["vim"],
+                "http_port": 80,
+                "metadata": {"os": "rhel-9", "my_tags": ["web"]},
+                "ansible_host": "192.168.1.10",
+            },
+        ),
+        GeneratedHost(
+            name="host2",
+            vars={
+                "http_port": 8080,
+                "selinux": "enforcing",
+                "packages": ["vim"],
+                "metadata": {"my_tags": ["web"], "os": "rhel-9"},
+                "ansible_host": "192.168.1.11",
+            },
+        ),
+        GeneratedHost(name="host3", vars={"ansible_host": "192.168.1.12"}),
+    ]
+
+    result = AnsibleInventory(hosts, metadata).build()
+
+    assert result["os_rhel-9"]["vars"] == {
+        "selinux": "enforcing",
+        "packages": ["vim"],
+        "ansible_group_priority": 1,
+    }
+    assert result["my_tags_web"]["vars"] == {
+        "selinux": "permissive",
+        "http_port": 80,
+        "ansible_group_priority": 2,
+    }
+    assert "vars" not in result["ungrouped"]
+
+    hostvars = result["_meta"]["hostvars"]
+    # Values Ansible resolves from the groups are left out
+    assert hostvars["host1"] == {
+        "metadata": {"os": "rhel-9", "my_tags": ["web"]},
+        "ansible_host": "192.168.1.10",
+    }
+    # host2 orders its metadata differently, so the conflicting value stays
+    assert hostvars["host2"] == {
+        "http_port": 8080,
+        "selinux": "enforcing",
+        "metadata": {"my_tags": ["web"], "os": "rhel-9"},
+        "ansible_host": "192.168.1.11",
+    }
+    assert hostvars["host3"] == {"ansible_host": "192.168.1.12"}
+
+
+def test_select_hosts():
+    groups = {
+        "environment_production": ["host1", "host3"],
+        "tags_web": ["host1", "host2"],
+        "tags_db": ["host3"],
+    }
+    hosts = ["host1", "host2", "host3", "db01"]
+
+    assert select_hosts("tags_web", groups, hosts) == ["host1", "host2"]
+    assert select_hosts("tags_web:db01", groups, hosts) == ["host1", "host2", "db01"]
+    assert select_hosts("tags_*,&environment_production", groups, hosts) == [
+        "host1",
+        "host3",
+    ]
+    assert select_hosts("all:!tags_web", groups, hosts) == ["host3", "db01"]
+    assert select_hosts("!tags_web", groups, hosts) == ["host3", "db01"]
+    assert select_hosts("~host[12]", groups, hosts) == ["host1", "host2"]
+    assert select_hosts("tags_web[1]", groups, hosts) == ["host2"]
+    assert select_hosts("missing", groups, hosts) == []
+
+
+def test_get_limited_hosts():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        (source / "hosts").mkdir()
+        (source / "metadata" / "env").mkdir(parents=True)
+        for name, env in [("web1", "prod"), ("web2", "test"), ("db1", "prod")]:
+            (source / "hosts" / f"{name}.yaml").write_text(f"metadata:\n  env: {env}\n")
+        generate_hosts(source)
+
+        # Only the generated files of matching hosts are read with the index
+        with patch(
+            "invgen.inventory.load_generated_host", wraps=load_generated_host
+        ) as mock_load:
+            hosts = get_limited_hosts(source, "env_prod:!db*")
+        assert [h.name for h in hosts] == ["web1"]
+        assert mock_load.call_count == 1
+
+        inventory = AnsibleInventory(hosts).build()
+        assert inventory["env_prod"] == {"hosts": ["web1"]}
+        assert "env_test" not in inventory
+
+        # Without a current index all generated hosts are loaded and filtered
+        (source / "generated" / "extra.yaml").write_text("metadata:\n  env: prod\n")
+        hosts = get_limited_hosts(source, "env_prod")
+        assert sorted(h.name for h in hosts) == ["db1", "extra", "web1"]
+
+
+def test_host_index_keeps_unselected_hosts():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        (source / "hosts").mkdir()
+        (source / "metadata" / "env").mkdir(parents=True)
+        (source / "metadata" / "env" / "prod.yaml").write_text("tier: prod\n")
+        for name in ("web1", "web2"):
+            (source / "hosts" / f"{name}.yaml").write_text("metadata:\n  env: prod\n")
+        generate_hosts(source)
+
+        # An edited host outside of --only keeps its generated file and index entry
+        (source / "hosts" / "web2.yaml").write_text("metadata:\n  env: prod\nx: 1\n")
+        generate_hosts(source, only=["web1"])
+        hosts = get_limited_hosts(source, "all")
+        assert sorted(h.name for h in hosts) == ["web1", "web2"]
+        assert "x" not in next(h for h in hosts if h.name == "web2").vars
+        assert load_provenance_index(source).explain("web2", "tier")[0][0] == "env/prod"
+
+        # Also when it is left in the format of the earlier run
+        generate_hosts(source, only=["web1"], format="json")
+        hosts = get_limited_hosts(source, "env_prod")
+        assert sorted(h.name for h in hosts) == ["web1", "web2"]
+        assert (source / "generated" / "web2.yaml").is_file()
@@ -122,3 +122,61 @@ def test_build_metadata_vars_missing_dir():
         # Should have no metadata types and not raise an error
         assert not hasattr(metadata, "platform")
         assert not hasattr(metadata, "environment")
+
+
+def test_metadata_vars_extends():
+    metadata = MetadataVars()
+    metadata.add_metadata("os")
+    metadata.add_metadata("security")
+    metadata.set_vars("security", "fips", {"crypto_policy": "FIPS"})
+    metadata.set_vars("os", "rhel-9", {"os_family": "RedHat", "selinux": "enforcing"})
+    metadata.set_vars(
+        "os",
+        "rhel-9-fips",
+        {"extends": ["rhel-9", "security/fips"], "selinux": "permissive"},
+    )
+
+    assert metadata.lookup("os", "rhel-9-fips") == {
+        "os_family": "RedHat",
+        "selinux": "permissive",
+        "crypto_policy": "FIPS",
+    }
+    assert metadata.get_chain("os", "rhel-9-fips") == [
+        "os/rhel-9",
+        "security/fips",
+        "os/rhel-9-fips",
+    ]
+    resolved = metadata.resolve("os", "rhel-9-fips")
+    assert resolved.sources["os_family"] == "os/rhel-9"
+    # The flattened result is resolved once
+    assert metadata.resolve("os", "rhel-9-fips") is resolved
+
+    metadata.set_vars("os", "rhel-9", {"extends": "rhel-9-fips"})
+    with pytest.raises(ValueError, match="Cycle"):
+        metadata.lookup("os", "rhel-9-fips")
+
+    metadata.set_vars("os", "rhel-9", {"extends": "rhel-8"})
+    with pytest.raises(ValueError, match="extends unknown os/rhel-8"):
+        metadata.lookup("os", "rhel-9-fips")
+
+
+def test_metadata_vars_merge():
+    metadata = MetadataVars()
+    metadata.add_metadata("os")
+    metadata.add_metadata("env")
+    metadata.set_vars("os", "rhel-9", {"ntp": ["a"], "selinux": "enforcing"})
+    metadata.set_vars("env", "prod", {"ntp": ["b"]})
+
+    layer = metadata.merge((("os", "rhel-9"), ("env", "prod")))
+    assert {k: v.value for k, v in layer.items()} == {
+        "ntp": ["b"],
+        "selinux": "enforcing",
+    }
+    assert layer["ntp"].source == "env/prod"
+    assert layer["ntp"].history == ["os/rhel-9", "env/prod"]
+    # Hosts with the same metadata share the merged vars
+    assert metadata.merge((("os", "rhel-9"), ("env", "prod"))) is layer
+    assert metadata.merge((("env", "prod"), ("os", "rhel-9")))["ntp"].value == ["a"]
+
+    metadata.set_vars("env", "prod", {"ntp": ["c"]})
+    assert metadata.merge((("os", "rhel-9"), ("env", "prod")))["ntp"].value == ["c"]
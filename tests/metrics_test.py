@@ -0,0 +1,76 @@
+import tempfile
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+from invgen.metrics import (
+    Counter,
+    Histogram,
+    Metric,
+    WatchMetrics,
+    start_metrics_server,
+    write_metrics_file,
+)
+
+
+def test_counter_render():
+    counter = Counter("invgen_test_total", "Test counter")
+    counter.inc()
+    counter.inc(2)
+
+    assert counter.render() == (
+        "# HELP invgen_test_total Test counter\n"
+        "# TYPE invgen_test_total counter\n"
+        "invgen_test_total 3\n"
+    )
+
+
+def test_metric_missing_samples():
+    class Summary(Metric):
+        type = "summary"
+
+    with pytest.raises(TypeError, match="samples"):
+        Summary("invgen_test_summary", "Test summary")
+
+
+def test_histogram_render():
+    histogram = Histogram("invgen_test_seconds", "Test histogram", buckets=(0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(2)
+
+    lines = histogram.render().splitlines()
+    assert 'invgen_test_seconds_bucket{le="0.1"} 1' in lines
+    assert 'invgen_test_seconds_bucket{le="1"} 2' in lines
+    assert 'invgen_test_seconds_bucket{le="+Inf"} 3' in lines
+    assert "invgen_test_seconds_sum 2.55" in lines
+    assert "invgen_test_seconds_count 3" in lines
+
+
+def test_write_metrics_file():
+    metrics = WatchMetrics()
+    metrics.events_received.inc()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "invgen.prom"
+        write_metrics_file(path, metrics)
+
+        content = path.read_text()
+        assert "invgen_watch_events_total 1\n" in content
+        assert "# TYPE invgen_event_to_output_seconds histogram" in content
+        assert list(Path(tmpdir).iterdir()) == [path]
+
+
+def test_metrics_server():
+    metrics = WatchMetrics()
+    metrics.hosts_regenerated.inc(5)
+    server = start_metrics_server(0, metrics)
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/metrics"
+        with urllib.request.urlopen(url) as response:
+            body = response.read().decode()
+    finally:
+        server.shutdown()
+
+    assert "invgen_hosts_regenerated_total 5\n" in body
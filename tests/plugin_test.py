@@ -0,0 +1,177 @@
+import importlib
+import os
+import sys
+import tempfile
+import types
+from pathlib import Path
+
+import pytest
+import yaml
+
+
+class StubBaseInventoryPlugin:
+    """Minimal stand-in for ansible.plugins.inventory.BaseInventoryPlugin"""
+
+    def __init__(self):
+        self._options = {}
+
+    def verify_file(self, path):
+        return os.path.exists(path)
+
+    def parse(self, inventory, loader, path, cache=True):
+        self.inventory = inventory
+        self.loader = loader
+
+    def _read_config_data(self, path):
+        with open(path) as f:
+            self._options.update(yaml.safe_load(f))
+
+    def get_option(self, name):
+        return self._options.get(name)
+
+
+class StubCacheable:
+    _cache: dict = {}
+
+    def get_cache_key(self, path):
+        return f"invgen_{path}"
+
+
+class StubInventory:
+    def __init__(self):
+        self.groups: dict[str, list[str]] = {}
+        self.hostvars: dict[str, dict] = {}
+        self.groupvars: dict[str, dict] = {}
+
+    def add_group(self, group):
+        self.groups.setdefault(group, [])
+
+    def add_host(self, host, group=None):
+        self.hostvars.setdefault(host, {})
+        if group is not None:
+            self.groups[group].append(host)
+
+    def set_variable(self, entity, key, value):
+        if entity in self.hostvars:
+            self.hostvars[entity][key] = value
+        else:
+            self.groupvars.setdefault(entity, {})[key] = value
+
+
+class StubLoader:
+    def load(self, data):
+        return ("vault", yaml.safe_load(data.replace("!vault", "")))
+
+
+@pytest.fixture
+def plugin_module(monkeypatch):
+    inventory_module = types.ModuleType("ansible.plugins.inventory")
+    inventory_module.BaseInventoryPlugin = StubBaseInventoryPlugin
+    inventory_module.Cacheable = StubCacheable
+    for name in ("ansible", "ansible.plugins"):
+        monkeypatch.setitem(sys.modules, name, types.ModuleType(name))
+    monkeypatch.setitem(sys.modules, "ansible.plugins.inventory", inventory_module)
+    monkeypatch.delitem(sys.modules, "invgen.plugins.invgen", raising=False)
+    StubCacheable._cache = {}
+    return importlib.import_module("invgen.plugins.invgen")
+
+
+@pytest.fixture
+def source_dir():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        generated = Path(tmpdir) / "generated"
+        generated.mkdir()
+        (generated / "host1.yaml").write_text(
+            """metadata:
+  os: rhel-9
+  tags:
+  - web
+ansible_host: 192.168.1.10
+password: !vault |
+  $ANSIBLE_VAULT;1.1;AES256
+  336366
+"""
+        )
+        (generated / "host2.yaml").write_text("ansible_host: 192.168.1.11\n")
+        config = Path(tmpdir) / "inventory.invgen.yml"
+        config.write_text(f"plugin: invgen\nsource: {tmpdir}\n")
+        yield Path(tmpdir)
+
+
+def test_verify_file(plugin_module, source_dir):
+    plugin = plugin_module.InventoryModule()
+    assert plugin.verify_file(str(source_dir / "inventory.invgen.yml"))
+
+    other = source_dir / "hosts.yml"
+    other.write_text("all: {}\n")
+    assert not plugin.verify_file(str(other))
+
+
+def test_parse_populates_inventory(plugin_module, source_dir):
+    plugin = plugin_module.InventoryModule()
+    inventory = StubInventory()
+    plugin.parse(inventory, StubLoader(), str(source_dir / "inventory.invgen.yml"))
+
+    assert inventory.groups["os_rhel-9"] == ["host1"]
+    assert inventory.groups["tags_web"] == ["host1"]
+    assert inventory.groups["ungrouped"] == ["host2"]
+    assert inventory.hostvars["host1"]["ansible_host"] == "192.168.1.10"
+    assert inventory.hostvars["host1"]["password"] == (
+        "vault",
+        "$ANSIBLE_VAULT;1.1;AES256\n336366\n",
+    )
+    assert inventory.hostvars["host2"] == {"ansible_host": "192.168.1.11"}
+
+
+def test_parse_uses_cache(plugin_module, source_dir):
+    config = source_dir / "inventory.invgen.yml"
+    config.write_text(config.read_text() + "cache: true\n")
+
+    plugin = plugin_module.InventoryModule()
+    plugin.parse(StubInventory(), StubLoader(), str(config), cache=False)
+    cache_key = plugin.get_cache_key(str(config))
+    assert cache_key in plugin._cache
+
+    # A cached result is used without reading generated/ again
+    (source_dir / "generated" / "host2.yaml").unlink()
+    inventory = StubInventory()
+    plugin = plugin_module.InventoryModule()
+    plugin.parse(inventory, StubLoader(), str(config), cache=True)
+    assert "host2" in inventory.hostvars
+
+
+def test_parse_without_cache(plugin_module, source_dir):
+    plugin = plugin_module.InventoryModule()
+    plugin.parse(StubInventory(), StubLoader(), str(source_dir / "inventory.invgen.yml"))
+    assert plugin._cache == {}
+
+
+def test_parse_with_group_vars(plugin_module, source_dir):
+    (source_dir / "metadata" / "os").mkdir(parents=True)
+    (source_dir / "metadata" / "os" / "rhel-9.yaml").write_text("selinux: enforcing\n")
+    with open(source_dir / "generated" / "host1.yaml", "a") as f:
+        f.write("selinux: enforcing\n")
+    config = source_dir / "inventory.invgen.yml"
+    config.write_text(config.read_text() + "group_vars: true\n")
+
+    plugin = plugin_module.InventoryModule()
+    inventory = StubInventory()
+    plugin.parse(inventory, StubLoader(), str(config))
+
+    assert inventory.groupvars["os_rhel-9"] == {
+        "selinux": "enforcing",
+        "ansible_group_priority": 1,
+    }
+    assert "selinux" not in inventory.hostvars["host1"]
+
+
+def test_parse_with_limit(plugin_module, source_dir):
+    config = source_dir / "inventory.invgen.yml"
+    config.write_text(config.read_text() + "limit: os_rhel-9\n")
+
+    plugin = plugin_module.InventoryModule()
+    inventory = StubInventory()
+    plugin.parse(inventory, StubLoader(), str(config))
+
+    assert list(inventory.hostvars) == ["host1"]
+    assert "ungrouped" not in inventory.groups
@@ -0,0 +1,48 @@
+import tempfile
+from pathlib import Path
+
+from invgen.hosts import generate_hosts
+from invgen.provenance import load_provenance_index
+
+
+def test_provenance_index():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        (source / "hosts").mkdir()
+        (source / "metadata" / "os").mkdir(parents=True)
+        (source / "metadata" / "env").mkdir()
+        (source / "metadata" / "os" / "rhel-9.yaml").write_text("ntp: [a]\nselinux: on\n")
+        (source / "metadata" / "os" / "rhel-9-fips.yaml").write_text(
+            "extends: rhel-9\nntp: [b]\n"
+        )
+        (source / "metadata" / "env" / "prod.yaml").write_text("ntp: [c]\n")
+        (source / "hosts" / "web1.yaml").write_text(
+            "metadata:\n  os: rhel-9-fips\n  env: prod\n"
+        )
+        (source / "hosts" / "web2.yaml").write_text(
+            "metadata:\n  os: rhel-9-fips\n  env: prod\nntp: [d]\n"
+        )
+
+        generate_hosts(source)
+        provenance = load_provenance_index(source)
+
+        rhel = str(source / "metadata" / "os" / "rhel-9.yaml")
+        assert provenance.explain("web1", "ntp") == [
+            ("env/prod", str(source / "metadata" / "env" / "prod.yaml")),
+            ("os/rhel-9-fips", str(source / "metadata" / "os" / "rhel-9-fips.yaml")),
+            ("os/rhel-9", rhel),
+        ]
+        assert provenance.explain("web2", "ntp")[0] == (
+            "hosts/web2",
+            str(source / "hosts" / "web2.yaml"),
+        )
+        assert provenance.hosts_from(rhel, "selinux") == ["web1", "web2"]
+        assert provenance.hosts_from("env/prod", "ntp") == ["web1"]
+
+        # Skipped hosts keep their provenance
+        generate_hosts(source)
+        assert load_provenance_index(source).hosts == provenance.hosts
+
+        # A change without regenerating makes the index outdated
+        (source / "generated" / "web1.yaml").unlink()
+        assert load_provenance_index(source) is None
@@ -0,0 +1,108 @@
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+import yaml
+
+from invgen.cache import load_host_index
+from invgen.hosts import generate_hosts
+from invgen.provenance import load_provenance_index
+from invgen.rules import RuleSet, assign_metadata, parse_rules
+
+
+def test_rule_set_match():
+    rules = RuleSet(
+        parse_rules(
+            [
+                {"name": "databases", "hosts": "db*", "metadata": {"services": "postgres"}},
+                {"regex": r"^web\d+\.dc1$", "metadata": {"role": "web"}},
+                {
+                    "name": "dc1",
+                    "vars": {"metadata.location": "dc1", "monitored": True},
+                    "metadata": {"env": "prod"},
+                },
+                {"hosts": ["db9", "web*"], "metadata": {"services": ["nginx"]}},
+                {"name": "lab", "regex": "(?i)^LAB-", "metadata": {"env": "lab"}},
+            ],
+            Path("rules.yaml"),
+        )
+    )
+
+    def names(name, host_vars=None):
+        return [rule.name for rule in rules.match(name, host_vars or {})]
+
+    assert names("db1") == ["databases"]
+    assert names("db9") == ["databases", "4"]
+    assert names("web1.dc1") == ["2", "4"]
+    assert names("web1.dc2") == ["4"]
+    assert names("app1") == []
+    # Global inline flags only apply to their own rule
+    assert names("lab-db1") == ["lab"]
+    assert names("WEB1.dc1") == []
+    assert names("app1", {"metadata": {"location": "dc1"}, "monitored": True}) == ["dc1"]
+    assert names("app1", {"metadata": {"location": "dc2"}, "monitored": True}) == []
+    assert rules.get_file("rules/dc1") == Path("rules.yaml")
+
+    # Later rules override earlier ones, the host overrides both
+    assert assign_metadata(
+        {"metadata": {"env": "dev"}, "port": 1}, rules.match("db9", {})
+    ) == {"metadata": {"services": ["nginx"], "env": "dev"}, "port": 1}
+
+
+@pytest.mark.parametrize(
+    "data, error",
+    [
+        ({"hosts": "db*"}, "expected a list"),
+        ([{"hosts": "db*"}], "assigns no metadata"),
+        ([{"host": "db*", "metadata": {"a": "b"}}], "unknown keys host"),
+        ([{"regex": "db(", "metadata": {"a": "b"}}], "invalid regex"),
+        ([{"regex": r"(\d)\1", "metadata": {"a": "b"}}], "backreferences"),
+        ([{"hosts": "db*", "metadata": {"a": {"b": "c"}}}], "metadata a must be"),
+    ],
+)
+def test_parse_rules_invalid(data, error):
+    with pytest.raises(ValueError, match=error):
+        parse_rules(data, Path("rules.yaml"))
+
+
+def test_generate_hosts_rules():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        (source / "hosts").mkdir()
+        (source / "metadata" / "services").mkdir(parents=True)
+        (source / "metadata" / "services" / "postgres.yaml").write_text("port: 5432\n")
+        (source / "metadata" / "services" / "mysql.yaml").write_text("port: 3306\n")
+        (source / "hosts" / "db1.yaml").write_text("ansible_host: 10.0.0.1\n")
+        (source / "hosts" / "web1.yaml").write_text("metadata: {}\n")
+        rules_file = source / "rules.yaml"
+
+        generate_hosts(source)
+        assert "port" not in yaml.safe_load((source / "generated" / "db1.yaml").read_text())
+
+        # Adding the rules file regenerates the hosts it matches
+        time.sleep(0.01)
+        rules_file.write_text(
+            "- name: databases\n  hosts: db*\n  metadata:\n    services: postgres\n"
+        )
+        stats = generate_hosts(source)
+
+        generated = yaml.safe_load((source / "generated" / "db1.yaml").read_text())
+        assert generated["metadata"] == {"services": "postgres"}
+        assert generated["port"] == 5432
+        assert stats.regenerated == 1
+        assert load_host_index(source)["db1"]["metadata"] == {"services": "postgres"}
+        provenance = load_provenance_index(source)
+        assert provenance.explain("db1", "metadata") == [
+            ("rules/databases", str(rules_file))
+        ]
+        assert provenance.hosts_from("rules/databases", "metadata") == ["db1"]
+
+        time.sleep(0.01)
+        rules_file.write_text(
+            "- name: databases\n  hosts: db*\n  metadata:\n    services: mysql\n"
+        )
+        generate_hosts(source)
+
+        generated = yaml.safe_load((source / "generated" / "db1.yaml").read_text())
+        assert generated["port"] == 3306
@@ -0,0 +1,47 @@
+import json
+import tempfile
+from pathlib import Path
+
+from invgen.hosts import generate_hosts, get_all_generated_hosts
+from invgen.stats import collect_stats, render_stats
+
+
+def test_collect_stats():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        (source / "hosts").mkdir()
+        (source / "metadata" / "os").mkdir(parents=True)
+        (source / "metadata" / "os" / "rhel-9.yaml").write_text(
+            "packages: [vim, git, tmux]\nselinux: enforcing\n"
+        )
+        (source / "metadata" / "os" / "debian.yaml").write_text("apt: true\n")
+        for i in range(3):
+            (source / "hosts" / f"web{i}.yaml").write_text(
+                f"metadata:\n  os: rhel-9\nansible_host: 10.0.0.{i}\n"
+            )
+        (source / "hosts" / "broken.yaml").write_text("metadata:\n  os: windows\n")
+
+        stats = collect_stats(source)
+
+        assert stats.hosts == 4
+        assert stats.groups == {"os_rhel-9": 3, "os_windows": 1}
+        assert stats.unused_metadata == [str(source / "metadata" / "os" / "debian.yaml")]
+        assert stats.unresolved == [("broken", "os/windows")]
+
+        rhel = stats.metadata["os/rhel-9"]
+        assert rhel.hosts == 3
+        assert rhel.contributed_bytes == 3 * rhel.serialized_bytes
+
+        # Sizes match the hostvars of the --list output
+        generate_hosts(source)
+        hostvars = {h.name: h.vars for h in get_all_generated_hosts(source)}
+        assert stats.host_bytes == {
+            name: len(json.dumps(vars)) for name, vars in hostvars.items()
+        }
+        assert stats.list_bytes == sum(stats.host_bytes.values())
+        # Metadata vars are duplicated on each host using it
+        assert stats.duplicated_bytes == 2 * rhel.serialized_bytes + 2 * len(
+            '"metadata": {"os": "rhel-9"}'
+        )
+
+        assert "=> Hosts: 4" in render_stats(stats)
@@ -0,0 +1,194 @@
+import json
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+import yaml
+
+from invgen.hosts import generate_hosts
+from invgen.metadata import build_metadata_vars
+from invgen.tables import (
+    CsvTable,
+    JsonlTable,
+    SqliteTable,
+    YamlBundle,
+    _cell,
+    _OffsetTable,
+)
+
+
+def test_csv_table():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "site.csv"
+        path.write_text(
+            "name,region,racks,dns,notes,country,power,ipv6\n"
+            'fra1,eu-central,12,"[10.0.0.1, 10.0.0.2]",,DE,"[on, off]",true\n'
+            '\n'
+            'ams1,eu-west,4,[],"multi\nline",NO,,\n'
+        )
+        table = CsvTable(path, "site")
+
+        assert table.names() == ["fra1", "ams1"]
+        assert table.load("fra1") == {
+            "region": "eu-central",
+            "racks": 12,
+            "dns": ["10.0.0.1", "10.0.0.2"],
+            "country": "DE",
+            "power": ["on", "off"],
+            "ipv6": True,
+        }
+        # Only true and false are booleans, e.g. the country code of Norway is not
+        assert table.load("ams1")["country"] == "NO"
+        assert table.load("ams1")["notes"] == "multi\nline"
+
+        path.write_text("site,region\nfra1,eu-central\n")
+        with pytest.raises(ValueError, match="no name column"):
+            CsvTable(path, "site")
+
+
+@pytest.mark.parametrize(
+    "cell, value",
+    [
+        ("01234", "01234"),
+        ("12:30", "12:30"),
+        ("#x", "#x"),
+        ("a: b", "a: b"),
+        (".inf", ".inf"),
+        ("null", "null"),
+        ("on", "on"),
+        ("12", 12),
+        ("-1.5", -1.5),
+        ("false", False),
+        ("'12'", "12"),
+        ("[a, 01, 2, on]", ["a", "01", 2, "on"]),
+        ("{a: 1}", {"a": 1}),
+        ("[broken", "[broken"),
+    ],
+)
+def test_csv_cell(cell, value):
+    assert _cell(cell) == value
+
+
+def test_table_missing_methods():
+    class RowsTable(_OffsetTable):
+        def _scan(self, f):
+            pass
+
+    with pytest.raises(TypeError, match="_parse"):
+        RowsTable(Path("rows.txt"), "rows")
+
+
+def test_jsonl_table():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "site.jsonl"
+        rows = [
+            {"name": "fra1", "ntp": {"servers": ["a", "b"]}},
+            {"name": "ams1", "racks": 4},
+        ]
+        path.write_text("\n".join(json.dumps(r) for r in rows) + "\n\n")
+        table = JsonlTable(path, "site")
+
+        assert table.names() == ["fra1", "ams1"]
+        assert table.load("fra1") == {"ntp": {"servers": ["a", "b"]}}
+        assert table.load("ams1") == {"racks": 4}
+
+        path.write_text('{"region": "eu"}\n')
+        with pytest.raises(ValueError, match="has no name"):
+            JsonlTable(path, "site")
+
+
+def test_sqlite_table():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "site.sqlite"
+        db = sqlite3.connect(path)
+        db.execute("CREATE TABLE site (name TEXT PRIMARY KEY, region TEXT, racks INT)")
+        db.executemany(
+            "INSERT INTO site VALUES (?, ?, ?)",
+            [("fra1", "eu-central", 12), ("ams1", "eu-west", None)],
+        )
+        db.commit()
+        db.close()
+        table = SqliteTable(path, "site")
+
+        assert sorted(table.names()) == ["ams1", "fra1"]
+        assert table.load("fra1") == {"region": "eu-central", "racks": 12}
+        assert table.load("ams1") == {"region": "eu-west"}
+
+
+def test_yaml_bundle():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        (source / "includes").mkdir()
+        (source / "includes" / "ntp.yaml").write_text("[a, b]\n")
+        path = source / "os.bundle.yaml"
+        path.write_text(
+            "rhel-9:\n  ntp: !include includes/ntp.yaml\n"
+            "rhel-9-fips:\n  extends: rhel-9\n"
+            "10:\n"
+        )
+        bundle = YamlBundle(path, "os", source)
+
+        assert bundle.names() == ["rhel-9", "rhel-9-fips", "10"]
+        assert bundle.load("rhel-9") == {"ntp": ["a", "b"]}
+        assert bundle.load("10") == {}
+        assert bundle.size("rhel-9-fips") == len("rhel-9-fips:\n  extends: rhel-9\n")
+
+        path.write_text("rhel-9: [a]\n")
+        with pytest.raises(ValueError, match="not a mapping"):
+            YamlBundle(path, "os")
+
+
+def test_build_metadata_vars_tables():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        (source / "metadata" / "site").mkdir(parents=True)
+        (source / "metadata" / "site.csv").write_text(
+            "name,region,extends\nfra1,eu-central,\nfra2,,fra1\n"
+        )
+        # Files override rows of the same value
+        (source / "metadata" / "site" / "fra1.yaml").write_text("region: eu\n")
+
+        metadata = build_metadata_vars(source)
+
+        assert metadata.get_file("site", "fra2") == source / "metadata" / "site.csv"
+        assert metadata.get_table("site", "fra1") is None
+        assert metadata.lookup("site", "fra2") == {"region": "eu"}
+        assert metadata.site == {"fra1": {"region": "eu"}, "fra2": {"extends": "fra1"}}
+
+        # Bundle values override rows and are overridden by files
+        bundle = source / "metadata" / "site.bundle.yaml"
+        bundle.write_text(
+            "fra1:\n  region: bundle\nfra2:\n  region: bundle\nfra3: {}\n"
+        )
+        # Other yaml files are not metadata types
+        (source / "metadata" / "README.yaml").write_text("- notes\n")
+        metadata = build_metadata_vars(source)
+
+        assert sorted(metadata.types()) == ["site"]
+        assert metadata.get_file("site", "fra2") == bundle
+        assert metadata.lookup("site", "fra1") == {"region": "eu"}
+        assert metadata.lookup("site", "fra2") == {"region": "bundle"}
+        assert sorted(metadata.names("site")) == ["fra1", "fra2", "fra3"]
+
+
+def test_generate_hosts_table_dependency():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = Path(tmpdir)
+        (source / "hosts").mkdir()
+        (source / "metadata").mkdir()
+        table = source / "metadata" / "site.jsonl"
+        table.write_text('{"name": "fra1", "region": "eu-central"}\n')
+        (source / "hosts" / "web1.yaml").write_text("metadata:\n  site: fra1\n")
+
+        generate_hosts(source)
+        generated = source / "generated" / "web1.yaml"
+        assert yaml.safe_load(generated.read_text())["region"] == "eu-central"
+
+        time.sleep(0.01)
+        table.write_text('{"name": "fra1", "region": "eu-west"}\n')
+        stats = generate_hosts(source)
+
+        assert stats.regenerated == 1
+        assert yaml.safe_load(generated.read_text())["region"] == "eu-west"
@@ -3,8 +3,10 @@ from pathlib import Path
 
 import pytest
 import jinja2
+import yaml
 
-from invgen.templates import render_template
+from invgen.files import VaultPass
+from invgen.templates import compile_expression, render_template, render_vars
 
 
 def test_render_template():
@@ -67,3 +69,92 @@ required: {{ required }}
 
         assert "name: test-host" in result
         assert "platform: test-platform" in result
+
+
+def test_render_vars():
+    host_vars = {
+        "domain_name": "example.com",
+        "hostname": "ap01",
+        "ansible_host": "{{ hostname }}.{{ domain_name }}",
+        "dns_servers": ["1.1.1.1", "8.8.8.8"],
+        "network_interfaces": [{"name": "eth0", "dns": "{{ dns_servers }}"}],
+        "fqdn": "{{ ansible_host }}",
+        "port": "{{ 8000 + 80 }}",
+    }
+
+    rendered = render_vars(host_vars)
+
+    assert rendered["ansible_host"] == "ap01.example.com"
+    assert rendered["fqdn"] == "ap01.example.com"
+    assert rendered["network_interfaces"][0]["dns"] == ["1.1.1.1", "8.8.8.8"]
+    assert rendered["port"] == 8080
+    # Input vars are not modified
+    assert host_vars["ansible_host"] == "{{ hostname }}.{{ domain_name }}"
+
+
+def test_render_vars_leaves_runtime_expressions():
+    host_vars = {
+        "hostname": "ap01",
+        "ip": "{{ ansible_facts.default_ipv4.address }}",
+        "name": "{{ inventory_hostname }}",
+        "url": "http://{{ ip }}/",
+        "cidr": "{{ ip | ansible.utils.ipaddr('network') }}",
+        "password": VaultPass("{{ not_a_template }}"),
+    }
+
+    rendered = render_vars(host_vars)
+
+    assert rendered == host_vars
+    assert isinstance(rendered["password"], VaultPass)
+
+
+def test_render_vars_leaves_vault_references():
+    password = VaultPass("$ANSIBLE_VAULT;1.1;AES256\n6162")
+    host_vars = {
+        "user": "app",
+        "pw": password,
+        "conn": "postgres://{{ user }}:{{ pw }}@db",
+        "dsn": "{{ conn }}?sslmode=require",
+        "db": {"password": password},
+        "db_pw": "{{ db.password }}",
+        "login": "{{ user }}@db",
+    }
+
+    rendered = render_vars(host_vars)
+
+    assert rendered["conn"] == "postgres://{{ user }}:{{ pw }}@db"
+    assert rendered["dsn"] == "{{ conn }}?sslmode=require"
+    assert rendered["db_pw"] == "{{ db.password }}"
+    assert rendered["login"] == "app@db"
+    assert isinstance(rendered["pw"], VaultPass)
+
+
+def test_render_vars_copies_and_shares_containers():
+    base = {"ntp": ["a"]}
+    static = {"dns": ["1.1.1.1"]}
+    host_vars = {"base": base, "b": ["{{ base }}", "{{ base }}"], "static": static}
+
+    rendered = render_vars(host_vars)
+
+    assert rendered["b"] == [base, base]
+    # Rendered containers are copies, dumped without yaml anchors
+    assert rendered["b"][0] is not rendered["b"][1]
+    assert "&id" not in yaml.safe_dump(rendered)
+    # Containers without expressions are the same objects
+    assert rendered["base"] is base
+    assert rendered["static"] is static
+
+
+def test_render_vars_cycle():
+    with pytest.raises(ValueError, match="a -> b -> a"):
+        render_vars({"a": "{{ b }}", "b": "{{ a }}", "c": "plain"})
+
+
+def test_compile_expression_is_cached():
+    compile_expression.cache_clear()
+    first = compile_expression("{{ hostname }}.{{ domain_name }}")
+    second = compile_expression("{{ hostname }}.{{ domain_name }}")
+
+    assert first is second
+    assert first.names == {"hostname", "domain_name"}
+    assert compile_expression.cache_info().hits == 1
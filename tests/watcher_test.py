@@ -4,9 +4,14 @@ from pathlib import Path
 from unittest.mock import patch, MagicMock, call
 
 import pytest
-from watchdog.events import FileCreatedEvent
+from watchdog.events import (
+    DirModifiedEvent,
+    FileCreatedEvent,
+    FileModifiedEvent,
+)
 
-from invgen.watcher import watch_for_changes
+from invgen.rules import load_rules
+from invgen.watcher import RegenerateHandler, watch_for_changes
 
 
 @pytest.fixture
@@ -38,20 +43,16 @@ def test_watch_for_changes(
     mock_observer_instance.stop.assert_called_once()
     mock_observer_instance.join.assert_called_once()
 
-    # Check that the observer was scheduled for both directories
-    assert mock_observer_instance.schedule.call_count == 2
-    mock_observer_instance.schedule.assert_has_calls(
+    # Check that the observer was scheduled for both directories and the rules
+    schedule = mock_observer_instance.schedule
+    assert schedule.call_count == 3
+    handler = schedule.call_args_list[0][0][0]
+    assert isinstance(handler, RegenerateHandler)
+    schedule.assert_has_calls(
         [
-            call(
-                mock_observer_instance.schedule.call_args_list[0][0][0],
-                str(temp_inventory_dir / "hosts/"),
-                recursive=True,
-            ),
-            call(
-                mock_observer_instance.schedule.call_args_list[1][0][0],
-                str(temp_inventory_dir / "metadata/"),
-                recursive=True,
-            ),
+            call(handler, str(temp_inventory_dir / "hosts/"), recursive=True),
+            call(handler, str(temp_inventory_dir / "metadata/"), recursive=True),
+            call(handler, str(temp_inventory_dir), recursive=False),
         ],
         any_order=True,
     )
@@ -72,7 +73,7 @@ def test_file_event_handling(mock_observer, mock_generate_hosts, temp_inventory_
     # Test file created event
     yaml_event = FileCreatedEvent(str(temp_inventory_dir / "hosts" / "test.yaml"))
     handler._regenerate(yaml_event)
-    mock_generate_hosts.assert_called_with(temp_inventory_dir)
+    mock_generate_hosts.assert_called_with(temp_inventory_dir, None)
     mock_generate_hosts.reset_mock()
 
     # Test _should_process method
@@ -120,3 +121,78 @@ def test_debounce_mechanism(mock_time, mock_generate_hosts, temp_inventory_dir):
     handler.check_pending()
     assert mock_generate_hosts.call_count == 1
     assert handler.pending_regeneration == False
+
+
+@patch("invgen.watcher.generate_hosts")
+@patch("invgen.watcher.time")
+def test_watch_metrics(mock_time, mock_generate_hosts, temp_inventory_dir):
+    from invgen.hosts import GenerateStats
+    from invgen.watcher import RegenerateHandler
+
+    mock_generate_hosts.return_value = GenerateStats(regenerated=2, skipped=3)
+    handler = RegenerateHandler(temp_inventory_dir)
+
+    mock_time.return_value = 100.0
+    handler._schedule_regeneration(
+        FileCreatedEvent(str(temp_inventory_dir / "hosts" / "test1.yaml"))
+    )
+
+    # Two events within the debounce time are merged into one pending run
+    mock_time.return_value = 100.1
+    handler._schedule_regeneration(
+        FileCreatedEvent(str(temp_inventory_dir / "hosts" / "test2.yaml"))
+    )
+    mock_time.return_value = 100.2
+    handler._schedule_regeneration(
+        FileCreatedEvent(str(temp_inventory_dir / "hosts" / "test3.yaml"))
+    )
+    assert handler.metrics.pending_events.value == 2
+
+    mock_time.return_value = 100.7
+    handler.check_pending()
+
+    metrics = handler.metrics
+    assert metrics.events_received.value == 3
+    assert metrics.events_coalesced.value == 1
+    assert metrics.pending_events.value == 0
+    assert metrics.regenerations.value == 2
+    assert metrics.hosts_regenerated.value == 4
+    assert metrics.hosts_skipped.value == 6
+    assert metrics.event_to_output.count == 2
+    # The pending run is measured from the first pending event
+    assert metrics.event_to_output.sum == pytest.approx(0.6)
+
+    mock_generate_hosts.side_effect = ValueError("broken")
+    handler._regenerate(
+        FileCreatedEvent(str(temp_inventory_dir / "hosts" / "test1.yaml"))
+    )
+    assert metrics.regeneration_failures.value == 1
+
+
+@patch("invgen.watcher.generate_hosts")
+def test_root_events(mock_generate_hosts, temp_inventory_dir):
+    (temp_inventory_dir / "includes").mkdir()
+    (temp_inventory_dir / "shared.yaml").write_text("[db1]\n")
+    (temp_inventory_dir / "rules.yaml").write_text(
+        "- name: db\n  hosts: !include shared.yaml\n  metadata:\n    role: db\n"
+    )
+    handler = RegenerateHandler(temp_inventory_dir, export=temp_inventory_dir / "inv.yaml")
+    load_rules(temp_inventory_dir)
+
+    # Files written to the root by the watch loop itself don't regenerate
+    for event in (
+        FileModifiedEvent(str(temp_inventory_dir / "inv.yaml")),
+        FileCreatedEvent(str(temp_inventory_dir / "metrics.yaml")),
+        DirModifiedEvent(str(temp_inventory_dir)),
+        DirModifiedEvent(str(temp_inventory_dir / "hosts")),
+    ):
+        handler._schedule_regeneration(event)
+    mock_generate_hosts.assert_not_called()
+
+    # The rules and the files they include do
+    assert handler._should_process(
+        FileModifiedEvent(str(temp_inventory_dir / "rules.yaml"))
+    )
+    assert handler._should_process(
+        FileModifiedEvent(str(temp_inventory_dir / "shared.yaml"))
+    )